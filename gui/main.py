@@ -4,25 +4,49 @@ import sys
 from contextlib import suppress
 from importlib.metadata import version
 
-import geopandas as gpd
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import pyqtspinner
+import shapely
 from loguru import logger
 from matplotlib.backends.backend_qt5agg import \
     FigureCanvasQTAgg as FigureCanvas
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from matplotlib.backends.backend_qt5agg import \
+    NavigationToolbar2QT as NavigationToolbar
+from matplotlib.figure import Figure
+from PyQt5.QtCore import (QAbstractTableModel, QModelIndex, QObject,
+                          QSortFilterProxyModel, Qt, QThread, QTimer,
+                          pyqtSignal)
 from PyQt5.QtGui import QIcon, QMovie
-from PyQt5.QtWidgets import (QApplication, QDialog, QFileDialog, QLabel,
-                             QMainWindow, QMessageBox, QPushButton,
-                             QStackedLayout, QTableWidget, QTableWidgetItem,
+from PyQt5.QtWidgets import (QApplication, QComboBox, QDialog, QFileDialog,
+                             QGroupBox, QHBoxLayout, QHeaderView, QLabel,
+                             QLineEdit, QListWidget, QListWidgetItem,
+                             QMainWindow, QMessageBox, QProgressBar,
+                             QPushButton, QStackedLayout, QTableView,
                              QTabWidget, QVBoxLayout, QWidget)
 
-from geocover_qa.stat import get_lots_perimeter, get_stats_for_issues_gdb
+from geocover_qa.aggregate import ISSUE_COLUMNS, IssueIndex, compare_counts
+from geocover_qa.cache import StatsCache
+from geocover_qa.config import LOTS_IN_WORK, MAX_PLOTTED_FEATURES, QA_DIR
+from geocover_qa.export import export_table
+from geocover_qa.plot import draw_issues, map_extent, outline_collection
+from geocover_qa.reference import read_reference_layer
+from geocover_qa.stat import (ISSUE_LAYERS, CancelToken, Cancelled,
+                              get_lots_perimeter, get_stats_for_issues_gdb)
+from geocover_qa.source import find_qa_gdbs
 from geocover_qa.utils import get_mapsheets_path, map_network_drive
 
 GPKG_FILEPATH = get_mapsheets_path()
 
+# Number of rows used to size the table columns
+COLUMN_WIDTH_SAMPLE = 100
+# Number of runs before and after the selected one loaded in the background
+PREFETCH_DISTANCE = 1
+# Delay after the last pan/zoom before the issues are redrawn (ms)
+MAP_REDRAW_DELAY = 150
+# Simplification of the base layers outlines (m)
+BASE_LAYERS_TOLERANCE = 10
+
 
 class CustomFileDialog(QFileDialog):
     def __init__(self, *args, **kwargs):
@@ -38,60 +62,321 @@ class CustomFileDialog(QFileDialog):
             print("Please select a directory that ends with 'issue.gdb'")
 
 
+class DataFrameModel(QAbstractTableModel):
+    """Table model reading the cells straight from a DataFrame, formatted only when displayed."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.set_dataframe(pd.DataFrame())
+
+    def set_dataframe(self, df):
+        self.beginResetModel()
+        self.df = df
+        self.columns = [df[column].to_numpy() for column in df.columns]
+        self.order = np.arange(len(df))  # sorted DataFrame rows
+        self.mask = np.ones(len(df), dtype=bool)  # DataFrame rows passing the filter
+        self.rows = self.order  # displayed row -> DataFrame row
+        self.search_text = None  # lower case cells, built on the first filter
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        value = self.columns[index.column()][self.rows[index.row()]]
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return ""
+        return str(value)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return str(self.df.columns[section])
+        return str(section + 1)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Vectorized sort: only the display order is changed."""
+        if column < 0 or column >= len(self.columns):
+            return
+        self.layoutAboutToBeChanged.emit()
+        self.order = (
+            self.df.iloc[:, column]
+            .reset_index(drop=True)
+            .sort_values(
+                ascending=order == Qt.AscendingOrder, kind="stable", na_position="last"
+            )
+            .index.to_numpy()
+        )
+        self.rows = self.order[self.mask[self.order]]
+        self.layoutChanged.emit()
+
+    def set_filter(self, text):
+        """Keep the rows where any cell contains `text` (case insensitive)."""
+        self.beginResetModel()
+        if not text:
+            self.mask = np.ones(len(self.df), dtype=bool)
+        else:
+            if self.search_text is None:
+                self.search_text = [
+                    self.df[column].astype(str).str.lower() for column in self.df.columns
+                ]
+            text = text.lower()
+            self.mask = np.zeros(len(self.df), dtype=bool)
+            for column in self.search_text:
+                self.mask |= column.str.contains(text, regex=False, na=False).to_numpy()
+        self.rows = self.order[self.mask[self.order]]
+        self.endResetModel()
+
+
+class DataFrameProxyModel(QSortFilterProxyModel):
+    """
+    Proxy delegating sorting and filtering to the vectorized DataFrameModel.
+
+    The default implementations call back into Python for each comparison and
+    update the view row range by row range, which is too slow for large tables.
+    """
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sourceModel().sort(column, order)
+
+    def set_filter(self, text):
+        self.sourceModel().set_filter(text)
+
+
+class CheckList(QGroupBox):
+    """Titled list of checkable values, emitting `changed` when the selection changes."""
+
+    changed = pyqtSignal()
+
+    def __init__(self, title, parent=None):
+        super().__init__(title, parent)
+        self.list = QListWidget()
+        self.list.setMaximumHeight(110)
+        self.list.itemChanged.connect(lambda item: self.changed.emit())
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.list)
+
+    def set_values(self, values, checked=None):
+        """Replace the values, `checked` being the values to check (None: all)."""
+        self.list.blockSignals(True)
+        self.list.clear()
+        for value in values:
+            item = QListWidgetItem(str(value))
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            is_checked = checked is None or str(value) in checked
+            item.setCheckState(Qt.Checked if is_checked else Qt.Unchecked)
+            self.list.addItem(item)
+        self.list.blockSignals(False)
+
+    def checked_values(self):
+        return [
+            self.list.item(row).text()
+            for row in range(self.list.count())
+            if self.list.item(row).checkState() == Qt.Checked
+        ]
+
+
 class WorkerThread(QThread):
-    finished = pyqtSignal(pd.DataFrame, pd.DataFrame)
+    # Not named `finished`: QThread.finished is emitted once the thread has stopped
+    data_loaded = pyqtSignal(pd.DataFrame, pd.DataFrame, object)
     error = pyqtSignal(str)  # Signal to emit error messages
+    progress = pyqtSignal(str, int, int)  # layer, features read, total features
+    partial = pyqtSignal(str, int, int, object)  # same, with the joined chunk
+    cancelled = pyqtSignal()
 
     def __init__(self, dir_path, parent=None):
         super().__init__(parent)
         self.dir_path = dir_path
+        self.cancel_token = CancelToken()
+
+    def cancel(self):
+        self.cancel_token.cancel()
+
+    def report(self, layer, done, total, joined):
+        self.progress.emit(layer, done, total)
+        self.partial.emit(layer, done, total, joined)
 
     def run(self):
         try:
             # Call the function and process results
-            combined, stats = get_stats_for_issues_gdb(self.dir_path)
-            self.finished.emit(combined, stats)
+            combined, stats = get_stats_for_issues_gdb(
+                self.dir_path, progress=self.report, cancel=self.cancel_token
+            )
+            # Compact per-issue assignments, for the interactive selections
+            issue_index = IssueIndex(combined)
+            self.data_loaded.emit(combined, stats, issue_index)
+        except Cancelled:
+            self.cancelled.emit()
         except Exception as e:
             # Catch exceptions and emit an error signal
             error_message = f"Error while getting stats for {self.dir_path}: {str(e)}"
             self.error.emit(error_message)
 
 
+def load_issue_stats(gdb_path):
+    """Stats of an issue.gdb as cached by the workspace: combined issues, stats and index."""
+    combined, stats = get_stats_for_issues_gdb(gdb_path)
+    return combined, stats, IssueIndex(combined)
+
+
+def run_label(gdb_path):
+    """Short label of a QA run: the timestamp directory of its issue.gdb."""
+    return os.path.basename(os.path.dirname(os.path.normpath(gdb_path)))
+
+
+class RunsThread(QThread):
+    """List the QA runs (issue.gdb) of a QA name and a release."""
+
+    found = pyqtSignal(object)  # records, oldest first
+    error = pyqtSignal(str)
+
+    def __init__(self, qa_name, release, base_dir, parent=None):
+        super().__init__(parent)
+        self.qa_name = qa_name
+        self.release = release
+        self.base_dir = base_dir
+
+    def run(self):
+        try:
+            runs = find_qa_gdbs(
+                qa_name=self.qa_name, base_dir=self.base_dir, release=self.release
+            )
+            self.found.emit(sorted(runs, key=lambda run: run["date"]))
+        except Exception as e:
+            self.error.emit(f"Error while listing the runs in {self.base_dir}: {e}")
+
+
+class CacheNotifier(QObject):
+    """Brings the futures of the stats cache, done in the pool threads, back to the GUI thread."""
+
+    loaded = pyqtSignal(str, object)  # issue.gdb path, future
+    compared = pyqtSignal(str, object)
+
+
 class PlotWorkerThread(QThread):
-    plot_ready = pyqtSignal()
+    """Prepare the map data off the GUI thread; the drawing itself stays in `MapCanvas`."""
 
-    def __init__(self, dataframe, canvas, parent=None):
+    plot_ready = pyqtSignal(object, object)  # base layers (None if cached), issues
+
+    def __init__(self, dataframe, load_base_layers=True, parent=None):
         super().__init__(parent)
         self.dataframe = dataframe
-        self.plot_canvas = canvas
+        self.load_base_layers = load_base_layers
 
     def run(self):
-        ch_gdf = gpd.read_file(GPKG_FILEPATH, layer="ch")
-        ch_gdf = ch_gdf.set_crs(epsg=2056, allow_override=True)
-        lots_perimeter_gdf = get_lots_perimeter(GPKG_FILEPATH)
-        # lot_gdf = lots_perimeter[lots_perimeter["Lot"] == lot]
-
-        ax = self.plot_canvas.figure.add_subplot(111)
-        ax.clear()
-        # ax.plot([0, 1, 2, 3], [0, 1, 4, 9], label="y = x^2")
-        # ax.plot(self.data)
-        self.dataframe.plot(
-            ax=ax, alpha=0.8, facecolor="none", edgecolor="pink", linewidth=1
-        )
-        ch_gdf.plot(ax=ax, alpha=0.3, facecolor="none", edgecolor="purple", linewidth=3)
-        lots_perimeter_gdf.plot(
-            ax=ax, alpha=0.8, facecolor="none", edgecolor="pink", linewidth=3
-        )
+        base_layers = None
+        if self.load_base_layers:
+            # Read once per session, the canvas keeps them as artists
+            ch_gdf = read_reference_layer(GPKG_FILEPATH, "ch")
+            lots_perimeter_gdf = get_lots_perimeter(GPKG_FILEPATH)
+            base_layers = [
+                (
+                    ch_gdf.geometry.values,
+                    {"colors": "purple", "linewidths": 3, "alpha": 0.3},
+                ),
+                (
+                    lots_perimeter_gdf.geometry.values,
+                    {"colors": "pink", "linewidths": 3, "alpha": 0.8},
+                ),
+            ]
+
+        categories = self.dataframe["Code"].astype("category")
+        geometries = np.asarray(self.dataframe.geometry.values)
+        issues = {
+            "geometry": geometries,
+            "code": categories.cat.codes.to_numpy(),
+            "labels": list(categories.cat.categories),
+            # Spatial index, to draw only the issues in the visible extent
+            "tree": shapely.STRtree(geometries),
+        }
+        self.plot_ready.emit(base_layers, issues)
+
+
+class MapCanvas(FigureCanvas):
+    """
+    Map of the issues over the base layers, redrawn for the visible extent only.
+
+    The base layers are added once as collections and kept. After a pan or a
+    zoom, the issues in the new extent are queried from the spatial index and
+    drawn with `draw_issues` (simplified collections, or a density raster).
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(Figure())
+        self.setParent(parent)
+        self.ax = self.figure.add_subplot(111)
+        self.ax.set_aspect("equal")
+        self.has_base_layers = False
+        self.issues = None
+        self.issue_artists = []
+        self.drawing = False
+        # Redraw once the view stops changing (pan/zoom emit many limit changes)
+        self.redraw_timer = QTimer(self)
+        self.redraw_timer.setSingleShot(True)
+        self.redraw_timer.setInterval(MAP_REDRAW_DELAY)
+        self.redraw_timer.timeout.connect(self.redraw_issues)
+        self.ax.callbacks.connect("xlim_changed", self.on_limits_changed)
+        self.ax.callbacks.connect("ylim_changed", self.on_limits_changed)
+
+    def set_base_layers(self, base_layers):
+        for geometries, style in base_layers:
+            self.ax.add_collection(
+                outline_collection(
+                    geometries, tolerance=BASE_LAYERS_TOLERANCE, zorder=3, **style
+                )
+            )
+        self.has_base_layers = True
 
-        ax.set_title("Dummy Graph")
-        # ax.set_xlim(2.450e6,2.9e6 )
-        # ax.set_ylim(1.050e6, 1.35e6)
-        ax.legend()
-        self.plot_canvas.draw()
-        # plt.figure()
-        # self.dataframe.plot()
-        # plt.savefig("plot.png")  # Save plot as PNG file
-        self.plot_ready.emit()
+    def set_issues(self, issues):
+        self.issues = issues
+        bounds = shapely.total_bounds(issues["geometry"])
+        if np.isnan(bounds).any():
+            self.ax.autoscale_view()
+        else:
+            x_min, x_max, y_min, y_max = map_extent(bounds)
+            self.ax.set_xlim(x_min, x_max)
+            self.ax.set_ylim(y_min, y_max)
+        self.redraw_issues()
+
+    def on_limits_changed(self, ax):
+        if not self.drawing:
+            self.redraw_timer.start()
+
+    def redraw_issues(self):
+        for artist in self.issue_artists:
+            artist.remove()
+        self.issue_artists = []
+        if self.issues is None:
+            return
+
+        x_min, x_max = self.ax.get_xlim()
+        y_min, y_max = self.ax.get_ylim()
+        visible = self.issues["tree"].query(shapely.box(x_min, y_min, x_max, y_max))
+        visible.sort()
+
+        self.drawing = True
+        before = set(self.ax.get_children())
+        try:
+            count = draw_issues(
+                self.ax,
+                self.issues["geometry"][visible],
+                self.issues["code"][visible],
+                labels=self.issues["labels"],
+                max_features=MAX_PLOTTED_FEATURES,
+            )
+        finally:
+            self.drawing = False
+        self.issue_artists = [
+            artist for artist in self.ax.get_children() if artist not in before
+        ]
+        self.ax.set_title(f"{count} of {len(self.issues['geometry'])} issues")
+        self.draw_idle()
 
 
 class MainWindow(QMainWindow):
@@ -112,18 +397,67 @@ class MainWindow(QMainWindow):
         self.button_select.clicked.connect(lambda: self.load_directory(start_dir))
         self.layout.addWidget(self.button_select)
 
+        # Workspace: all the runs of a QA name and a release
+        self.workspace_box = QGroupBox("Workspace")
+        workspace_layout = QVBoxLayout(self.workspace_box)
+        search_layout = QHBoxLayout()
+        self.qa_name_edit = QLineEdit("Topology")
+        self.qa_name_edit.setPlaceholderText("QA name")
+        self.release_edit = QLineEdit("RC_2030-12-31")
+        self.release_edit.setPlaceholderText("Release")
+        self.button_runs = QPushButton("List runs")
+        self.button_runs.clicked.connect(self.list_runs)
+        search_layout.addWidget(self.qa_name_edit)
+        search_layout.addWidget(self.release_edit)
+        search_layout.addWidget(self.button_runs)
+        workspace_layout.addLayout(search_layout)
+        runs_layout = QHBoxLayout()
+        self.runs_list = QListWidget()
+        self.runs_list.setMaximumHeight(110)
+        self.runs_list.currentRowChanged.connect(self.select_run)
+        self.compare_combo = QComboBox()
+        self.compare_combo.addItem("Compare with...")
+        self.compare_combo.currentIndexChanged.connect(self.select_compared_run)
+        runs_layout.addWidget(self.runs_list)
+        runs_layout.addWidget(self.compare_combo)
+        workspace_layout.addLayout(runs_layout)
+        self.layout.addWidget(self.workspace_box)
+        self.base_dir = start_dir if start_dir and os.path.isdir(start_dir) else QA_DIR
+
         self.tabs = QTabWidget()
         self.table_tab = QWidget()
         self.table_layout = QVBoxLayout(self.table_tab)
 
-        self.table = QTableWidget()
+        self.selection_layout = QHBoxLayout()
+        self.group_by_list = CheckList("Group by")
+        self.group_by_list.set_values(ISSUE_COLUMNS)
+        self.lot_list = CheckList("Lots")
+        self.issue_type_list = CheckList("Issue types")
+        for check_list in (self.group_by_list, self.lot_list, self.issue_type_list):
+            check_list.changed.connect(self.update_aggregates)
+            self.selection_layout.addWidget(check_list)
+        self.table_layout.addLayout(self.selection_layout)
+
+        self.filter_edit = QLineEdit()
+        self.filter_edit.setPlaceholderText("Filter rows...")
+        self.filter_edit.textChanged.connect(self.filter_table)
+        self.table_layout.addWidget(self.filter_edit)
+
+        self.table_model = DataFrameModel()
+        self.proxy_model = DataFrameProxyModel()
+        self.proxy_model.setSourceModel(self.table_model)
+        self.table = QTableView()
+        self.table.setModel(self.proxy_model)
         self.table.setSortingEnabled(True)
+        # Fixed row heights: no per-row size computation
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
         self.table_layout.addWidget(self.table)
 
         self.plot_tab = QWidget()
         self.plot_layout = QVBoxLayout(self.plot_tab)
-        # self.plot_widget = QLabel('Plot will appear here')
-        self.plot_canvas = FigureCanvas(plt.figure())
+        self.plot_canvas = MapCanvas()
+        self.plot_layout.addWidget(NavigationToolbar(self.plot_canvas, self.plot_tab))
         self.plot_layout.addWidget(self.plot_canvas)
 
         self.tabs.addTab(self.table_tab, "Data Table")
@@ -133,6 +467,19 @@ class MainWindow(QMainWindow):
         self.spinner = pyqtspinner.WaitingSpinner(self)
         self.layout.addWidget(self.spinner)
 
+        self.progress_layout = QHBoxLayout()
+        self.progress_label = QLabel()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100 * len(ISSUE_LAYERS))
+        self.progress_bar.setFormat("%p%")
+        self.button_cancel = QPushButton("Cancel")
+        self.button_cancel.clicked.connect(self.cancel_loading)
+        self.button_cancel.setDisabled(True)  # Enabled while loading
+        self.progress_layout.addWidget(self.progress_label)
+        self.progress_layout.addWidget(self.progress_bar)
+        self.progress_layout.addWidget(self.button_cancel)
+        self.layout.addLayout(self.progress_layout)
+
         self.button_save = QPushButton("Save as Excel")
         self.button_save.clicked.connect(self.save_as_excel)
         self.button_save.setDisabled(True)  # Disabled until data is loaded
@@ -145,6 +492,20 @@ class MainWindow(QMainWindow):
 
         self.dataframe = None  # To store the DataFrame
         self.data = None
+        self.issue_index = None
+        self.worker = None
+        self.cancelled_workers = []  # Kept alive until they stop
+        self.partial_chunks = []
+        self.current_path = None
+        self.runs = []
+        self.runs_thread = None
+        self.compare_path = None
+        self.compare_index = None
+        # Stats of the runs already loaded or prefetched, by issue.gdb path
+        self.stats_cache = StatsCache(load_issue_stats)
+        self.cache_notifier = CacheNotifier()
+        self.cache_notifier.loaded.connect(self.on_cached_run_loaded)
+        self.cache_notifier.compared.connect(self.on_compared_run_loaded)
 
         # Load directory if provided in command line arguments
         if gdb_path and gdb_path.endswith(".gdb"):
@@ -158,60 +519,266 @@ class MainWindow(QMainWindow):
             self.load_directory_from_path(dir_path)
 
     def load_directory_from_path(self, dir_path):
+        # Abort a load still running: its results are not wanted anymore
+        self.cancel_loading()
+        self.current_path = dir_path
+
+        cached = self.stats_cache.get(dir_path)
+        if cached is not None:
+            self.show_stats(*cached)
+            return
+
         self.spinner.start()
+        if self.stats_cache.is_loading(dir_path):
+            # Being prefetched: wait for it rather than reading it twice
+            self.progress_label.setText(f"Loading {dir_path} (prefetched)")
+            self.stats_cache.load(dir_path).add_done_callback(
+                lambda future: self.cache_notifier.loaded.emit(dir_path, future)
+            )
+            return
+
+        self.partial_chunks = []
+        self.progress_bar.setValue(0)
+        self.progress_label.setText(f"Loading {dir_path}")
+        self.button_cancel.setEnabled(True)
         self.worker = WorkerThread(dir_path)
-        self.worker.finished.connect(self.on_data_loaded)
+        self.worker.data_loaded.connect(self.on_data_loaded)
         self.worker.error.connect(self.on_data_error)
+        self.worker.progress.connect(self.on_progress)
+        self.worker.partial.connect(self.on_partial)
+        self.worker.cancelled.connect(self.on_cancelled)
         self.worker.start()
 
-    def on_data_loaded(self, combined, df):
-        self.dataframe = df  # Store the DataFrame
-        self.data = combined
-        self.table.setRowCount(df.shape[0])
-        self.table.setColumnCount(df.shape[1])
-        self.table.setHorizontalHeaderLabels(df.columns)
+    def cancel_loading(self):
+        worker = self.worker
+        if worker is None or not worker.isRunning():
+            return
+        for signal in (
+            worker.data_loaded,
+            worker.error,
+            worker.progress,
+            worker.partial,
+            worker.cancelled,
+        ):
+            signal.disconnect()
+        worker.cancel()
+        self.cancelled_workers.append(worker)
+        # Released once its thread has stopped, however it ended
+        worker.finished.connect(lambda: self.release_worker(worker))
+        self.worker = None
+        self.on_cancelled()
+
+    def release_worker(self, worker):
+        self.cancelled_workers.remove(worker)
+        worker.deleteLater()
+
+    def on_cancelled(self):
+        self.spinner.stop()
+        self.button_cancel.setDisabled(True)
+        self.progress_label.setText("Loading cancelled")
+
+    def on_progress(self, layer, done, total):
+        layer_index = ISSUE_LAYERS.index(layer)
+        percent = 100 * done // total if total else 100
+        self.progress_bar.setValue(100 * layer_index + percent)
+        self.progress_label.setText(f"{layer}: {done}/{total}")
+
+    def on_partial(self, layer, done, total, joined):
+        """Show the stats of the issues read so far, at the end of each layer."""
+        self.partial_chunks.append(joined)
+        if done < total:
+            return
+        self.issue_index = IssueIndex(pd.concat(self.partial_chunks, ignore_index=True))
+        self.refresh_selections()
+
+    def on_data_loaded(self, combined, df, issue_index):
+        self.stats_cache.put(self.current_path, (combined, df, issue_index))
+        self.show_stats(combined, df, issue_index)
+
+    def on_cached_run_loaded(self, gdb_path, future):
+        if gdb_path != self.current_path:
+            return  # Another run was selected meanwhile
+        if future.exception() is not None:
+            self.on_data_error(
+                f"Error while getting stats for {gdb_path}: {future.exception()}"
+            )
+            return
+        self.show_stats(*future.result())
 
-        for i in range(df.shape[0]):
-            for j in range(df.shape[1]):
-                self.table.setItem(i, j, QTableWidgetItem(str(df.iat[i, j])))
+    def show_stats(self, combined, df, issue_index):
+        self.data = combined
+        self.issue_index = issue_index
+        self.partial_chunks = []
+        self.refresh_selections()
 
-        # Resize columns to fit contents
-        self.table.resizeColumnsToContents()
         self.button_save.setEnabled(True)  # Enable save button
         self.button_plot.setEnabled(True)
+        self.button_cancel.setDisabled(True)
+        self.progress_bar.setValue(self.progress_bar.maximum())
+        self.progress_label.setText(f"{len(combined)} issues")
         self.spinner.stop()
 
+    def refresh_selections(self):
+        """Fill the lots and issue types from the issue index, keeping the user choices."""
+        if self.lot_list.list.count():
+            lots = self.lot_list.checked_values()
+        else:
+            lots = [lot.strip() for lot in LOTS_IN_WORK.split(",")]
+        issue_types = self.issue_type_list.checked_values() or None
+        self.lot_list.set_values(self.issue_index.values("Lot"), checked=lots)
+        self.issue_type_list.set_values(
+            self.issue_index.values("IssueType"), checked=issue_types
+        )
+        self.update_aggregates()
+
+    def update_aggregates(self):
+        """Recompute the table from the issue index for the current selections."""
+        if self.issue_index is None:
+            return
+        group_by = self.group_by_list.checked_values()
+        selections = {
+            "Lot": self.lot_list.checked_values(),
+            "IssueType": self.issue_type_list.checked_values(),
+        }
+        df = self.issue_index.aggregate(group_by, **selections)
+        if self.compare_index is not None:
+            df = compare_counts(
+                df,
+                self.compare_index.aggregate(group_by, **selections),
+                group_by,
+                labels=(run_label(self.current_path), run_label(self.compare_path)),
+            )
+        self.dataframe = df  # Store the DataFrame
+        self.table_model.set_dataframe(df)
+        self.proxy_model.set_filter(self.filter_edit.text())
+
+        # Resize columns to fit contents
+        self.resize_columns(df)
+
+    def resize_columns(self, df):
+        """Size the columns from a sample of rows instead of every cell."""
+        metrics = self.table.fontMetrics()
+        sample = df.head(COLUMN_WIDTH_SAMPLE)
+        for col, column in enumerate(df.columns):
+            texts = [str(column)] + [str(value) for value in sample[column]]
+            width = max(metrics.horizontalAdvance(text) for text in texts)
+            self.table.setColumnWidth(col, min(width + 24, 400))
+
+    def list_runs(self):
+        self.spinner.start()
+        self.button_runs.setDisabled(True)
+        self.runs_thread = RunsThread(
+            self.qa_name_edit.text().strip(),
+            self.release_edit.text().strip(),
+            self.base_dir,
+        )
+        self.runs_thread.found.connect(self.on_runs_found)
+        self.runs_thread.error.connect(self.on_data_error)
+        self.runs_thread.finished.connect(lambda: self.button_runs.setEnabled(True))
+        self.runs_thread.start()
+
+    def on_runs_found(self, runs):
+        self.spinner.stop()
+        self.runs = runs
+        labels = [f"{run['date']:%Y-%m-%d %H:%M}  {run['RC']}" for run in runs]
+        self.runs_list.blockSignals(True)
+        self.runs_list.clear()
+        self.runs_list.addItems(labels)
+        self.runs_list.blockSignals(False)
+        self.compare_combo.blockSignals(True)
+        self.compare_combo.clear()
+        self.compare_combo.addItem("Compare with...")
+        self.compare_combo.addItems(labels)
+        self.compare_combo.blockSignals(False)
+        self.progress_label.setText(f"{len(runs)} runs found")
+        if runs:
+            self.runs_list.setCurrentRow(len(runs) - 1)  # Last run
+
+    def select_run(self, row):
+        if not 0 <= row < len(self.runs):
+            return
+        self.load_directory_from_path(self.runs[row]["file_path"])
+        # Stepping to the previous or next night is then instant
+        neighbours = range(row - PREFETCH_DISTANCE, row + PREFETCH_DISTANCE + 1)
+        self.stats_cache.prefetch(
+            self.runs[i]["file_path"]
+            for i in neighbours
+            if i != row and 0 <= i < len(self.runs)
+        )
+
+    def select_compared_run(self, index):
+        row = index - 1  # First item: no comparison
+        self.compare_index = None
+        self.compare_path = None
+        if 0 <= row < len(self.runs):
+            self.compare_path = self.runs[row]["file_path"]
+            compare_path = self.compare_path
+            self.stats_cache.load(compare_path).add_done_callback(
+                lambda future: self.cache_notifier.compared.emit(compare_path, future)
+            )
+        self.update_aggregates()
+
+    def on_compared_run_loaded(self, gdb_path, future):
+        if gdb_path != self.compare_path:
+            return
+        if future.exception() is not None:
+            self.on_data_error(
+                f"Error while getting stats for {gdb_path}: {future.exception()}"
+            )
+            return
+        self.compare_index = future.result()[2]
+        self.update_aggregates()
+
+    def closeEvent(self, event):
+        self.stats_cache.shutdown()
+        super().closeEvent(event)
+
+    def filter_table(self, text):
+        self.proxy_model.set_filter(text)
+
     def on_data_error(self, error_message):
         # Handle errors (e.g., show a message box)
         self.spinner.stop()
+        self.button_cancel.setDisabled(True)
         QMessageBox.critical(self, "Error", error_message)
         print(f"Error: {error_message}")
 
     def save_as_excel(self):
         if self.dataframe is not None:
             options = QFileDialog.Options()
-            file_path, _ = QFileDialog.getSaveFileName(
+            file_path, selected_filter = QFileDialog.getSaveFileName(
                 self,
                 "Save as Excel File",
                 "",
-                "Excel Files (*.xlsx);;All Files (*)",
+                "Excel Files (*.xlsx);;CSV Files (*.csv);;Parquet Files (*.parquet)",
                 options=options,
             )
 
             if file_path:
-                self.dataframe.to_excel(file_path, index=False)
-                print(f"Data saved to {file_path}")
+                if not os.path.splitext(file_path)[1]:
+                    # Extension of the selected filter, e.g. "CSV Files (*.csv)"
+                    file_path += selected_filter.split("*")[-1].rstrip(")")
+                try:
+                    export_table(self.dataframe, file_path)
+                except (ValueError, OSError) as e:
+                    QMessageBox.critical(self, "Error", f"Cannot save {file_path}: {e}")
+                    return
+                logger.info(f"Data saved to {file_path}")
 
     def plot_data(self):
         if self.data is not None:
             self.spinner.start()
-            self.plot_worker = PlotWorkerThread(self.data, self.plot_canvas)
+            self.plot_worker = PlotWorkerThread(
+                self.data, load_base_layers=not self.plot_canvas.has_base_layers
+            )
             self.plot_worker.plot_ready.connect(self.on_plot_ready)
             self.plot_worker.start()
 
-    def on_plot_ready(self):
-        # pixmap = QPixmap("plot.png")
-        # self.plot_widget.setPixmap(pixmap)
+    def on_plot_ready(self, base_layers, issues):
+        # Matplotlib is only used from the GUI thread
+        if base_layers is not None:
+            self.plot_canvas.set_base_layers(base_layers)
+        self.plot_canvas.set_issues(issues)
         self.tabs.setCurrentIndex(1)  # Switch to plot tab
         self.spinner.stop()
 
@@ -18,6 +18,7 @@ setup(
         "geocover_qa": [
             "data/*.gpkg",
             "data/*.json",
+            "data/*.pickle",
         ],  # Include all .gpkg and .json files in data directory
     },
     include_package_data=True,  # This tells setuptools to read MANIFEST.in
@@ -27,11 +28,13 @@ setup(
         "fiona",
         "gdal",
         "openpyxl",
+        "xlsxwriter",
         "matplotlib",
         "pyqt",
         "pandas",
         "numpy",
         "loguru",
+        "pyarrow",
     ],
     extras_require={
         "gui": [
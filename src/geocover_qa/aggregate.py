@@ -0,0 +1,314 @@
+import numpy as np
+import pandas as pd
+
+from geocover_qa.dimensions import to_label
+
+# Columns of the per-issue assignments which can be grouped by or filtered on
+ISSUE_COLUMNS = [
+    "Lot",
+    "Sheet",
+    "IssueType",
+    "Code",
+    "CodeDescription",
+    "QualityCondition",
+]
+
+
+def to_labels(series):
+    """Convert a column to string labels (see `to_label`), '' for missing values."""
+    return series.map(lambda value: to_label(value) or "")
+
+
+def encode(series):
+    """
+    Encode a column as integer codes of its labels (see `to_labels`).
+
+    Only the distinct values are converted to labels, not every row.
+
+    :return: Tuple of the codes (int32) and the array of the labels.
+    """
+    # Coded columns (see geocover_qa.dimensions) only keep the labels present
+    categorical = pd.Categorical(series).remove_unused_categories()
+    # Missing values (code -1) get the last slot, labelled ''
+    labels = to_labels(pd.Series(categorical.categories, dtype=object)).tolist() + [""]
+    categories, inverse = np.unique(np.asarray(labels, dtype=object), return_inverse=True)
+    codes = inverse.astype(np.int32)[categorical.codes]
+    return codes, categories
+
+
+class IssueIndex:
+    """
+    Compact, indexed form of the per-issue assignments of a QA run.
+
+    Each column is kept as categorical codes, so the issue counts for any
+    group-by columns and any selection of values are computed with numpy in
+    milliseconds, without reading the GDB again.
+
+        index = IssueIndex(combined_issues)
+        index.aggregate(["Lot", "IssueType"], Lot=["1", "2"], IssueType=["Error"])
+    """
+
+    def __init__(self, issues, columns=ISSUE_COLUMNS):
+        issues = issues.rename(columns={"MSH_MAP_TITLE": "Sheet"})
+        self.columns = [column for column in columns if column in issues.columns]
+        self.codes = {}
+        self.categories = {}
+        for column in self.columns:
+            self.codes[column], self.categories[column] = encode(issues[column])
+        self.size = len(issues)
+        # Group keys already computed, by tuple of group-by columns
+        self.group_keys = {}
+
+    def values(self, column):
+        """Distinct values of a column."""
+        return list(self.categories[column])
+
+    def mask(self, **selections):
+        """Boolean mask of the issues whose values are in the selections (None: no filter)."""
+        mask = np.ones(self.size, dtype=bool)
+        for column, selected in selections.items():
+            if selected is None:
+                continue
+            selected = {str(value) for value in selected}
+            wanted = np.array(
+                [value in selected for value in self.categories[column]], dtype=bool
+            )
+            mask &= wanted[self.codes[column]]
+        return mask
+
+    def keys(self, group_by):
+        """Integer key of the group of each issue, for the given group-by columns."""
+        group_by = tuple(group_by)
+        if group_by not in self.group_keys:
+            keys = np.zeros(self.size, dtype=np.int64)
+            for column in group_by:
+                keys = keys * len(self.categories[column]) + self.codes[column]
+            self.group_keys[group_by] = keys
+        return self.group_keys[group_by]
+
+    def aggregate(self, group_by, count_column="IssueCount", **selections):
+        """
+        Count the issues by group, as `groupby(group_by).size()` would.
+
+        :param group_by: List of columns to group by.
+        :param count_column: Name of the count column.
+        :param selections: Column=list of values to keep, e.g. Lot=["1", "2"].
+        :return: DataFrame with the group-by columns and the count column.
+        """
+        group_by = [column for column in group_by if column in self.categories]
+        mask = self.mask(**selections)
+        if not group_by:
+            return pd.DataFrame({count_column: [int(mask.sum())]})
+
+        keys, counts = np.unique(self.keys(group_by)[mask], return_counts=True)
+        result = {}
+        for column in reversed(group_by):
+            size = len(self.categories[column])
+            result[column] = self.categories[column][keys % size]
+            keys = keys // size
+        result = pd.DataFrame({column: result[column] for column in group_by})
+        result[count_column] = counts
+
+        return result
+
+
+def compare_counts(
+    counts, other_counts, group_by, count_column="IssueCount", labels=("A", "B")
+):
+    """
+    Put side by side the issue counts of two runs, as returned by `IssueIndex.aggregate`.
+
+    Groups missing in one of the runs count 0. The `Difference` column is the
+    count of the second run minus the count of the first one.
+
+    :param counts: Counts of the first run.
+    :param other_counts: Counts of the second run, for the same group-by columns.
+    :param group_by: Group-by columns.
+    :param count_column: Name of the count column of both tables.
+    :param labels: Labels of the runs, appended to the count column names.
+    :return: DataFrame with the group-by columns, both counts and their difference.
+    """
+    group_by = [column for column in group_by if column in counts.columns]
+    columns = [f"{count_column} {label}" for label in labels]
+    left = counts.rename(columns={count_column: columns[0]})
+    right = other_counts.rename(columns={count_column: columns[1]})
+    if group_by:
+        result = left.merge(right, on=group_by, how="outer", sort=True)
+    else:
+        result = pd.concat([left, right], axis=1)
+    result[columns] = result[columns].fillna(0).astype(np.int64)
+    result["Difference"] = result[columns[1]] - result[columns[0]]
+
+    return result
+
+
+def sort_key(value):
+    """Sort numbers before strings, and missing values last, e.g. lots 1, 2, 10, 'CH'."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return (2, "")
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return (0, value)
+    if isinstance(value, str) and value.isdigit():
+        # Lot labels, see geocover_qa.dimensions
+        return (0, int(value))
+    return (1, str(value))
+
+
+class StatsAccumulator:
+    """
+    Issue counts of many QA runs, folded in one run at a time.
+
+    Groups (tuples of group-by values) get integer ids as they appear. The
+    accumulator keeps the running total of each group and, as a sparse
+    date x group matrix in COO form, the count of each group at each date.
+    The matrix keeps one (date, group, count) triplet per row of each run
+    added: a few integers per row, instead of the DataFrames of the runs.
+
+        accumulator = StatsAccumulator(STATS_GROUP_BY)
+        for date, stats in runs:
+            accumulator.add(date, stats)
+        accumulator.pivot(["Lot", "IssueType"])
+    """
+
+    def __init__(self, group_by, count_column="IssueCount"):
+        self.group_by = list(group_by)
+        self.count_column = count_column
+        # Per column: label -> code, and the labels by code
+        self.vocabularies = {column: {} for column in self.group_by}
+        self.labels = {column: [] for column in self.group_by}
+        # Codes of the groups, one row per group id, and their index
+        self.group_codes = np.zeros((0, len(self.group_by)), dtype=np.int32)
+        self.groups = pd.MultiIndex.from_arrays(list(self.group_codes.T))
+        self.totals = np.zeros(0, dtype=np.int64)
+        self.dates = []
+        # COO triplets of the date x group matrix, one array per run
+        self.rows, self.columns, self.counts = [], [], []
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def group_count(self):
+        return len(self.group_codes)
+
+    def encode_column(self, column, values):
+        """Codes of the values of a column, new values being added to the vocabulary."""
+        vocabulary, labels = self.vocabularies[column], self.labels[column]
+        inverse, uniques = pd.factorize(pd.Series(values), use_na_sentinel=False)
+        unique_codes = np.empty(len(uniques), dtype=np.int32)
+        for i, value in enumerate(uniques):
+            value = None if pd.isna(value) else value
+            if value not in vocabulary:
+                vocabulary[value] = len(labels)
+                labels.append(value)
+            unique_codes[i] = vocabulary[value]
+        return unique_codes[inverse]
+
+    def add(self, date, stats):
+        """
+        Fold the grouped counts of a run into the totals and the matrix.
+
+        :param date: Date of the run.
+        :param stats: DataFrame with the group-by columns and the count column.
+        """
+        keys = pd.MultiIndex.from_arrays(
+            [self.encode_column(column, stats[column]) for column in self.group_by]
+        )
+        group_ids = self.groups.get_indexer(keys).astype(np.int64)
+        new = group_ids < 0
+        if new.any():
+            new_ids, new_keys = pd.factorize(keys[new])
+            group_ids[new] = self.group_count + new_ids
+            new_codes = np.column_stack(
+                [new_keys.get_level_values(i) for i in range(len(self.group_by))]
+            )
+            self.group_codes = np.concatenate(
+                [self.group_codes, new_codes.astype(np.int32)]
+            )
+            self.groups = self.groups.append(new_keys)
+
+        counts = stats[self.count_column].to_numpy(dtype=np.int64)
+        if self.group_count > len(self.totals):
+            self.totals = np.concatenate(
+                [self.totals, np.zeros(self.group_count - len(self.totals), np.int64)]
+            )
+        np.add.at(self.totals, group_ids, counts)
+
+        self.rows.append(np.full(len(group_ids), len(self.dates), dtype=np.int32))
+        self.columns.append(group_ids.astype(np.int32))
+        self.counts.append(counts)
+        self.dates.append(date)
+
+    def coo(self):
+        """The date x group matrix as (row, column, count) arrays."""
+        if not self.dates:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty
+        return (
+            np.concatenate(self.rows),
+            np.concatenate(self.columns),
+            np.concatenate(self.counts),
+        )
+
+    def group_frame(self, columns=None):
+        """Labels of the groups, one row per group id."""
+        columns = self.group_by if columns is None else columns
+        return pd.DataFrame(
+            {
+                column: np.array(self.labels[column], dtype=object)[
+                    self.group_codes[:, self.group_by.index(column)]
+                ]
+                for column in columns
+            }
+        )
+
+    def total_frame(self):
+        """Counts of each group summed over all the runs."""
+        result = self.group_frame()
+        result[self.count_column] = self.totals
+        return result
+
+    def frame(self, date_index):
+        """Grouped counts of a single run, as it was added."""
+        result = self.group_frame().iloc[self.columns[date_index]]
+        result = result.reset_index(drop=True)
+        result[self.count_column] = self.counts[date_index]
+        return result
+
+    def entries(self):
+        """The runs as the {"date", "stats"} dicts of `export_stats_range`."""
+        for date_index, date in enumerate(self.dates):
+            yield {"date": date, "stats": self.frame(date_index)}
+
+    def pivot(self, columns):
+        """
+        Counts by date and by group of `columns`, as `pivot_table(aggfunc="sum")`.
+
+        :param columns: Subset of the group-by columns.
+        :return: DataFrame indexed by date (sorted), one column per group.
+        """
+        columns = list(columns)
+        labels = self.group_frame(columns)
+        # Groups of the subset: distinct label tuples, sorted
+        subsets = (
+            labels.drop_duplicates()
+            .sort_values(columns, key=lambda values: values.map(sort_key))
+            .reset_index(drop=True)
+        )
+        subset_ids = labels.merge(
+            subsets.reset_index(), on=columns, how="left", sort=False
+        )["index"].to_numpy()
+
+        rows, group_ids, counts = self.coo()
+        date_order = np.argsort(np.array(self.dates, dtype="datetime64[ns]"))
+        date_rank = np.empty(len(self.dates), dtype=np.int64)
+        date_rank[date_order] = np.arange(len(self.dates))
+
+        matrix = np.zeros((len(self.dates), len(subsets)), dtype=np.int64)
+        np.add.at(matrix, (date_rank[rows], subset_ids[group_ids]), counts)
+
+        return pd.DataFrame(
+            matrix,
+            index=pd.Index(np.array(self.dates)[date_order], name="date"),
+            columns=pd.MultiIndex.from_frame(subsets),
+        )
@@ -0,0 +1,312 @@
+"""
+Content-addressed archive of issue.gdb snapshots.
+
+Nightly issue.gdb are mostly identical from one night to the next: the
+same system tables, often the same issue tables. Instead of one full zip
+per night, files are split into content-defined chunks, stored once by
+their SHA-256 and compressed, and each run keeps a manifest of its files
+as lists of chunks:
+
+    <archive>/chunks/3f/3fa9...e1      zlib compressed chunk
+    <archive>/runs/<name>.json         files of a run, with their chunks
+
+Chunk boundaries depend on the content only (gear rolling hash): bytes
+inserted in a table only change the chunks around them.
+
+    archive_gdb("/backup/qa_archive", gdb_path, "Topology_RC_2030-12-31_20241207_03-01-10")
+    restore_zip("/backup/qa_archive", "Topology_RC_2030-12-31_20241207_03-01-10", "issue.gdb.zip")
+"""
+
+import hashlib
+import json
+import os
+import zipfile
+import zlib
+from datetime import datetime
+
+import numpy as np
+from loguru import logger
+
+from geocover_qa.utils import parse_qa_paths
+
+CHUNKS_DIRNAME = "chunks"
+RUNS_DIRNAME = "runs"
+# Chunk sizes: boundaries where the top CHUNK_BITS bits of the hash are 0,
+# i.e. 64 KiB chunks on average, between 16 KiB and 256 KiB
+CHUNK_BITS = 16
+CHUNK_MIN_SIZE = 16 * 1024
+CHUNK_MAX_SIZE = 256 * 1024
+# Bytes read (and hashed) at once
+CHUNK_READ_SIZE = 8 * 1024 * 1024
+COMPRESSION_LEVEL = 6
+# Number of bytes covered by the rolling hash
+GEAR_WINDOW = 32
+
+# Random 32-bit value of each byte, derived from SHA-256 to stay the same everywhere
+GEAR = np.array(
+    [
+        int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], "little")
+        for i in range(256)
+    ],
+    dtype=np.uint32,
+)
+CHUNK_MASK = np.uint32(((1 << CHUNK_BITS) - 1) << (32 - CHUNK_BITS))
+
+
+def gear_hashes(data):
+    """
+    Gear hash of the GEAR_WINDOW bytes ending at each position of `data`.
+
+    h(i) = sum(GEAR[data[i - k]] << k for k < GEAR_WINDOW), computed for all
+    the positions at once by doubling the window: log2(GEAR_WINDOW) passes.
+    """
+    hashes = GEAR[data]
+    width = 1
+    while width < GEAR_WINDOW:
+        hashes[width:] = hashes[width:] + (hashes[:-width] << np.uint32(width))
+        width *= 2
+    return hashes
+
+
+def content_chunks(
+    f,
+    min_size=CHUNK_MIN_SIZE,
+    max_size=CHUNK_MAX_SIZE,
+    read_size=CHUNK_READ_SIZE,
+):
+    """
+    Split a binary stream into content-defined chunks.
+
+    :return: Generator of the chunks (bytes).
+    """
+    buffer = bytearray()
+    context = b""  # Bytes before the block, completing the window of its first hashes
+    while True:
+        block = f.read(read_size)
+        if not block:
+            break
+        data = np.frombuffer(context + block, dtype=np.uint8)
+        cuts = np.flatnonzero((gear_hashes(data.copy()) & CHUNK_MASK) == 0)
+        # Cut after the matching positions, as offsets in the buffer
+        cuts = cuts - len(context) + len(buffer) + 1
+        context = bytes(data[-(GEAR_WINDOW - 1) :])
+        buffer += block
+
+        start = 0
+        for cut in cuts:
+            while cut - start > max_size:
+                yield bytes(buffer[start : start + max_size])
+                start += max_size
+            if cut - start >= min_size:
+                yield bytes(buffer[start:cut])
+                start = cut
+        while len(buffer) - start > max_size:
+            yield bytes(buffer[start : start + max_size])
+            start += max_size
+        del buffer[:start]
+
+    if buffer:
+        yield bytes(buffer)
+
+
+class ChunkStore:
+    """Compressed chunks stored once, by their SHA-256."""
+
+    def __init__(self, archive_dir):
+        self.root = os.path.join(archive_dir, CHUNKS_DIRNAME)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def __contains__(self, digest):
+        return os.path.isfile(self.path(digest))
+
+    def put(self, data):
+        """
+        Store a chunk if not stored yet.
+
+        :return: Tuple of its SHA-256 and the number of bytes written (0 if known).
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.isfile(path):
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(data, COMPRESSION_LEVEL)
+        # Written aside then renamed: a stored chunk is always complete
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp_path, path)
+        return digest, len(compressed)
+
+    def get(self, digest):
+        """Content of a chunk, checked against its SHA-256."""
+        with open(self.path(digest), "rb") as f:
+            data = zlib.decompress(f.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Corrupted chunk {digest}")
+        return data
+
+
+def run_manifest_path(archive_dir, name):
+    return os.path.join(archive_dir, RUNS_DIRNAME, f"{name}.json")
+
+
+def run_name(gdb_path):
+    """Name of the run of an issue.gdb: <QA>_<RC>_<timestamp>, else its directory name."""
+    catalog = parse_qa_paths([gdb_path])
+    qa, rc, timestamp = catalog.iloc[0][["QA", "RC", "timestamp"]]
+    if isinstance(qa, str) and isinstance(rc, str) and isinstance(timestamp, str):
+        return f"{qa}_{rc}_{timestamp}"
+    return os.path.basename(os.path.dirname(os.path.abspath(gdb_path)))
+
+
+def list_runs(archive_dir):
+    """Names of the archived runs, sorted."""
+    runs_dir = os.path.join(archive_dir, RUNS_DIRNAME)
+    if not os.path.isdir(runs_dir):
+        return []
+    return sorted(
+        name[: -len(".json")] for name in os.listdir(runs_dir) if name.endswith(".json")
+    )
+
+
+def read_run(archive_dir, name):
+    with open(run_manifest_path(archive_dir, name)) as f:
+        return json.load(f)
+
+
+def archive_gdb(archive_dir, gdb_path, name=None):
+    """
+    Archive the files of an issue.gdb, storing only the chunks not stored yet.
+
+    :param archive_dir: Root directory of the archive.
+    :param gdb_path: Path of the issue.gdb directory.
+    :param name: Name of the run (default: see `run_name`).
+    :return: The run manifest, with the total and the newly stored sizes.
+    """
+    if name is None:
+        name = run_name(gdb_path)
+    store = ChunkStore(archive_dir)
+    root = os.path.dirname(os.path.abspath(gdb_path))
+
+    files = []
+    total_size, stored_size = 0, 0
+    for dirpath, _, filenames in os.walk(gdb_path):
+        for filename in sorted(filenames):
+            file_path = os.path.join(dirpath, filename)
+            file_hash = hashlib.sha256()
+            chunks = []
+            with open(file_path, "rb") as f:
+                for chunk in content_chunks(f):
+                    file_hash.update(chunk)
+                    digest, written = store.put(chunk)
+                    chunks.append(digest)
+                    stored_size += written
+            size = os.path.getsize(file_path)
+            total_size += size
+            files.append(
+                {
+                    # Relative to the parent of the gdb, as in the zips: issue.gdb/...
+                    "path": os.path.relpath(file_path, root).replace(os.sep, "/"),
+                    "size": size,
+                    "mtime": os.path.getmtime(file_path),
+                    "sha256": file_hash.hexdigest(),
+                    "chunks": chunks,
+                }
+            )
+
+    manifest = {
+        "name": name,
+        "source": os.path.abspath(gdb_path),
+        "archived": datetime.now().isoformat(timespec="seconds"),
+        "size": total_size,
+        "stored": stored_size,
+        "files": files,
+    }
+    path = run_manifest_path(archive_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+    logger.info(
+        f"Archived {name}: {len(files)} files, {total_size} bytes, "
+        f"{stored_size} bytes stored"
+    )
+
+    return manifest
+
+
+def read_file(store, entry):
+    """Content of an archived file, checked against its SHA-256."""
+    data = b"".join(store.get(digest) for digest in entry["chunks"])
+    if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+        raise ValueError(f"Corrupted file {entry['path']}")
+    return data
+
+
+def restore_gdb(archive_dir, name, output_dir):
+    """
+    Rebuild the issue.gdb of a run below `output_dir`.
+
+    :return: Path of the restored gdb directory.
+    """
+    store = ChunkStore(archive_dir)
+    manifest = read_run(archive_dir, name)
+    for entry in manifest["files"]:
+        path = os.path.join(output_dir, *entry["path"].split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(read_file(store, entry))
+        os.utime(path, (entry["mtime"], entry["mtime"]))
+    gdb_dir = manifest["files"][0]["path"].split("/")[0] if manifest["files"] else ""
+    logger.info(f"Restored {name} into {output_dir}")
+
+    return os.path.join(output_dir, gdb_dir)
+
+
+def restore_zip(archive_dir, name, zip_path):
+    """Rebuild the run as a zip, laid out as `zip_gdb_directories_2` does."""
+    store = ChunkStore(archive_dir)
+    manifest = read_run(archive_dir, name)
+    os.makedirs(os.path.dirname(os.path.abspath(zip_path)), exist_ok=True)
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for entry in manifest["files"]:
+            info = zipfile.ZipInfo(
+                entry["path"], datetime.fromtimestamp(entry["mtime"]).timetuple()[:6]
+            )
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zipf.writestr(info, read_file(store, entry))
+    logger.info(f"Restored {name} into {zip_path}")
+
+    return zip_path
+
+
+def archive_qa_gdbs(archive_dir, base_dir):
+    """
+    Archive the issue.gdb below `base_dir` not archived yet.
+
+    :return: Manifests of the newly archived runs.
+    """
+    archived = set(list_runs(archive_dir))
+    manifests = []
+    for root, dirs, _ in os.walk(base_dir):
+        if "issue.gdb" in dirs:
+            gdb_path = os.path.join(root, "issue.gdb")
+            name = run_name(gdb_path)
+            if name in archived:
+                logger.debug(f"{name} already archived")
+            else:
+                manifests.append(archive_gdb(archive_dir, gdb_path, name))
+        # Do not walk into the gdb directories
+        dirs[:] = [d for d in dirs if not d.endswith(".gdb")]
+
+    total = sum(manifest["size"] for manifest in manifests)
+    stored = sum(manifest["stored"] for manifest in manifests)
+    if manifests:
+        logger.info(
+            f"Archived {len(manifests)} runs: {total} bytes, {stored} bytes stored"
+        )
+    return manifests
@@ -0,0 +1,107 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from loguru import logger
+
+from geocover_qa.config import STATS_CACHE_SIZE
+
+# Number of issue.gdb loaded concurrently in the background
+PREFETCH_WORKERS = 2
+
+
+class StatsCache:
+    """
+    Thread-safe LRU cache of the stats of QA runs, with background loading.
+
+    Values are computed by `loader(key)` (e.g. the path of an issue.gdb) in a
+    small thread pool. A key requested while it is already loading returns the
+    same future, so a run prefetched in the background is never read twice.
+
+        cache = StatsCache(get_stats_for_issues_gdb)
+        cache.prefetch([previous_gdb, next_gdb])
+        combined, stats = cache.load(gdb).result()
+    """
+
+    def __init__(
+        self, loader, max_entries=STATS_CACHE_SIZE, max_workers=PREFETCH_WORKERS
+    ):
+        self.loader = loader
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def get(self, key, default=None):
+        """Cached value of `key`, marked as the most recently used."""
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        """Add a value, evicting the least recently used ones above `max_entries`."""
+        with self.lock:
+            self.add_entry(key, value)
+
+    def add_entry(self, key, value):
+        """Same as `put`, with the lock already held."""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            evicted, _ = self.entries.popitem(last=False)
+            logger.debug(f"Evicted {evicted} from the stats cache")
+
+    def is_loading(self, key):
+        with self.lock:
+            return key in self.pending
+
+    def load(self, key):
+        """
+        Future of the value of `key`: already done if cached, shared if loading.
+
+        :return: concurrent.futures.Future
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                future = Future()
+                future.set_result(self.entries[key])
+                return future
+            if key in self.pending:
+                return self.pending[key]
+            future = self.executor.submit(self.loader, key)
+            self.pending[key] = future
+        future.add_done_callback(lambda done: self.on_loaded(key, done))
+        return future
+
+    def on_loaded(self, key, future):
+        loaded = not future.cancelled() and future.exception() is None
+        if not future.cancelled() and not loaded:
+            logger.warning(f"Cannot load {key}: {future.exception()}")
+        # No longer pending and cached at once: a `load` in between would run it again
+        with self.lock:
+            self.pending.pop(key, None)
+            if loaded:
+                self.add_entry(key, future.result())
+
+    def prefetch(self, keys):
+        """Load `keys` in the background, if not cached or loading yet."""
+        for key in keys:
+            if key not in self and not self.is_loading(key):
+                logger.debug(f"Prefetching {key}")
+                self.load(key)
+
+    def shutdown(self):
+        """Stop the background loading, dropping the loads not started yet."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
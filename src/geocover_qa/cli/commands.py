@@ -1,7 +1,44 @@
+import ast
+import json
+import os
+
 import click
+from loguru import logger
 
+# Only light modules here: geopandas, pandas and matplotlib are imported by the
+# commands needing them, so that loading the plugin or `--help` stays fast
 from geocover_qa.config import QA_DIR
-from geocover_qa.config import LOTS_IN_WORK
+from geocover_qa.config import (
+    ATTRIBUTIONS,
+    INCREMENTS_DIR,
+    LOTS_IN_WORK,
+    MAX_PLOTTED_FEATURES,
+    MAX_WORKERS,
+    POLL_INTERVAL,
+    RETENTION_DAILY_DAYS,
+    RETENTION_WEEKLY_DAYS,
+    RETRY_ATTEMPTS,
+    SETTLE_SECONDS,
+    STATS_CACHE_SIZE,
+    TABLE_FORMATS,
+    ZIP_BASE_DIR,
+)
+
+
+def use_batch_backend(interactive=False):
+    """
+    Select the non-interactive Agg backend of matplotlib for batch runs.
+
+    Must be called before pyplot is imported. Runs showing plots on the screen
+    keep the default backend, unless there is no display to show them.
+    """
+    import matplotlib
+
+    has_display = os.name == "nt" or bool(
+        os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")
+    )
+    if not (interactive and has_display):
+        matplotlib.use("Agg")
 
 
 class PythonLiteralOption(click.Option):
@@ -96,6 +133,65 @@ def topology():
     default="both",
     help="Output type.",
 )
+@click.option(
+    "--table-format",
+    "table_formats",
+    type=click.Choice(TABLE_FORMATS, case_sensitive=False),
+    multiple=True,
+    default=["xlsx"],
+    help="Format of the stats tables (can be repeated)",
+)
+@click.option(
+    "--single-workbook",
+    is_flag=True,
+    default=False,
+    help="Write the whole date range into one file per format (one sheet per date)",
+)
+@click.option(
+    "--maps",
+    is_flag=True,
+    default=False,
+    help="Render one issue map (PNG) per lot and per mapsheet",
+)
+@click.option(
+    "--max-map-features",
+    type=click.IntRange(min=0),
+    default=MAX_PLOTTED_FEATURES,
+    help="Number of issues above which maps show a density raster per Code",
+)
+@click.option(
+    "-j",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=MAX_WORKERS,
+    help="Number of concurrent directory listings when looking for issue.gdb",
+)
+@click.option(
+    "--attribution",
+    type=click.Choice(ATTRIBUTIONS, case_sensitive=False),
+    default="intersects",
+    help="Count issues in every lot they intersect, or in exactly one: the one "
+    "holding most of them (overlap) or their representative point (point)",
+)
+@click.option(
+    "--shared",
+    is_flag=True,
+    default=False,
+    help="With --attribution overlap/point, count the issues spread over "
+    "several lots in a 'Shared' lot",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Skip the issue.gdb already processed into the same output directory",
+)
+@click.option(
+    "--retries",
+    type=click.IntRange(min=0),
+    default=RETRY_ATTEMPTS - 1,
+    help="Retries of a failing issue.gdb, with an increasing delay",
+)
 def stat(
     qa_dir,
     dryrun,
@@ -110,7 +206,39 @@ def stat(
     regions,
     output,
     output_dir,
+    workers,
+    maps,
+    max_map_features,
+    table_formats,
+    single_workbook,
+    attribution,
+    shared,
+    resume,
+    retries,
 ):
+    use_batch_backend(interactive=plots)
+
+    import matplotlib.pyplot as plt
+
+    from geocover_qa.aggregate import StatsAccumulator
+    from geocover_qa.dimensions import load_dimensions
+    from geocover_qa.export import export_stats_range, export_table
+    from geocover_qa.manifest import MANIFEST_FILENAME, RunManifest, call_with_retry
+    from geocover_qa.reference import read_reference_layer
+    from geocover_qa.source import find_qa_gdbs
+    from geocover_qa.stat import (
+        ATTRIBUTED_GROUP_BY,
+        STATS_GROUP_BY,
+        get_stats,
+        plot_single_lot,
+    )
+    from geocover_qa.utils import (
+        check_qa_path_level,
+        get_lots_perimeter,
+        get_mapsheets_path,
+        parse_qa_full_path,
+    )
+
     # qa_name = "TechnicalQualityAssurance"
     # qa_name = "Topology"
     rc_name = None
@@ -154,7 +282,6 @@ def stat(
     if rc_name is None:
         rc_name = f"RC_{rc}"
 
-    GROUP_BY = ["Id", "IssueType", "Code", "CodeDescription", "QualityCondition"]
     #
     # TOD: test if qa_dir is already an issue db
 
@@ -167,13 +294,14 @@ def stat(
         if meta:
             issue_gdbs = [meta]
     else:
-        issue_gdbs = get_qa_gdb(
+        issue_gdbs = find_qa_gdbs(
             qa_name=qa_name,
             base_dir=qa_dir,
             release=rc_name,
             start_date=start_date,
             end_date=end_date,
             last=last,
+            max_workers=workers,
         )
     # Display the found files with parsed dates
     issue_gdbs_nb = len(issue_gdbs)
@@ -187,92 +315,192 @@ def stat(
 
     click.echo(lots_in_work)
 
-    GPKG_FILEPATH = os.path.join(cur_dir, "../../../../QA/data/lots_mapsheets.gpkg")
-    ch_gdf = gpd.read_file(GPKG_FILEPATH, layer="ch")
+    GPKG_FILEPATH = get_mapsheets_path()
+    ch_gdf = read_reference_layer(GPKG_FILEPATH, "ch")
     ch_gdf = ch_gdf.set_crs(epsg=2056, allow_override=True)
     lots_perimeter_gdf = get_lots_perimeter(GPKG_FILEPATH)
+    # Loaded once, also used to partition the issues of the maps by lot and sheet
+    sheets_perimeter_gdf = get_lots_perimeter(
+        GPKG_FILEPATH, layername="mapsheet_with_lot_nr_lot_mapsheet_buffer_100m"
+    )
     ALL_SWITZERLAND_ID = "CH"
 
-    stats_over_time = []
+    # Running totals and date x group counts, instead of every run's table
+    accumulator = None
 
     if start_date is None:
         start_date = min(issue_gdbs, key=lambda x: x["date"])["date"]
     if end_date is None:
         end_date = max(issue_gdbs, key=lambda x: x["date"])["date"]
 
-    for idx, entry in enumerate(issue_gdbs):
-        logger.info(
-            f"{idx}/{issue_gdbs_nb} Date: {entry['date']}, File Path: {entry['file_path']}"
-        )
-
+    def process_gdb(entry, lots_in_work):
+        """Stats and output files of an issue.gdb, raising on read errors."""
         issue_gdb_path = entry["file_path"]
         file_date = entry["date"]
         rc = entry["RC"]
         test_name = entry["QA"]
+        outputs = []
 
-        plot_single_lot(ALL_SWITZERLAND_ID, lots_perimeter_gdf, issue_gdb_path, ch_gdf)
+        if plots:
+            plot_single_lot(
+                ALL_SWITZERLAND_ID, lots_perimeter_gdf, issue_gdb_path, ch_gdf
+            )
 
-        combined_issues, stats = get_stats(issue_gdb_path, group_by=GROUP_BY)
+        result = get_stats(
+            issue_gdb_path,
+            lots_perimeter=sheets_perimeter_gdf,
+            group_by=(
+                STATS_GROUP_BY if attribution == "intersects" else ATTRIBUTED_GROUP_BY
+            ),
+            attribution=attribution,
+            shared=shared,
+        )
+        if result is None:
+            raise RuntimeError(f"Cannot compute the stats of {issue_gdb_path}")
+        combined_issues, stats = result
 
-        if stats is None:
-            continue
+        if maps and not dryrun:
+            from geocover_qa.plot import render_issue_maps
+
+            maps_dir = os.path.join(
+                output_dir, "maps", f"{file_date:%Y-%m-%d}_{rc}_{test_name}"
+            )
+            render_issue_maps(
+                combined_issues,
+                sheets_perimeter_gdf,
+                [
+                    (ch_gdf, {"edgecolor": "purple", "linewidth": 3, "alpha": 0.15}),
+                    (lots_perimeter_gdf, {"edgecolor": "pink", "linewidth": 3}),
+                ],
+                maps_dir,
+                title=f"{file_date:%Y-%m-%d} {test_name}",
+                cache_dir=os.path.join(output_dir, "maps", "backgrounds"),
+                max_features=max_map_features,
+            )
+            outputs.append(maps_dir)
 
         logger.info(type(stats))
 
         if lots_in_work is None:
             lots_in_work = stats["Lot"].unique()
 
-        grouped_stats = stats[stats["Lot"].isin(lots_in_work)]
+        grouped_stats = stats[load_dimensions().lots.isin(stats["Lot"], lots_in_work)]
 
         # Display grouped stats
         logger.info(grouped_stats.head())
 
-        # Append the statistics along with the date
-        stats_over_time.append({"date": file_date, "stats": grouped_stats})
-
         # Save the statistics to CSV
         # grouped_stats.to_csv("lots_issue_stats.csv", index=False)
 
-        if any(ele in output for ele in ["xlsx", "both"]):
-            xlsx_path = os.path.join(
-                output_dir, f"{file_date:%Y-%m-%d}_{rc}_{test_name}.xlsx"
+        if any(ele in output for ele in ["xlsx", "both"]) and not single_workbook:
+            for table_format in table_formats:
+                table_path = os.path.join(
+                    output_dir,
+                    f"{file_date:%Y-%m-%d}_{rc}_{test_name}.{table_format}",
+                )
+                outputs.append(export_table(grouped_stats, table_path, sheet="Issue"))
+
+        return grouped_stats, outputs
+
+    # Completed issue.gdb are recorded, so that --resume skips them
+    manifest = RunManifest(
+        os.path.join(output_dir, MANIFEST_FILENAME),
+        options={
+            "regions": None if regions is None else sorted(map(str, regions)),
+            "output": output,
+            "table_formats": sorted(table_formats),
+            "single_workbook": single_workbook,
+            "maps": maps and not dryrun,
+            # Checkpoints with plain lot numbers (before the coded lots) are not reused
+            "lot_codes": True,
+            "attribution": attribution,
+            "shared": shared,
+        },
+    )
+    if not resume:
+        manifest.reset()
+
+    for idx, entry in enumerate(issue_gdbs):
+        logger.info(
+            f"{idx}/{issue_gdbs_nb} Date: {entry['date']}, File Path: {entry['file_path']}"
+        )
+
+        issue_gdb_path = entry["file_path"]
+        file_date = entry["date"]
+        rc = entry["RC"]
+        test_name = entry["QA"]
+
+        grouped_stats = manifest.completed_stats(issue_gdb_path)
+        if grouped_stats is not None:
+            logger.info(f"Already processed, resuming from {manifest.path}")
+        else:
+            try:
+                grouped_stats, outputs = call_with_retry(
+                    process_gdb, entry, lots_in_work, attempts=retries + 1
+                )
+            except Exception as e:
+                logger.error(f"Skipping {issue_gdb_path} after {retries + 1} attempts")
+                manifest.fail(issue_gdb_path, e, retries + 1)
+                continue
+            manifest.complete(issue_gdb_path, grouped_stats, outputs)
+
+        if lots_in_work is None:
+            lots_in_work = grouped_stats["Lot"].unique()
+
+        # Fold the statistics of this date into the accumulator
+        if accumulator is None:
+            accumulator = StatsAccumulator(
+                [column for column in grouped_stats.columns if column != "IssueCount"]
             )
+        accumulator.add(file_date, grouped_stats)
 
-            with pd.ExcelWriter(xlsx_path) as writer:
-                # writing to the 'Employee' sheet
-                grouped_stats.to_excel(writer, sheet_name="Issue", index=False)
+    failed = manifest.failed()
+    if failed:
+        logger.warning(
+            f"{len(failed)} issue.gdb failed, run again with --resume to retry them: "
+            + ", ".join(failed)
+        )
 
-                # Get the xlsxwriter objects from the dataframe writer object.
-                workbook = writer.book
-                worksheet = writer.sheets["Issue"]
+    range_name = f"{start_date:%Y-%m-%d}_{end_date:%Y-%m-%d}_{rc}_{test_name}"
+    if (
+        any(ele in output for ele in ["xlsx", "both"])
+        and single_workbook
+        and accumulator
+    ):
+        export_stats_range(
+            list(accumulator.entries()),
+            output_dir,
+            range_name,
+            formats=table_formats,
+        )
 
-                # Set the width of columns A to D to 20
-                # worksheet.set_column("C:E", 50)
+    if aggregate and accumulator:
+        # Counts of each group summed over the whole range
+        for table_format in table_formats:
+            export_table(
+                accumulator.total_frame(),
+                os.path.join(output_dir, f"{range_name}_total.{table_format}"),
+                sheet="Total",
+            )
 
     # Plot the evolution of issues over time
     # Apply a logarithmic scale to the y-axis
 
-    if any(ele in output for ele in ["plot", "both"]):
-        # Combine statistics over time for plotting
-        all_stats = pd.concat(
-            [entry["stats"].assign(date=entry["date"]) for entry in stats_over_time],
-            ignore_index=True,
-        )
+    if any(ele in output for ele in ["plot", "both"]) and accumulator:
+        from geocover_qa.cube import CountCube, write_cube
 
-        # Pivot the data for easier plotting (issue_count by Lot and date)
-        pivot_stats = all_stats.pivot_table(
-            index="date",
-            columns=[
-                "Lot",
-                "IssueType",
-            ],  # , "Code", "CodeDescription", "QualityCondition"],
-            values="issue_count",
-            aggfunc="sum",
-            fill_value=0,
+        # Trend data kept as a count cube (date x Lot x IssueType x Code)
+        cube_path = write_cube(
+            accumulator, os.path.join(output_dir, f"{range_name}.cube")
         )
+        # IssueCount by date, Lot and IssueType, read from the mapped cube
+        pivot_stats = CountCube(cube_path).series(
+            ["Lot", "IssueType"]
+        )  # , "Code", "CodeDescription", "QualityCondition"]
 
         # Plot the evolution of issues over time with a logarithmic y-axis
-        ax = pivot_stats.plot(kind="line", marker="o", figsize=(12, 6))
+        fig, ax = plt.subplots(figsize=(12, 6))
+        ax.plot(pivot_stats.index, pivot_stats.to_numpy(), marker="o")
 
         # Set x and y labels and title
         plt.xlabel("Date")
@@ -319,3 +547,695 @@ def stat(
             plt.savefig(plot_path, dpi=100)
         if plots:
             plt.show()
+
+
+@qa.command(
+    "watch",
+    help="Process the new QA runs as they land (stats, tables, maps and trend)",
+    context_settings={"show_default": True},
+)
+@click.option(
+    "-d",
+    "--qa-dir",
+    default=QA_DIR,
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    help="QA test results directory (containing the QA names)",
+)
+@click.option(
+    "-o",
+    "--output-dir",
+    default="outputs",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Output directory",
+)
+@click.option(
+    "--rc",
+    type=click.Choice(["2030-12-31", "2016-12-31"]),
+    default="2030-12-31",
+    help="Release",
+)
+@click.option(
+    "-q",
+    "--qa_name",
+    type=click.Choice(["TechnicalQualityAssurance", "Topology"]),
+    default="Topology",
+    help="QA test name",
+)
+@click.option(
+    "--regions",
+    type=str,
+    cls=PythonLiteralOption,
+    default=LOTS_IN_WORK,
+    help="Comma-separated list of regions to process. Use 'all' for no filter",
+)
+@click.option(
+    "--table-format",
+    "table_formats",
+    type=click.Choice(TABLE_FORMATS, case_sensitive=False),
+    multiple=True,
+    default=["xlsx"],
+    help="Format of the stats table of each run (can be repeated)",
+)
+@click.option(
+    "--trend-format",
+    "trend_formats",
+    type=click.Choice(["csv", "parquet"], case_sensitive=False),
+    multiple=True,
+    default=["csv"],
+    help="Format of the trend table the runs are appended to (can be repeated)",
+)
+@click.option(
+    "--maps",
+    is_flag=True,
+    default=False,
+    help="Render one issue map (PNG) per lot and per mapsheet",
+)
+@click.option(
+    "--max-map-features",
+    type=click.IntRange(min=0),
+    default=MAX_PLOTTED_FEATURES,
+    help="Number of issues above which maps show a density raster per Code",
+)
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=1),
+    default=POLL_INTERVAL,
+    help="Seconds between two polls of the QA directory",
+)
+@click.option(
+    "--settle",
+    type=click.FloatRange(min=0),
+    default=SETTLE_SECONDS,
+    help="Seconds an issue.gdb must stay unchanged before it is processed",
+)
+@click.option(
+    "--process-existing",
+    is_flag=True,
+    default=False,
+    help="On the first start, also process the runs already there",
+)
+@click.option(
+    "--once", is_flag=True, default=False, help="Poll once and exit (e.g. from cron)"
+)
+@click.option(
+    "--attribution",
+    type=click.Choice(ATTRIBUTIONS, case_sensitive=False),
+    default="intersects",
+    help="Count issues in every lot they intersect, or in exactly one: the one "
+    "holding most of them (overlap) or their representative point (point)",
+)
+@click.option(
+    "--shared",
+    is_flag=True,
+    default=False,
+    help="With --attribution overlap/point, count the issues spread over "
+    "several lots in a 'Shared' lot",
+)
+@click.option(
+    "--store",
+    "store_dir",
+    default=None,
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Also ingest the issues of each run into this issue store",
+)
+@click.option(
+    "--retries",
+    type=click.IntRange(min=0),
+    default=RETRY_ATTEMPTS - 1,
+    help="Retries of a failing run, with an increasing delay, before it is "
+    "recorded as failed",
+)
+def watch(
+    qa_dir,
+    output_dir,
+    rc,
+    qa_name,
+    regions,
+    table_formats,
+    trend_formats,
+    maps,
+    max_map_features,
+    interval,
+    settle,
+    process_existing,
+    once,
+    attribution,
+    shared,
+    store_dir,
+    retries,
+):
+    use_batch_backend()
+
+    from geocover_qa.watch import STATE_FILENAME, RunProcessor, RunWatcher
+    from geocover_qa.watch import watch as watch_runs
+
+    base_dir = os.path.join(qa_dir, qa_name)
+    if not os.path.isdir(base_dir):
+        raise click.BadParameter(f"No QA '{qa_name}' in {qa_dir}")
+
+    # Loaded once: reference layers and spatial index stay warm between runs
+    processor = RunProcessor(
+        output_dir,
+        qa_name=qa_name,
+        lots_in_work=regions,
+        table_formats=table_formats,
+        trend_formats=trend_formats,
+        maps=maps,
+        max_map_features=max_map_features,
+        store_dir=store_dir,
+        attribution=attribution,
+        shared=shared,
+    )
+    watcher = RunWatcher(base_dir, release=f"RC_{rc}", settle=settle)
+    logger.info(f"Watching {base_dir} for new RC_{rc} runs every {interval}s")
+    watch_runs(
+        watcher,
+        processor,
+        os.path.join(output_dir, STATE_FILENAME),
+        interval=interval,
+        skip_existing=not process_existing,
+        once=once,
+        retry_attempts=retries + 1,
+    )
+
+
+@qa.command(
+    "serve",
+    help="Serve the stats of the QA runs as JSON/Arrow on localhost",
+    context_settings={"show_default": True},
+)
+@click.option(
+    "-d",
+    "--qa-dir",
+    default=QA_DIR,
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    help="QA test results directory (containing the QA names)",
+)
+@click.option(
+    "--host",
+    default="127.0.0.1",
+    help="Loopback address to listen on (the service is local only)",
+)
+@click.option("-p", "--port", type=click.IntRange(1, 65535), default=8765, help="Port")
+@click.option(
+    "--cache-size",
+    type=click.IntRange(min=1),
+    default=STATS_CACHE_SIZE,
+    help="Number of runs kept in memory",
+)
+def serve(qa_dir, host, port, cache_size):
+    from geocover_qa.service import is_loopback
+    from geocover_qa.service import serve as serve_stats
+
+    if not is_loopback(host):
+        raise click.BadParameter(f"Not a loopback address: {host}", param_hint="--host")
+    serve_stats(qa_dir, host=host, port=port, cache_size=cache_size)
+
+
+@qa.command(
+    "check",
+    help="Check the validity, overlaps, gaps and slivers of a GCOVERP increment",
+    context_settings={"show_default": True},
+)
+@click.argument(
+    "increment_gdb", type=click.Path(exists=True, file_okay=False, dir_okay=True)
+)
+@click.option(
+    "-o",
+    "--output",
+    default="issue.gdb",
+    type=click.Path(dir_okay=True),
+    help="Output issue.gdb (or .gpkg), readable by `qa stat`",
+)
+@click.option(
+    "-l",
+    "--layer",
+    "layers",
+    multiple=True,
+    default=None,
+    help="Layer to check (can be repeated) [default: GC_BEDROCK, GC_UNCO_DESPOSIT]",
+)
+@click.option("--id-column", default="UUID", help="Attribute identifying the objects")
+@click.option(
+    "--bbox",
+    type=float,
+    nargs=4,
+    default=None,
+    help="Only check the objects within minx miny maxx maxy (EPSG:2056)",
+)
+@click.option(
+    "--tiled",
+    is_flag=True,
+    default=False,
+    help="Check mapsheet by mapsheet in parallel (national tables)",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of processes of --tiled [default: number of CPUs]",
+)
+def check(increment_gdb, output, layers, id_column, bbox, tiled, workers):
+    import pandas as pd
+
+    from geocover_qa.geometry import CHECKED_LAYERS, check_layer, write_issues
+    from geocover_qa.source import read_increment_layer
+
+    if tiled and bbox:
+        raise click.BadParameter("Cannot be used with --tiled", param_hint="--bbox")
+
+    issues = []
+    for layer in layers or CHECKED_LAYERS:
+        if tiled:
+            from geocover_qa.tiling import check_layer_tiled, read_tiles
+
+            issues.append(
+                check_layer_tiled(
+                    increment_gdb,
+                    layer,
+                    read_tiles(),
+                    id_column=id_column,
+                    max_workers=workers,
+                )
+            )
+            continue
+        gdf = read_increment_layer(increment_gdb, layer, bbox=bbox)
+        issues.append(check_layer(gdf, layer, id_column=id_column))
+    write_issues(pd.concat(issues, ignore_index=True), output)
+
+
+@qa.command(
+    "ingest",
+    help="Ingest the QA runs not ingested yet into the issue store",
+    context_settings={"show_default": True},
+)
+@click.option(
+    "-d",
+    "--qa-dir",
+    default=QA_DIR,
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    help="QA test results directory (containing the QA names)",
+)
+@click.option(
+    "-s",
+    "--store",
+    "store_dir",
+    default="issue_store",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Issue store directory",
+)
+@click.option(
+    "--rc",
+    type=click.Choice(["2030-12-31", "2016-12-31"]),
+    default="2030-12-31",
+    help="Release",
+)
+@click.option(
+    "-q",
+    "--qa_name",
+    type=click.Choice(["TechnicalQualityAssurance", "Topology"]),
+    default="Topology",
+    help="QA test name",
+)
+@click.option(
+    "--start-date",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="Start date (YYYY-MM-DD).",
+)
+@click.option(
+    "--replace", is_flag=True, default=False, help="Ingest the runs already there again"
+)
+def ingest(qa_dir, store_dir, rc, qa_name, start_date, replace):
+    from geocover_qa.source import find_qa_gdbs
+    from geocover_qa.store import ingest_runs
+
+    records = find_qa_gdbs(
+        qa_name=qa_name, base_dir=qa_dir, release=f"RC_{rc}", start_date=start_date
+    )
+    ingested = ingest_runs(store_dir, records, replace=replace)
+    logger.info(f"Ingested {len(ingested)} runs into {store_dir}")
+
+
+@qa.command(
+    "history",
+    help="Issue counts over time from the issue store, by sheet, lot or bbox",
+    context_settings={"show_default": True},
+)
+@click.option(
+    "-s",
+    "--store",
+    "store_dir",
+    default="issue_store",
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    help="Issue store directory",
+)
+@click.option(
+    "--rc",
+    type=click.Choice(["2030-12-31", "2016-12-31"]),
+    default="2030-12-31",
+    help="Release",
+)
+@click.option(
+    "-q",
+    "--qa_name",
+    type=click.Choice(["TechnicalQualityAssurance", "Topology"]),
+    default="Topology",
+    help="QA test name",
+)
+@click.option(
+    "--start-date",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="Start date (YYYY-MM-DD).",
+)
+@click.option(
+    "--end-date",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="End date (YYYY-MM-DD), included.",
+)
+@click.option("--sheet", "sheets", multiple=True, help="Mapsheet (can be repeated)")
+@click.option("--lot", "lots", multiple=True, help="Lot (can be repeated)")
+@click.option(
+    "--bbox",
+    type=float,
+    nargs=4,
+    default=None,
+    help="Only the issues within minx miny maxx maxy (EPSG:2056)",
+)
+@click.option(
+    "--group-by",
+    default="date,Sheet",
+    help="Comma-separated columns (date, Lot, Sheet, IssueType, Code, ...)",
+)
+@click.option(
+    "-o",
+    "--output",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Write the table (.xlsx, .csv or .parquet) instead of printing it",
+)
+def history(
+    store_dir,
+    rc,
+    qa_name,
+    start_date,
+    end_date,
+    sheets,
+    lots,
+    bbox,
+    group_by,
+    output,
+):
+    from geocover_qa.store import count_issues
+
+    if end_date is not None:
+        end_date = end_date.replace(hour=23, minute=59, second=59)
+    counts = count_issues(
+        store_dir,
+        group_by=[column.strip() for column in group_by.split(",") if column.strip()],
+        qa_name=qa_name,
+        release=f"RC_{rc}",
+        start_date=start_date,
+        end_date=end_date,
+        bbox=bbox,
+        lots=lots or None,
+        sheets=sheets or None,
+    )
+    if output:
+        from geocover_qa.export import export_table
+
+        export_table(counts, output, sheet="History")
+    else:
+        click.echo(counts.to_string(index=False))
+
+
+@qa.command(
+    "trend",
+    help="Plot issue counts over time from a count cube written by `qa stat`",
+    context_settings={"show_default": True},
+)
+@click.argument("cube_path", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "-o",
+    "--output",
+    default="trend.png",
+    type=click.Path(dir_okay=False),
+    help="PNG file of the plot",
+)
+@click.option(
+    "--by",
+    default="Lot,IssueType",
+    help="Comma-separated axes defining the lines (Lot, IssueType, Code)",
+)
+@click.option("--lot", "lots", multiple=True, help="Lot (can be repeated)")
+@click.option(
+    "--issue-type", "issue_types", multiple=True, help="Issue type (can be repeated)"
+)
+@click.option("--code", "codes", multiple=True, help="Code (can be repeated)")
+@click.option(
+    "--start-date",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="Start date (YYYY-MM-DD).",
+)
+@click.option(
+    "--end-date",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="End date (YYYY-MM-DD), included.",
+)
+@click.option("--log", "log_scale", is_flag=True, default=False, help="Log scale")
+@click.option("--title", default="", help="Title of the plot")
+def trend(
+    cube_path,
+    output,
+    by,
+    lots,
+    issue_types,
+    codes,
+    start_date,
+    end_date,
+    log_scale,
+    title,
+):
+    use_batch_backend()
+
+    from geocover_qa.cube import CountCube
+    from geocover_qa.plot import plot_counts
+
+    if end_date is not None:
+        end_date = end_date.replace(hour=23, minute=59, second=59)
+    by = [column.strip() for column in by.split(",") if column.strip()]
+    cube = CountCube(cube_path)
+    pivot_stats = cube.series(
+        by,
+        start_date=start_date,
+        end_date=end_date,
+        Lot=lots or None,
+        IssueType=issue_types or None,
+        Code=codes or None,
+    )
+    logger.info(f"{pivot_stats.shape[1]} lines over {len(pivot_stats)} dates")
+    plot_counts(pivot_stats, output, title=title, log_scale=log_scale, columns=by)
+    logger.info(f"Written {output}")
+
+
+@qa.command(
+    "archive",
+    help="Archive the issue.gdb not archived yet, storing each distinct chunk once",
+    context_settings={"show_default": True},
+)
+@click.option(
+    "-d",
+    "--qa-dir",
+    default=QA_DIR,
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    help="QA test results directory (containing the QA names)",
+)
+@click.option(
+    "-a",
+    "--archive",
+    "archive_dir",
+    default="qa_archive",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Archive directory",
+)
+def archive(qa_dir, archive_dir):
+    from geocover_qa.archive import archive_qa_gdbs
+
+    manifests = archive_qa_gdbs(archive_dir, qa_dir)
+    total = sum(manifest["size"] for manifest in manifests)
+    stored = sum(manifest["stored"] for manifest in manifests)
+    click.echo(
+        f"{len(manifests)} runs archived, {total / 1e6:.1f} MB read, "
+        f"{stored / 1e6:.1f} MB stored"
+    )
+
+
+@qa.command(
+    "restore",
+    help="Rebuild the issue.gdb (or its zip) of an archived run",
+    context_settings={"show_default": True},
+)
+@click.argument("name", required=False)
+@click.option(
+    "-a",
+    "--archive",
+    "archive_dir",
+    default="qa_archive",
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    help="Archive directory",
+)
+@click.option(
+    "-o",
+    "--output",
+    default=".",
+    type=click.Path(),
+    help="Directory of the restored issue.gdb, or path of a .zip",
+)
+def restore(name, archive_dir, output):
+    from geocover_qa.archive import list_runs, restore_gdb, restore_zip
+
+    if name is None:
+        click.echo("\n".join(list_runs(archive_dir)))
+        return
+    if output.endswith(".zip"):
+        restore_zip(archive_dir, name, output)
+    else:
+        restore_gdb(archive_dir, name, output)
+
+
+@qa.command(
+    "verify",
+    help="Verify the zip archives of a backup tree (SHA-256 sidecars and CRC)",
+    context_settings={"show_default": True},
+)
+@click.argument(
+    "base_dir",
+    default=ZIP_BASE_DIR,
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+)
+@click.option(
+    "--cache",
+    "cache_path",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Cache of the results (default: .verify_cache.json in BASE_DIR)",
+)
+@click.option(
+    "-j",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=MAX_WORKERS,
+    help="Number of archives verified concurrently",
+)
+@click.option(
+    "--no-crc",
+    is_flag=True,
+    default=False,
+    help="Do not inflate the members to check their CRC",
+)
+@click.option("--force", is_flag=True, default=False, help="Ignore the cached results")
+@click.option(
+    "-o",
+    "--output",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Write the results (.xlsx, .csv or .parquet)",
+)
+def verify(base_dir, cache_path, workers, no_crc, force, output):
+    from geocover_qa.verify import CACHE_FILENAME, find_archives, verify_archives
+
+    if cache_path is None:
+        cache_path = os.path.join(base_dir, CACHE_FILENAME)
+    results = verify_archives(
+        find_archives(base_dir),
+        cache_path=cache_path,
+        max_workers=workers,
+        check_crc=not no_crc,
+        force=force,
+    )
+    if output:
+        from geocover_qa.export import export_table
+
+        table = results.copy()
+        if "directories" in table.columns:
+            table["directories"] = table["directories"].map(
+                lambda directories: (
+                    ", ".join(directories) if isinstance(directories, list) else ""
+                )
+            )
+        export_table(table, output, sheet="Verification")
+
+    failed = results[results["status"] != "ok"] if len(results) else results
+    for row in failed.itertuples():
+        click.echo(f"FAILED {row.path}: {row.error}")
+    summary = f"{len(results)} archives verified, {len(failed)} failed"
+    if len(failed):
+        raise click.ClickException(summary)
+    click.echo(summary)
+
+
+@qa.command(
+    "prune",
+    help="Remove the increments beyond the retention policy (dry run unless --apply)",
+    context_settings={"show_default": True},
+)
+@click.argument(
+    "base_dir",
+    default=INCREMENTS_DIR,
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+)
+@click.option(
+    "--daily",
+    "daily_days",
+    type=click.IntRange(min=0),
+    default=RETENTION_DAILY_DAYS,
+    help="Days during which all the increments are kept",
+)
+@click.option(
+    "--weekly",
+    "weekly_days",
+    type=click.IntRange(min=0),
+    default=RETENTION_WEEKLY_DAYS,
+    help="Days during which the last one of each week is kept (then of each month)",
+)
+@click.option(
+    "--apply", is_flag=True, default=False, help="Remove the files, not only list them"
+)
+def prune(base_dir, daily_days, weekly_days, apply):
+    from geocover_qa.increments import apply_retention, find_increments, plan_retention
+
+    plan = plan_retention(
+        find_increments(base_dir), daily_days=daily_days, weekly_days=weekly_days
+    )
+    freed = apply_retention(plan, dry_run=not apply) if len(plan) else 0
+    removed = int((~plan["keep"]).sum()) if len(plan) else 0
+    click.echo(
+        f"{len(plan) - removed} increments kept, {removed} "
+        f"{'removed' if apply else 'to remove'}, {freed / 1e9:.2f} GB"
+    )
+
+
+@qa.command(
+    "extract",
+    help="Extract only some tables of a zipped increment, as a FileGDB",
+    context_settings={"show_default": True},
+)
+@click.argument("zip_path", type=click.Path(exists=True, dir_okay=False))
+@click.argument("tables", nargs=-1, required=True)
+@click.option(
+    "-o",
+    "--output-dir",
+    default=".",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Directory of the extracted GDB",
+)
+def extract(zip_path, tables, output_dir):
+    from geocover_qa.increments import extract_tables
+
+    gdb_path = extract_tables(zip_path, tables, output_dir)
+    click.echo(gdb_path)
+
+
+if __name__ == "__main__":
+    # Standalone entry point, e.g. to time the startup: python -m geocover_qa.cli.commands --help
+    qa()
@@ -8,6 +8,26 @@ ZIP_BASE_DIR = "/media/marco/G13/"
 
 LOTS_IN_WORK = "1, 2, 8, 10"
 
+# Above this number of issues, maps show a density raster instead of the geometries
+MAX_PLOTTED_FEATURES = 50000
+# Number of QA runs whose stats are kept in memory by the GUI
+STATS_CACHE_SIZE = 8
+# Number of concurrent directory listings on the network shares
+MAX_WORKERS = 8
+# Formats of the stats tables
+TABLE_FORMATS = ["xlsx", "csv", "parquet"]
+# `qa watch`: seconds between two polls, and an issue.gdb must stay unchanged
+POLL_INTERVAL = 30
+SETTLE_SECONDS = 60
+# Batch runs: calls of a failing issue.gdb, and seconds before the first retry
+RETRY_ATTEMPTS = 3
+RETRY_DELAY = 5
+# Increments kept: all of the last days, then the last of each week, then of each month
+RETENTION_DAILY_DAYS = 30
+RETENTION_WEEKLY_DAYS = 365
+# How issues get their lot and mapsheet: every intersecting one, or exactly one
+ATTRIBUTIONS = ["intersects", "overlap", "point"]
+
 # Regular expression to match the final chunk of the directory (date pattern: YYYYMMDD_HH-MM-SS)
 zip_date_pattern = re.compile(r"(\d{8}_\d{2}-\d{2}-\d{2})")
 
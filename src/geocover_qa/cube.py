@@ -0,0 +1,186 @@
+"""
+Issue counts of a date range as a memory-mapped count cube.
+
+A cube is a directory holding a dense `counts.npy` (dates x Lot x
+IssueType x Code, int32) and `labels.json`, the labels along each axis.
+Dates are sorted. Reading a cube maps the array without loading it: a
+slice (one lot, one code, a date window) only reads the pages it covers.
+
+    write_cube(accumulator, "outputs/2024_RC_2030-12-31_Topology.cube")
+    cube = CountCube("outputs/2024_RC_2030-12-31_Topology.cube")
+    cube.series(["Lot", "IssueType"], Code=["TOP.3"], start_date=last_month)
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from geocover_qa.aggregate import sort_key
+
+# Axes of the cube after the dates
+CUBE_DIMENSIONS = ["Lot", "IssueType", "Code"]
+COUNTS_FILENAME = "counts.npy"
+LABELS_FILENAME = "labels.json"
+
+
+def json_label(value):
+    """Labels as written to JSON: numpy scalars as Python ones, missing ones as null."""
+    if value is None or (np.ndim(value) == 0 and pd.isna(value)):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def write_cube(accumulator, path, dimensions=CUBE_DIMENSIONS):
+    """
+    Write the counts of a StatsAccumulator as a cube, summed over the other columns.
+
+    :param accumulator: StatsAccumulator grouping by (at least) the `dimensions`.
+    :param path: Directory of the cube, created or replaced.
+    :param dimensions: Columns of the axes after the dates.
+    :return: Path of the cube.
+    """
+    from numpy.lib.format import open_memmap
+
+    dimensions = [column for column in dimensions if column in accumulator.group_by]
+    groups = accumulator.group_frame(dimensions)
+
+    labels = {}
+    group_index = []
+    for column in dimensions:
+        # Missing values (None or NaN) are a single label, not matched by a dict
+        codes, values = pd.factorize(groups[column], use_na_sentinel=False)
+        order = sorted(range(len(values)), key=lambda i: sort_key(values[i]))
+        positions = np.empty(len(values), dtype=np.int64)
+        positions[order] = np.arange(len(values))
+        labels[column] = [json_label(values[i]) for i in order]
+        group_index.append(positions[codes])
+
+    dates = np.array(accumulator.dates, dtype="datetime64[s]")
+    date_order = np.argsort(dates, kind="stable")
+    date_rank = np.empty(len(dates), dtype=np.int64)
+    date_rank[date_order] = np.arange(len(dates))
+
+    os.makedirs(path, exist_ok=True)
+    shape = (len(dates),) + tuple(len(labels[column]) for column in dimensions)
+    counts = open_memmap(
+        os.path.join(path, COUNTS_FILENAME), mode="w+", dtype=np.int32, shape=shape
+    )
+    counts[:] = 0
+    rows, group_ids, values = accumulator.coo()
+    index = (date_rank[rows],) + tuple(column[group_ids] for column in group_index)
+    np.add.at(counts, index, values.astype(np.int32))
+    counts.flush()
+    del counts
+
+    with open(os.path.join(path, LABELS_FILENAME), "w") as f:
+        json.dump(
+            {
+                "dimensions": ["date"] + dimensions,
+                "date": [str(date) for date in dates[date_order]],
+                **labels,
+            },
+            f,
+            indent=1,
+        )
+    logger.info(f"Written a {' x '.join(map(str, shape))} count cube to {path}")
+
+    return path
+
+
+class CountCube:
+    """
+    Read-only, memory-mapped count cube written by `write_cube`.
+
+        cube = CountCube(path)
+        cube.labels["Lot"]
+        counts = cube.select(Lot=[1], start_date=datetime(2024, 6, 1))
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, LABELS_FILENAME)) as f:
+            labels = json.load(f)
+        self.dimensions = labels["dimensions"]
+        self.dates = np.array(labels["date"], dtype="datetime64[s]")
+        self.labels = {column: labels[column] for column in self.dimensions[1:]}
+        self.counts = np.load(os.path.join(path, COUNTS_FILENAME), mmap_mode="r")
+
+    @property
+    def shape(self):
+        return self.counts.shape
+
+    def positions(self, column, values):
+        """Indices of `values` along the axis of `column`, unknown values ignored."""
+        labels = {str(label): i for i, label in enumerate(self.labels[column])}
+        return [labels[str(value)] for value in values if str(value) in labels]
+
+    def date_window(self, start_date=None, end_date=None):
+        """Slice of the dates within [start_date, end_date]."""
+        start, stop = 0, len(self.dates)
+        if start_date is not None:
+            start = np.searchsorted(self.dates, np.datetime64(start_date, "s"))
+        if end_date is not None:
+            stop = np.searchsorted(
+                self.dates, np.datetime64(end_date, "s"), side="right"
+            )
+        return slice(int(start), int(stop))
+
+    def select(self, start_date=None, end_date=None, **selections):
+        """
+        Sub-cube of a date window and of the selected labels (None: all of them).
+
+        Only the selected part of the mapped array is read.
+
+        :return: Tuple of the counts (ndarray) and the labels along each axis.
+        """
+        window = self.date_window(start_date, end_date)
+        counts = self.counts[window]
+        labels = {"date": self.dates[window]}
+        for axis, column in enumerate(self.dimensions[1:], start=1):
+            selected = selections.get(column)
+            if selected is None:
+                labels[column] = self.labels[column]
+                continue
+            positions = self.positions(column, selected)
+            counts = np.take(counts, positions, axis=axis)
+            labels[column] = [self.labels[column][i] for i in positions]
+        return np.asarray(counts), labels
+
+    def series(
+        self, by=("Lot", "IssueType"), start_date=None, end_date=None, **selections
+    ):
+        """
+        Counts by date and by group of `by`, summed over the other axes.
+
+        :return: DataFrame indexed by date, one column per group (non-zero ones only).
+        """
+        by = [column for column in by if column in self.labels]
+        counts, labels = self.select(start_date, end_date, **selections)
+        other_axes = tuple(
+            axis
+            for axis, column in enumerate(self.dimensions[1:], start=1)
+            if column not in by
+        )
+        counts = counts.sum(axis=other_axes, dtype=np.int64)
+        index = pd.Index(pd.to_datetime(labels["date"]), name="date")
+        if not by:
+            return pd.DataFrame({"IssueCount": counts}, index=index)
+
+        # Remaining axes are in the order of the dimensions, reorder them as `by`
+        axes = sorted(self.dimensions.index(column) for column in by)
+        counts = np.moveaxis(
+            counts,
+            [1 + axes.index(self.dimensions.index(column)) for column in by],
+            range(1, len(by) + 1),
+        )
+        df = pd.DataFrame(
+            counts.reshape(len(index), -1),
+            index=index,
+            columns=pd.MultiIndex.from_product(
+                [labels[column] for column in by], names=by
+            ),
+        )
+        return df.loc[:, df.sum(axis=0) > 0]
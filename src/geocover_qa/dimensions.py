@@ -0,0 +1,197 @@
+"""
+Integer codes of the lots, mapsheets and quality conditions.
+
+Lots and mapsheets are read once from the reference GeoPackage and get the
+position of their label, sorted: the same GeoPackage always gives the same
+codes. Quality conditions, and any label missing from the GeoPackage, get
+the next free code when first seen.
+
+Columns are carried as categoricals of these labels: one small integer
+code per row, each label stored once. Labels are only written out by the
+exports (xlsx, csv), the issue store and the cube labels.
+
+    dimensions = load_dimensions()
+    perimeter = dimensions.encode_frame(sheets_perimeter)
+    stats = stats[dimensions.lots.isin(stats["Lot"], [1, 2, 8, 10])]
+"""
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+# Dimension of each column carrying its codes
+DIMENSION_COLUMNS = {
+    "Lot": "lots",
+    "MSH_MAP_TITLE": "sheets",
+    "Sheet": "sheets",
+    "QualityCondition": "conditions",
+}
+# Reference layers the lots and the mapsheets are read from
+LOT_LAYERS = ["lots", "mapsheet_with_lot_nr_lot_mapsheet_buffer_100m"]
+SHEET_LAYER = "mapsheet_with_lot_nr_lot_mapsheet_buffer_100m"
+
+# Loaded dimensions, by GeoPackage path
+loaded_dimensions = {}
+loaded_dimensions_lock = threading.Lock()
+
+
+def to_label(value):
+    """Label of a value: lots 1, 1.0 and '1' are all '1', None when missing."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return f"{value:.0f}"
+    return str(value).strip()
+
+
+class Dimension:
+    """
+    Labels of a column and their integer codes (positions in `labels`).
+
+    Codes are never reassigned: new labels are appended.
+    """
+
+    def __init__(self, name, labels=()):
+        self.name = name
+        self.labels = []
+        self.codes = {}
+        self.lock = threading.Lock()
+        self.add(labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def dtype(self):
+        return np.int16 if len(self) < np.iinfo(np.int16).max else np.int32
+
+    def add(self, labels):
+        """Register the labels not known yet."""
+        with self.lock:
+            for label in labels:
+                if label is not None and label not in self.codes:
+                    self.codes[label] = len(self.labels)
+                    self.labels.append(label)
+
+    def encode(self, values):
+        """
+        Codes of the values, new labels being registered.
+
+        Only the distinct values are converted to labels, not every row.
+
+        :return: Array of codes (int16, or int32 for large dimensions), -1 if missing.
+        """
+        if isinstance(getattr(values, "dtype", None), pd.CategoricalDtype):
+            # Already coded: only its categories are converted
+            categorical = pd.Categorical(values)
+            category_codes = np.append(self.encode(categorical.categories), -1)
+            return category_codes[categorical.codes].astype(self.dtype)
+
+        inverse, uniques = pd.factorize(pd.Series(values, dtype=object))
+        unique_labels = [to_label(value) for value in uniques]
+        self.add(unique_labels)
+        unique_codes = np.array(
+            [-1 if label is None else self.codes[label] for label in unique_labels]
+            + [-1],  # Missing values: factorize gives them -1, i.e. this last slot
+            dtype=np.int64,
+        )
+        return unique_codes[inverse].astype(self.dtype)
+
+    def decode(self, codes):
+        """Labels of the codes, None for -1."""
+        labels = np.array(self.labels + [None], dtype=object)
+        return labels[np.asarray(codes)]
+
+    def categorical(self, values):
+        """Values as a categorical over all the labels of the dimension."""
+        if isinstance(values, pd.Series):
+            index = values.index
+        else:
+            index = None
+        codes = self.encode(values)
+        return pd.Series(
+            pd.Categorical.from_codes(codes, categories=list(self.labels)),
+            index=index,
+        )
+
+    def isin(self, values, selected):
+        """Boolean mask of the values among `selected`, compared on their codes."""
+        selected = [to_label(value) for value in selected]
+        wanted = [self.codes[label] for label in selected if label in self.codes]
+        return np.isin(self.encode(values), wanted)
+
+
+class Dimensions:
+    """The lot, mapsheet and quality condition dimensions."""
+
+    def __init__(self, lots=(), sheets=(), conditions=()):
+        self.lots = Dimension("lots", lots)
+        self.sheets = Dimension("sheets", sheets)
+        self.conditions = Dimension("conditions", conditions)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def encode_frame(self, df, columns=DIMENSION_COLUMNS):
+        """
+        Copy of `df` whose dimension columns are categoricals of the dimension labels.
+
+        :param columns: Dict of column -> dimension name.
+        """
+        encoded = {
+            column: self[dimension].categorical(df[column])
+            for column, dimension in columns.items()
+            if column in df.columns
+        }
+        return df.assign(**encoded)
+
+
+def read_dimensions(gpkg_path):
+    """Dimensions with the lots and the mapsheets of the reference GeoPackage."""
+    # Not at the top: geocover_qa.aggregate imports `to_label` from here
+    from geocover_qa.aggregate import sort_key
+    from geocover_qa.utils import get_lots_perimeter
+
+    lots, sheets = set(), set()
+    for layer in LOT_LAYERS:
+        perimeter = get_lots_perimeter(gpkg_path, layername=layer)
+        lots.update(to_label(value) for value in perimeter["Lot"].unique())
+        if layer == SHEET_LAYER and "MSH_MAP_TITLE" in perimeter.columns:
+            sheets.update(
+                to_label(value) for value in perimeter["MSH_MAP_TITLE"].unique()
+            )
+    lots.discard(None)
+    sheets.discard(None)
+
+    return Dimensions(
+        lots=sorted(lots, key=sort_key),
+        sheets=sorted(sheets),
+    )
+
+
+def load_dimensions(gpkg_path=None):
+    """
+    Dimensions of the reference GeoPackage, loaded once per process.
+
+    Without the GeoPackage, all the codes are given when the labels are first seen.
+    """
+    from geocover_qa.utils import get_mapsheets_path
+
+    if gpkg_path is None:
+        gpkg_path = get_mapsheets_path()
+    key = os.path.abspath(str(gpkg_path))
+    with loaded_dimensions_lock:
+        if key not in loaded_dimensions:
+            try:
+                loaded_dimensions[key] = read_dimensions(gpkg_path)
+            except Exception as e:
+                logger.warning(f"Cannot read the dimensions of {gpkg_path}: {e}")
+                loaded_dimensions[key] = Dimensions()
+            dimensions = loaded_dimensions[key]
+            logger.debug(
+                f"{len(dimensions.lots)} lots, {len(dimensions.sheets)} mapsheets"
+            )
+        return loaded_dimensions[key]
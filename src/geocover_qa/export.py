@@ -0,0 +1,173 @@
+import os
+import re
+
+import pandas as pd
+from loguru import logger
+
+from geocover_qa.dimensions import to_label
+
+# Excel limits the sheet names to 31 characters, without []:*?/\
+EXCEL_SHEET_NAME_LENGTH = 31
+excel_forbidden_chars = re.compile(r"[\[\]:*?/\\]")
+# Number of rows used to guess the column widths
+COLUMN_WIDTH_SAMPLE = 200
+
+
+def sheet_name(name, used=()):
+    """Return a valid and unique Excel sheet name."""
+    name = excel_forbidden_chars.sub("_", str(name))[:EXCEL_SHEET_NAME_LENGTH]
+    candidate, counter = name, 1
+    while candidate in used:
+        counter += 1
+        suffix = f"_{counter}"
+        candidate = name[: EXCEL_SHEET_NAME_LENGTH - len(suffix)] + suffix
+    return candidate
+
+
+def write_excel_sheet(workbook, name, df, date_format):
+    """Write a DataFrame row by row, as required by the xlsxwriter constant_memory mode."""
+    worksheet = workbook.add_worksheet(name)
+    worksheet.write_row(0, 0, [str(column) for column in df.columns])
+
+    sample = df.head(COLUMN_WIDTH_SAMPLE)
+    for col, column in enumerate(df.columns):
+        width = max([len(str(column))] + [len(str(value)) for value in sample[column]])
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            worksheet.set_column(col, col, max(width, 19), date_format)
+        else:
+            worksheet.set_column(col, col, min(width + 2, 60))
+
+    values = df.astype(object).where(df.notna(), None)
+    for row, record in enumerate(values.itertuples(index=False, name=None), start=1):
+        worksheet.write_row(row, 0, record)
+
+    if len(df.columns) > 0:
+        worksheet.autofilter(0, 0, len(df), len(df.columns) - 1)
+
+
+def write_excel(sheets, xlsx_path):
+    """
+    Write several DataFrames into one workbook, one sheet each.
+
+    Uses the streaming (constant_memory) mode of xlsxwriter: the memory does not
+    grow with the number of rows. Falls back to the default pandas writer if
+    xlsxwriter is not installed.
+
+    :param sheets: Dict of sheet name -> DataFrame.
+    :param xlsx_path: Path of the workbook.
+    :return: Path of the workbook.
+    """
+    try:
+        import xlsxwriter
+    except ModuleNotFoundError:
+        logger.warning("xlsxwriter is not installed, using the default Excel writer")
+        with pd.ExcelWriter(xlsx_path) as writer:
+            used = []
+            for name, df in sheets.items():
+                used.append(sheet_name(name, used))
+                df.to_excel(writer, sheet_name=used[-1], index=False)
+        return xlsx_path
+
+    workbook = xlsxwriter.Workbook(xlsx_path, {"constant_memory": True})
+    date_format = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"})
+    try:
+        used = []
+        for name, df in sheets.items():
+            used.append(sheet_name(name, used))
+            write_excel_sheet(workbook, used[-1], df, date_format)
+    finally:
+        workbook.close()
+
+    return xlsx_path
+
+
+def export_table(df, path, sheet="Issue"):
+    """Write a DataFrame as xlsx, csv or parquet, according to the extension of `path`."""
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension == "xlsx":
+        write_excel({sheet: df}, path)
+    elif extension == "csv":
+        df.to_csv(path, index=False)
+    elif extension == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        raise ValueError(f"Unsupported table format '{extension}' for {path}")
+    logger.info(f"Written {len(df)} rows to {path}")
+
+    return path
+
+
+def export_stats_range(stats_over_time, output_dir, basename, formats=("xlsx",)):
+    """
+    Write the stats of a whole date range to a single file per format.
+
+    The workbook has one sheet per date; csv and parquet get a single long
+    table with a 'date' column, for downstream tooling.
+
+    :param stats_over_time: List of dicts with a 'date' and its 'stats' DataFrame.
+    :param output_dir: Output directory.
+    :param basename: Name of the files, without extension.
+    :param formats: Formats to write, among TABLE_FORMATS.
+    :return: List of the written paths.
+    """
+    paths = []
+    entries = sorted(stats_over_time, key=lambda entry: entry["date"])
+
+    if "xlsx" in formats:
+        sheets = {}
+        for entry in entries:
+            sheets[sheet_name(f"{entry['date']:%Y-%m-%d}", sheets)] = entry["stats"]
+        xlsx_path = os.path.join(output_dir, f"{basename}.xlsx")
+        paths.append(write_excel(sheets, xlsx_path))
+        logger.info(f"Written {len(sheets)} sheets to {xlsx_path}")
+
+    long_formats = [fmt for fmt in formats if fmt != "xlsx"]
+    if long_formats and entries:
+        all_stats = pd.concat(
+            [entry["stats"].assign(date=entry["date"]) for entry in entries],
+            ignore_index=True,
+        )
+        for fmt in long_formats:
+            paths.append(
+                export_table(all_stats, os.path.join(output_dir, f"{basename}.{fmt}"))
+            )
+
+    return paths
+
+
+def lot_labels(df):
+    """
+    Lots as string labels, e.g. of tables written when lots were numbers.
+
+    Tables written before the coded lots (see `geocover_qa.dimensions`) have
+    integer lots, which cannot be concatenated with the labels.
+    """
+    if "Lot" not in df.columns:
+        return df
+    return df.assign(Lot=df["Lot"].astype(object).map(to_label))
+
+
+def append_table(df, path):
+    """
+    Append rows to a csv or parquet table, creating it if needed.
+
+    csv files are appended in place; parquet files are rewritten.
+
+    :return: Path of the table.
+    """
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if not os.path.isfile(path):
+        return export_table(df, path)
+    rows = len(df)
+    if extension == "csv":
+        columns = pd.read_csv(path, nrows=0).columns.tolist()
+        df.reindex(columns=columns).to_csv(path, mode="a", header=False, index=False)
+    elif extension == "parquet":
+        frames = [lot_labels(pd.read_parquet(path)), lot_labels(df)]
+        df = pd.concat(frames, ignore_index=True)
+        df.to_parquet(path, index=False)
+    else:
+        raise ValueError(f"Cannot append to a '{extension}' table: {path}")
+    logger.info(f"Appended {rows} rows to {path}")
+
+    return path
@@ -0,0 +1,295 @@
+import re
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from loguru import logger
+
+# GCOVERP layers checked by default (the typo is part of the layer name)
+CHECKED_LAYERS = ["GC_BEDROCK", "GC_UNCO_DESPOSIT"]
+# Overlaps smaller than this area (m2) are ignored, as numerical noise
+MIN_OVERLAP_AREA = 0.01
+# Holes of the union of the polygons up to this area (m2) are reported as gaps
+MAX_GAP_AREA = 1000.0
+# Polygons up to this area (m2) and thinner than SLIVER_THINNESS are slivers
+MAX_SLIVER_AREA = 100.0
+# 4 * pi * area / perimeter ** 2: 1 for a disc, close to 0 for thin polygons
+SLIVER_THINNESS = 0.1
+
+# Columns of the IssuePoints/IssueLines/IssuePolygons layers of an issue.gdb
+ISSUE_COLUMNS = [
+    "IssueType",
+    "Code",
+    "CodeDescription",
+    "QualityCondition",
+    "Description",
+    "InvolvedObjects",
+]
+# Issue layer of each geometry type
+ISSUE_LAYER_TYPES = {
+    "IssuePoints": ("Point", "MultiPoint"),
+    "IssueLines": ("LineString", "MultiLineString"),
+    "IssuePolygons": ("Polygon", "MultiPolygon"),
+}
+
+invalid_location_pattern = re.compile(r"\[([-\d.eE+]+) ([-\d.eE+]+)\]")
+
+
+def involved_objects(layer, ids):
+    return [f"{layer}:{object_id}" for object_id in ids]
+
+
+def issues_frame(
+    geometries, issue_type, code, description, condition, details, involved
+):
+    """GeoDataFrame of issues in the issue.gdb schema, one row per geometry."""
+    size = len(geometries)
+    return gpd.GeoDataFrame(
+        {
+            "IssueType": [issue_type] * size,
+            "Code": [code] * size,
+            "CodeDescription": [description] * size,
+            "QualityCondition": [condition] * size,
+            "Description": list(details),
+            "InvolvedObjects": list(involved),
+        },
+        geometry=list(geometries),
+        crs="EPSG:2056",
+    )
+
+
+def check_invalid(geometries, ids, layer):
+    """
+    Invalid geometries, located at the reported error when GEOS gives one.
+
+    :return: Issues (points), and the mask of the valid geometries.
+    """
+    valid = shapely.is_valid(geometries)
+    invalid = np.flatnonzero(~valid & ~shapely.is_missing(geometries))
+    reasons = shapely.is_valid_reason(geometries[invalid])
+
+    locations = shapely.point_on_surface(shapely.make_valid(geometries[invalid]))
+    for i, reason in enumerate(reasons):
+        match = invalid_location_pattern.search(reason or "")
+        if match:
+            locations[i] = shapely.Point(float(match.group(1)), float(match.group(2)))
+
+    issues = issues_frame(
+        locations,
+        "Error",
+        "InvalidGeometry",
+        "Invalid geometry",
+        f"{layer}_ValidGeometry",
+        reasons,
+        involved_objects(layer, ids[invalid]),
+    )
+    return issues, valid
+
+
+def polygonal_parts(geometries):
+    """
+    Only the polygons of the geometry collections, e.g. of an intersection.
+
+    Polygons overlapping and also sharing an edge intersect as a collection of
+    a polygon and a line, which fits no issue layer.
+
+    :return: Geometries, collections replaced by the MultiPolygon of their polygons.
+    """
+    geometries = geometries.copy()
+    collections = np.flatnonzero(shapely.get_type_id(geometries) == 7)
+    parts, index = shapely.get_parts(geometries[collections], return_index=True)
+    polygonal = np.isin(shapely.get_type_id(parts), (3, 6))
+    collected = np.full(len(collections), None, dtype=object)
+    if polygonal.any():
+        # MultiPolygons are exploded too, each polygon keeping its collection
+        polygons, part_index = shapely.get_parts(parts[polygonal], return_index=True)
+        collected = shapely.multipolygons(
+            polygons, indices=index[polygonal][part_index], out=collected
+        )
+    geometries[collections] = collected
+    return geometries
+
+
+def check_overlaps(geometries, ids, layer, min_area=MIN_OVERLAP_AREA):
+    """
+    Polygons of a same layer whose interiors overlap.
+
+    Candidate pairs come from a STRtree; pairs only touching are discarded
+    with their DE-9IM matrix before any intersection is computed.
+
+    :return: Issues (overlap polygons), one per overlapping pair.
+    """
+    tree = shapely.STRtree(geometries)
+    left, right = tree.query(geometries, predicate="intersects")
+    pairs = left < right
+    left, right = left[pairs], right[pairs]
+
+    # Interiors intersecting in 2D: first cell of the DE-9IM matrix is '2'
+    matrices = shapely.relate(geometries[left], geometries[right]).astype(str)
+    overlapping = np.char.startswith(matrices, "2")
+    left, right = left[overlapping], right[overlapping]
+
+    overlaps = polygonal_parts(
+        shapely.intersection(geometries[left], geometries[right])
+    )
+    areas = shapely.area(overlaps)
+    keep = areas >= min_area
+    left, right, overlaps, areas = left[keep], right[keep], overlaps[keep], areas[keep]
+    logger.debug(f"{layer}: {len(overlaps)} overlaps")
+
+    return issues_frame(
+        overlaps,
+        "Error",
+        "Overlap",
+        "Overlapping polygons",
+        f"{layer}_NoOverlaps",
+        [f"Overlap of {area:.2f} m2" for area in areas],
+        [
+            ";".join(involved_objects(layer, pair))
+            for pair in zip(ids[left], ids[right])
+        ],
+    )
+
+
+def check_gaps(geometries, layer, max_area=MAX_GAP_AREA):
+    """
+    Small holes between the polygons: the holes of their union up to `max_area`.
+
+    Larger holes are considered as intended (e.g. lakes, other layers).
+
+    :return: Issues (gap polygons).
+    """
+    union = shapely.union_all(geometries)
+    polygons = shapely.get_parts(union)
+    polygons = polygons[shapely.get_type_id(polygons) == 3]
+    counts = shapely.get_num_interior_rings(polygons)
+    if counts.sum() == 0:
+        return issues_frame([], "Warning", "Gap", "", "", [], [])
+
+    polygon_index = np.repeat(np.arange(len(polygons)), counts)
+    ring_index = np.concatenate([np.arange(count) for count in counts])
+    rings = shapely.get_interior_ring(polygons[polygon_index], ring_index)
+    gaps = shapely.polygons(rings)
+
+    # Parts of the union lying inside a hole (islands) are not part of the gap
+    tree = shapely.STRtree(polygons)
+    gap_index, island_index = tree.query(gaps, predicate="contains_properly")
+    for gap in np.unique(gap_index):
+        islands = polygons[island_index[gap_index == gap]]
+        gaps[gap] = shapely.difference(gaps[gap], shapely.union_all(islands))
+
+    return gap_issues(gaps, layer, max_area=max_area)
+
+
+def gap_issues(gaps, layer, max_area=MAX_GAP_AREA):
+    """Issues of the gap polygons up to `max_area`."""
+    areas = shapely.area(gaps)
+    keep = areas <= max_area
+    logger.debug(f"{layer}: {keep.sum()} gaps")
+
+    return issues_frame(
+        gaps[keep],
+        "Warning",
+        "Gap",
+        "Gap between polygons",
+        f"{layer}_NoGaps",
+        [f"Gap of {area:.2f} m2" for area in areas[keep]],
+        [""] * int(keep.sum()),
+    )
+
+
+def check_slivers(
+    geometries, ids, layer, max_area=MAX_SLIVER_AREA, thinness=SLIVER_THINNESS
+):
+    """
+    Small and thin polygons, by their thinness ratio (see SLIVER_THINNESS).
+
+    :return: Issues (sliver polygons).
+    """
+    areas = shapely.area(geometries)
+    perimeters = shapely.length(geometries)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = np.where(perimeters > 0, 4 * np.pi * areas / perimeters**2, 1.0)
+    slivers = np.flatnonzero((areas <= max_area) & (ratios < thinness))
+    logger.debug(f"{layer}: {len(slivers)} slivers")
+
+    return issues_frame(
+        geometries[slivers],
+        "Warning",
+        "Sliver",
+        "Sliver polygon",
+        f"{layer}_NoSlivers",
+        [
+            f"Area {area:.2f} m2, thinness {ratio:.3f}"
+            for area, ratio in zip(areas[slivers], ratios[slivers])
+        ],
+        involved_objects(layer, ids[slivers]),
+    )
+
+
+def check_layer(gdf, layer, id_column="UUID", gaps=True):
+    """
+    Run all the checks on the polygons of a layer.
+
+    Invalid geometries are reported, then left out of the other checks.
+
+    :param gdf: GeoDataFrame of the layer.
+    :param layer: Name of the layer, used in the quality conditions.
+    :param id_column: Column identifying the objects in the issues (default: the index).
+    :param gaps: Whether to check the gaps (see `geocover_qa.tiling` when tiled).
+    :return: GeoDataFrame of the issues, in the issue.gdb schema.
+    """
+    geometries = np.asarray(gdf.geometry.values)
+    if id_column in gdf.columns:
+        ids = gdf[id_column].astype(str).to_numpy()
+    else:
+        ids = gdf.index.astype(str).to_numpy()
+
+    invalid_issues, valid = check_invalid(geometries, ids, layer)
+    geometries, ids = geometries[valid], ids[valid]
+
+    issues = [
+        df
+        for df in (
+            invalid_issues,
+            check_overlaps(geometries, ids, layer),
+            check_gaps(geometries, layer) if gaps else [],
+            check_slivers(geometries, ids, layer),
+        )
+        if len(df)
+    ]
+    if issues:
+        issues = pd.concat(issues, ignore_index=True)
+    else:
+        issues = issues_frame([], "", "", "", "", [], [])
+    logger.info(f"{layer}: {len(gdf)} objects, {len(issues)} issues")
+
+    return gpd.GeoDataFrame(issues, geometry="geometry", crs="EPSG:2056")
+
+
+def write_issues(issues, path):
+    """
+    Write issues as the IssuePoints/IssueLines/IssuePolygons layers read by `get_stats`.
+
+    The three layers are always created, even if empty. The format follows the
+    extension of `path`: FileGDB (.gdb, GDAL >= 3.6) or GeoPackage (.gpkg).
+
+    :return: Path of the dataset.
+    """
+    driver = "OpenFileGDB" if path.rstrip("/\\").endswith(".gdb") else "GPKG"
+    geometry_types = issues.geometry.geom_type.to_numpy()
+    for layer, types in ISSUE_LAYER_TYPES.items():
+        layer_issues = issues[np.isin(geometry_types, types)]
+        layer_issues = layer_issues[ISSUE_COLUMNS + ["geometry"]].reset_index(drop=True)
+        layer_issues.to_file(
+            path,
+            layer=layer,
+            driver=driver,
+            engine="pyogrio",
+            geometry_type=f"Multi{types[0]}" if types[0] != "Point" else "Point",
+            promote_to_multi=types[0] != "Point",
+        )
+        logger.info(f"Written {len(layer_issues)} issues to {path}/{layer}")
+
+    return path
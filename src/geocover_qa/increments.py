@@ -0,0 +1,204 @@
+"""
+Retention and selective restore of the GCOVERP increment backups.
+
+Increments (`20241001_GCOVERP_2030-12-31.gdb` and their `.gdb.zip`) are
+kept daily for RETENTION_DAILY_DAYS, then the last one of each ISO week up
+to RETENTION_WEEKLY_DAYS, then the last one of each month:
+
+    plan = plan_retention(find_increments(INCREMENTS_DIR))
+    apply_retention(plan, dry_run=False)
+
+Restoring a table only extracts its own files from a zipped increment (and
+the small system tables a FileGDB needs to open), found through the system
+catalog `a00000001.gdbtable`, read in place through /vsizip/:
+
+    extract_tables("20241001_GCOVERP_2030-12-31.gdb.zip", ["GC_BEDROCK"], "restore")
+"""
+
+import os
+import re
+import shutil
+import zipfile
+from datetime import datetime
+
+import pandas as pd
+from loguru import logger
+
+from geocover_qa.config import RETENTION_DAILY_DAYS, RETENTION_WEEKLY_DAYS
+from geocover_qa.source import layer_matches
+from geocover_qa.utils import parse_increment_gdb
+from geocover_qa.verify import SIDECAR_SUFFIXES
+
+increment_pattern = re.compile(r"\d{8}_GCOVERP_(2030-12-31|2016-12-31)\.gdb(\.zip)?$")
+# Files of a FileGDB besides the tables, needed to open it
+GDB_HEADER_FILES = ["gdb", "timestamps"]
+
+
+def find_increments(base_dir):
+    """Paths of the increment GDB and zips below `base_dir`, sorted."""
+    paths = []
+    for root, dirs, files in os.walk(base_dir):
+        paths += [
+            os.path.join(root, name)
+            for name in dirs + files
+            if increment_pattern.match(name)
+        ]
+        # Do not walk into the GDB
+        dirs[:] = [d for d in dirs if not d.endswith(".gdb")]
+    return sorted(paths)
+
+
+def retention_buckets(dates, today, daily_days, weekly_days):
+    """
+    Retention bucket of each date: the day, ISO week or month it stands for.
+
+    :param dates: Series of datetimes.
+    :return: Series of the buckets, e.g. "2024-10-01", "2024-W40" or "2024-10".
+    """
+    age = (pd.Timestamp(today).normalize() - dates.dt.normalize()).dt.days
+    iso = dates.dt.isocalendar()
+    weeks = iso["year"].astype(str) + "-W" + iso["week"].astype(str).str.zfill(2)
+    buckets = dates.dt.strftime("%Y-%m")
+    buckets = buckets.where(age >= weekly_days, weeks)
+    return buckets.where(age >= daily_days, dates.dt.strftime("%Y-%m-%d"))
+
+
+def plan_retention(
+    paths,
+    today=None,
+    daily_days=RETENTION_DAILY_DAYS,
+    weekly_days=RETENTION_WEEKLY_DAYS,
+):
+    """
+    Which increments to keep: the most recent one of each bucket, per release.
+
+    The GDB and the zip of a same increment are kept or removed together.
+
+    :param paths: Paths of the increments, see `find_increments`.
+    :param today: Reference date of the ages (default: now).
+    :return: DataFrame with the columns file_path, date, RC, extension, bucket and keep.
+    """
+    records = [parse_increment_gdb(path) for path in paths]
+    plan = pd.DataFrame(
+        [record for record in records if record],
+        columns=["date", "file_path", "RC", "week", "extension"],
+    )
+    if plan.empty:
+        return plan.assign(bucket=pd.Series(dtype=str), keep=pd.Series(dtype=bool))
+
+    plan["date"] = pd.to_datetime(plan["date"])
+    plan["bucket"] = retention_buckets(
+        plan["date"], today or datetime.now(), daily_days, weekly_days
+    )
+    last_dates = plan.groupby(["RC", "bucket"])["date"].transform("max")
+    plan["keep"] = plan["date"] == last_dates
+
+    return plan.sort_values(["RC", "date"], ascending=[True, False], ignore_index=True)
+
+
+def path_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path)
+        for name in files
+    )
+
+
+def apply_retention(plan, dry_run=True):
+    """
+    Remove the increments not kept by a plan, with their SHA-256 sidecars.
+
+    :param plan: See `plan_retention`.
+    :param dry_run: Only log what would be removed.
+    :return: Number of bytes freed (or to be freed).
+    """
+    freed = 0
+    for path in plan.loc[~plan["keep"], "file_path"]:
+        sidecars = [f"{path}{suffix}" for suffix in SIDECAR_SUFFIXES]
+        sidecars = [sidecar for sidecar in sidecars if os.path.isfile(sidecar)]
+        size = path_size(path) + sum(os.path.getsize(s) for s in sidecars)
+        freed += size
+        if dry_run:
+            logger.info(f"Would remove {path} ({size / 1e6:.1f} MB)")
+            continue
+        logger.info(f"Removing {path} ({size / 1e6:.1f} MB)")
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        for sidecar in sidecars:
+            os.remove(sidecar)
+    return freed
+
+
+def gdb_prefix(zipf):
+    """Path of the GDB directory inside a zip, e.g. '20241001_GCOVERP_2030-12-31.gdb/'."""
+    for name in zipf.namelist():
+        if name.endswith("a00000001.gdbtable"):
+            return name[: -len("a00000001.gdbtable")]
+    raise ValueError(f"No FileGDB system catalog in {zipf.filename}")
+
+
+def read_catalog(zip_path, prefix):
+    """
+    Tables of a zipped FileGDB, read from its system catalog without extracting it.
+
+    :return: Series of the table names, indexed by their number (a0000000N.gdbtable).
+    """
+    import pyogrio
+
+    catalog = pyogrio.read_dataframe(
+        f"/vsizip/{zip_path}/{prefix.rstrip('/')}",
+        layer="GDB_SystemCatalog",
+        read_geometry=False,
+        fid_as_index=True,
+        LIST_ALL_TABLES="YES",
+    )
+    return catalog["Name"]
+
+
+def extract_tables(zip_path, tables, output_dir):
+    """
+    Extract a FileGDB from a zipped increment, with only the files of `tables`.
+
+    The system tables are extracted as well, so that the result opens as a
+    FileGDB holding the requested tables.
+
+    :param zip_path: Path of the .gdb.zip.
+    :param tables: Table names, with or without owner prefix (see `layer_matches`).
+    :param output_dir: Directory where the GDB directory is written.
+    :return: Path of the extracted GDB.
+    """
+    with zipfile.ZipFile(zip_path) as zipf:
+        prefix = gdb_prefix(zipf)
+        catalog = read_catalog(zip_path, prefix)
+
+        numbers = set(catalog.index[catalog.str.startswith("GDB_")])
+        for table in tables:
+            matching = [
+                fid for fid, name in catalog.items() if layer_matches(name, table)
+            ]
+            if not matching:
+                raise ValueError(f"No table {table} in {zip_path}")
+            numbers.update(matching)
+
+        stems = {f"a{number:08x}." for number in numbers}
+        members = [
+            name
+            for name in zipf.namelist()
+            if name.startswith(prefix)
+            and not name.endswith("/")
+            and (
+                name[len(prefix) :] in GDB_HEADER_FILES
+                or name[len(prefix) :].split(".")[0] + "." in stems
+            )
+        ]
+        for member in members:
+            zipf.extract(member, output_dir)
+
+    logger.info(
+        f"Extracted {len(members)} files of {', '.join(tables)} from {zip_path}"
+    )
+    return os.path.join(output_dir, prefix.rstrip("/"))
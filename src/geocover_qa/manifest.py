@@ -0,0 +1,140 @@
+"""
+Checkpoints of long batch runs, e.g. `qa stat` over a year of issue.gdb.
+
+The manifest records, for each issue.gdb, whether it was processed, its
+output files and its grouped stats (pickled next to the manifest). A run
+started again with `--resume` reuses the completed entries instead of
+reading their issue.gdb again.
+"""
+
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+import pandas as pd
+from loguru import logger
+
+from geocover_qa.config import RETRY_ATTEMPTS, RETRY_DELAY
+
+MANIFEST_FILENAME = "stat_manifest.json"
+# Directory of the pickled stats, next to the manifest
+CHECKPOINTS_DIRNAME = ".checkpoints"
+
+
+def call_with_retry(func, *args, attempts=RETRY_ATTEMPTS, delay=RETRY_DELAY, **kwargs):
+    """
+    Call `func`, again after `delay`, 2 * `delay`, ... seconds while it raises.
+
+    :param attempts: Total number of calls, at least 1.
+    :raise: The exception of the last attempt.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            wait = delay * 2 ** (attempt - 1)
+            logger.warning(
+                f"Attempt {attempt}/{attempts} failed: {e}, retrying in {wait}s"
+            )
+            time.sleep(wait)
+
+
+class RunManifest:
+    """
+    JSON manifest of the issue.gdb processed by a batch run.
+
+    Entries are keyed by the path of the issue.gdb. The options the outputs
+    depend on are recorded: entries completed with other options are not
+    reused.
+
+        manifest = RunManifest(os.path.join(output_dir, MANIFEST_FILENAME), options)
+        stats = manifest.completed_stats(gdb_path)
+        if stats is None:
+            ...
+            manifest.complete(gdb_path, stats, outputs=[table_path])
+    """
+
+    def __init__(self, path, options=None):
+        self.path = path
+        self.options = options or {}
+        self.checkpoints_dir = os.path.join(os.path.dirname(path), CHECKPOINTS_DIRNAME)
+        self.entries = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            if manifest.get("options") == self.options:
+                self.entries = manifest["entries"]
+            else:
+                logger.warning(f"Options changed since {path}, not resuming from it")
+
+    def reset(self):
+        """Forget all the entries."""
+        self.entries = {}
+        self.save()
+
+    def save(self):
+        # Written aside then renamed: never left half written when interrupted
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {"options": self.options, "entries": self.entries},
+                f,
+                indent=2,
+                default=str,
+            )
+        os.replace(tmp_path, self.path)
+
+    def checkpoint_path(self, gdb_path):
+        name = hashlib.sha1(gdb_path.encode()).hexdigest()[:16]
+        return os.path.join(self.checkpoints_dir, f"{name}.pickle")
+
+    def completed_stats(self, gdb_path):
+        """
+        Stats of a completed entry, None if not completed or its outputs are missing.
+        """
+        entry = self.entries.get(gdb_path)
+        if entry is None or entry["status"] != "done":
+            return None
+        missing = [
+            path
+            for path in entry["outputs"] + [entry["checkpoint"]]
+            if not os.path.exists(path)
+        ]
+        if missing:
+            logger.info(f"{missing[0]} is missing, processing {gdb_path} again")
+            return None
+        return pd.read_pickle(entry["checkpoint"])
+
+    def complete(self, gdb_path, stats, outputs=()):
+        """Record a processed issue.gdb, with its stats and output files."""
+        os.makedirs(self.checkpoints_dir, exist_ok=True)
+        checkpoint = self.checkpoint_path(gdb_path)
+        stats.to_pickle(checkpoint)
+        self.entries[gdb_path] = {
+            "status": "done",
+            "checkpoint": checkpoint,
+            "outputs": list(outputs),
+            "finished": datetime.now().isoformat(timespec="seconds"),
+        }
+        self.save()
+
+    def fail(self, gdb_path, error, attempts):
+        """Record an issue.gdb which could not be processed."""
+        self.entries[gdb_path] = {
+            "status": "failed",
+            "error": str(error),
+            "attempts": attempts,
+            "finished": datetime.now().isoformat(timespec="seconds"),
+        }
+        self.save()
+
+    def failed(self):
+        """Paths of the issue.gdb which failed."""
+        return sorted(
+            path for path, entry in self.entries.items() if entry["status"] == "failed"
+        )
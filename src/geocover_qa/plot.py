@@ -0,0 +1,481 @@
+import hashlib
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import numpy as np
+import shapely
+from loguru import logger
+
+from geocover_qa.config import MAX_PLOTTED_FEATURES
+from geocover_qa.dimensions import to_label
+
+# Size of the rendered maps (inches) and resolution
+MAP_SIZE = (16, 12)
+MAP_DPI = 100
+MAP_MARGIN = 0.05
+ISSUES_CMAP = "Set1"
+# Size of the density raster cells, in screen pixels
+DENSITY_CELL_PIXELS = 4
+
+# Base layers of the map workers, set once per process by `init_map_worker`
+base_layers = []
+
+
+def map_extent(bounds, margin=MAP_MARGIN, size=MAP_SIZE):
+    """
+    Return the (x_min, x_max, y_min, y_max) extent of a map around `bounds`.
+
+    The extent is expanded to the aspect ratio of the figure, so that a
+    background rendered for it can be reused pixel for pixel.
+    """
+    x_min, y_min, x_max, y_max = bounds
+    x_margin = (x_max - x_min) * margin
+    y_margin = (y_max - y_min) * margin
+    x_min, x_max = x_min - x_margin, x_max + x_margin
+    y_min, y_max = y_min - y_margin, y_max + y_margin
+
+    width, height = x_max - x_min, y_max - y_min
+    ratio = size[0] / size[1]
+    if width / height < ratio:
+        delta = (height * ratio - width) / 2
+        x_min, x_max = x_min - delta, x_max + delta
+    else:
+        delta = (width / ratio - height) / 2
+        y_min, y_max = y_min - delta, y_max + delta
+
+    return (x_min, x_max, y_min, y_max)
+
+
+def new_map_figure(extent, size=MAP_SIZE, dpi=MAP_DPI, frameless=False):
+    """Create an Agg figure (no pyplot state) with a single map axis."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=size, dpi=dpi)
+    FigureCanvasAgg(fig)
+    if frameless:
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.set_axis_off()
+    else:
+        ax = fig.add_subplot(111)
+    ax.set_xlim(extent[0], extent[1])
+    ax.set_ylim(extent[2], extent[3])
+    ax.set_aspect("equal")
+
+    return fig, ax
+
+
+def pixel_size(ax):
+    """Size of a screen pixel in map units, for the current limits of `ax`."""
+    x_min, x_max = ax.get_xlim()
+    y_min, y_max = ax.get_ylim()
+    bbox = ax.get_window_extent()
+    return max(
+        (x_max - x_min) / max(bbox.width, 1), (y_max - y_min) / max(bbox.height, 1)
+    )
+
+
+def split_coordinates(geometries):
+    """Vertices of each geometry as a list of (n, 2) arrays, and the geometry index of each array."""
+    coords, index = shapely.get_coordinates(geometries, return_index=True)
+    if len(coords) == 0:
+        return [], np.array([], dtype=int)
+    starts = np.flatnonzero(np.diff(index)) + 1
+    return np.split(coords, starts), index[np.r_[0, starts]]
+
+
+def draw_geometries(ax, geometries, colors, resolution):
+    """
+    Draw geometries simplified to `resolution` as matplotlib collections.
+
+    Multi-part geometries are exploded, parts smaller than a pixel (or
+    vanishing when simplified) are drawn as points and polygons are drawn by
+    their exterior ring only.
+    """
+    from matplotlib.collections import LineCollection, PolyCollection
+
+    parts, part_index = shapely.get_parts(geometries, return_index=True)
+    part_colors = colors[part_index]
+    # Bounds before simplifying: parts collapsing when simplified are still drawn as points
+    bounds = shapely.bounds(parts)
+    parts = shapely.simplify(parts, resolution, preserve_topology=False)
+
+    tiny = ((bounds[:, 2] - bounds[:, 0]) < resolution) & (
+        (bounds[:, 3] - bounds[:, 1]) < resolution
+    )
+    # Slivers longer than a pixel but thinner than one also simplify to empty
+    tiny |= shapely.is_empty(parts)
+    type_ids = shapely.get_type_id(parts)
+    polygons = (type_ids == 3) & ~tiny
+    lines = np.isin(type_ids, (1, 2)) & ~tiny
+    points = (type_ids == 0) | (tiny & ~np.isnan(bounds[:, 0]))
+
+    vertices, index = split_coordinates(shapely.get_exterior_ring(parts[polygons]))
+    if vertices:
+        color = part_colors[polygons][index]
+        ax.add_collection(
+            PolyCollection(vertices, facecolors=color, edgecolors=color, linewidths=0.5)
+        )
+
+    vertices, index = split_coordinates(parts[lines])
+    if vertices:
+        ax.add_collection(
+            LineCollection(vertices, colors=part_colors[lines][index], linewidths=1)
+        )
+
+    if points.any():
+        x = (bounds[points, 0] + bounds[points, 2]) / 2
+        y = (bounds[points, 1] + bounds[points, 3]) / 2
+        ax.scatter(x, y, s=4, c=part_colors[points], linewidths=0)
+
+
+def draw_density(ax, bounds, codes, resolution, cmap):
+    """
+    Draw a density raster of the issues, colored by their most frequent code per cell.
+
+    The cost depends on the number of cells, not on the number of issues.
+    """
+    x_min, x_max = ax.get_xlim()
+    y_min, y_max = ax.get_ylim()
+    cell = resolution * DENSITY_CELL_PIXELS
+    nx = max(int(np.ceil((x_max - x_min) / cell)), 1)
+    ny = max(int(np.ceil((y_max - y_min) / cell)), 1)
+    n_codes = int(codes.max()) + 1
+
+    x = np.clip(((bounds[:, 0] + bounds[:, 2]) / 2 - x_min) // cell, 0, nx - 1)
+    y = np.clip(((bounds[:, 1] + bounds[:, 3]) / 2 - y_min) // cell, 0, ny - 1)
+    cells = (y.astype(np.int64) * nx + x.astype(np.int64)) * n_codes + codes
+    counts = np.bincount(cells, minlength=nx * ny * n_codes).reshape(ny, nx, n_codes)
+
+    total = counts.sum(axis=2)
+    image = cmap(counts.argmax(axis=2) % cmap.N)
+    image[..., 3] = np.where(
+        total > 0, 0.35 + 0.65 * np.log1p(total) / np.log1p(total.max()), 0
+    )
+    ax.imshow(
+        image,
+        origin="lower",
+        extent=(x_min, x_min + nx * cell, y_min, y_min + ny * cell),
+        interpolation="nearest",
+        zorder=1,
+    )
+    ax.set_xlim(x_min, x_max)
+    ax.set_ylim(y_min, y_max)
+
+
+def draw_issues(
+    ax,
+    geometries,
+    codes,
+    labels=None,
+    max_features=MAX_PLOTTED_FEATURES,
+    cmap=ISSUES_CMAP,
+    legend=True,
+):
+    """
+    Draw issues on `ax`, at a cost independent of the number of issues.
+
+    Only the issues in the current limits of `ax` are drawn. Up to `max_features`,
+    the geometries are simplified to the pixel size and drawn as collections;
+    above, a density raster colored by the dominant code is drawn instead.
+
+    :param ax: Matplotlib axis, with its final limits already set.
+    :param geometries: Array of shapely geometries.
+    :param codes: Integer code (category) of each geometry.
+    :param labels: Optional label of each code, for the legend.
+    :param max_features: Number of visible issues above which a density raster is drawn.
+    :param cmap: Colormap of the codes.
+    :param legend: Add a legend with the number of issues per code.
+    :return: Number of visible issues.
+    """
+    from matplotlib.patches import Patch
+
+    if isinstance(cmap, str):
+        cmap = matplotlib.colormaps[cmap]
+    geometries = np.asarray(geometries)
+    codes = np.asarray(codes, dtype=np.int64)
+
+    bounds = shapely.bounds(geometries)
+    x_min, x_max = ax.get_xlim()
+    y_min, y_max = ax.get_ylim()
+    visible = (
+        (bounds[:, 2] >= x_min)
+        & (bounds[:, 0] <= x_max)
+        & (bounds[:, 3] >= y_min)
+        & (bounds[:, 1] <= y_max)
+        & (codes >= 0)
+    )
+    geometries, codes, bounds = geometries[visible], codes[visible], bounds[visible]
+    if len(geometries) == 0:
+        return 0
+
+    resolution = pixel_size(ax)
+    if len(geometries) > max_features:
+        logger.debug(f"Drawing a density raster of {len(geometries)} issues")
+        draw_density(ax, bounds, codes, resolution, cmap)
+    else:
+        draw_geometries(ax, geometries, cmap(codes % cmap.N), resolution)
+        ax.set_xlim(x_min, x_max)
+        ax.set_ylim(y_min, y_max)
+
+    if legend and labels is not None:
+        counts = np.bincount(codes, minlength=len(labels))
+        handles = [
+            Patch(color=cmap(code % cmap.N), label=f"{labels[code]} ({count})")
+            for code, count in enumerate(counts)
+            if count > 0
+        ]
+        ax.legend(handles=handles, title="Code", loc="upper left", fontsize="small")
+
+    return len(geometries)
+
+
+def outline_collection(geometries, tolerance=0, **kwargs):
+    """
+    Outlines of polygons as a single LineCollection, simplified to `tolerance`.
+
+    Meant for the base layers (CH, lots, mapsheets): built once, then kept on
+    the axis whatever the extent.
+
+    :param geometries: Array of shapely polygons or multi-polygons.
+    :param tolerance: Simplification tolerance, in map units.
+    :param kwargs: Style of the collection (colors, linewidths, alpha, ...).
+    """
+    from matplotlib.collections import LineCollection
+
+    rings = shapely.get_parts(shapely.boundary(shapely.get_parts(geometries)))
+    if tolerance:
+        rings = shapely.simplify(rings, tolerance)
+    vertices, _ = split_coordinates(rings)
+
+    return LineCollection(vertices, **kwargs)
+
+
+def plot_issues(issues, ax, column="Code", **kwargs):
+    """Draw a GeoDataFrame of issues with `draw_issues`, colored by `column`."""
+    categories = issues[column].astype("category")
+    return draw_issues(
+        ax,
+        issues.geometry.values,
+        categories.cat.codes.to_numpy(),
+        labels=list(categories.cat.categories),
+        **kwargs,
+    )
+
+
+def init_map_worker(layers):
+    """Process pool initializer: select the Agg backend and keep the base layers."""
+    matplotlib.use("Agg")
+    global base_layers
+    base_layers = layers
+
+
+def render_background(path, extent):
+    """Rasterize the base layers (outlines of CH, lots, ...) for `extent` into `path`."""
+    import geopandas as gpd
+
+    fig, ax = new_map_figure(extent, frameless=True)
+    for wkb, style in base_layers:
+        gpd.GeoSeries(shapely.from_wkb(wkb)).plot(ax=ax, facecolor="none", **style)
+    ax.set_xlim(extent[0], extent[1])
+    ax.set_ylim(extent[2], extent[3])
+    fig.savefig(path, dpi=MAP_DPI, transparent=True)
+
+    return path
+
+
+def render_issue_map(task):
+    """Render one issue map over its pre-rasterized background and save it as PNG."""
+    from matplotlib.image import imread
+
+    extent = task["extent"]
+    fig, ax = new_map_figure(extent)
+    ax.imshow(imread(task["background"]), extent=extent, zorder=0)
+
+    if len(task["geometry"]) > 0:
+        draw_issues(
+            ax,
+            shapely.from_wkb(task["geometry"]),
+            task["code"],
+            labels=task["labels"],
+            max_features=task["max_features"],
+        )
+
+    ax.set_title(task["title"])
+    fig.savefig(task["path"], dpi=MAP_DPI)
+
+    return task["path"]
+
+
+def safe_filename(value):
+    return re.sub(r"[^\w.-]+", "_", str(value)).strip("_")
+
+
+def perimeter_labels(perimeter, column):
+    """Labels of `column` for each row of the perimeter (see `to_label`)."""
+    return perimeter[column].map(lambda value: to_label(value) or "")
+
+
+def render_issue_maps(
+    issues,
+    perimeter,
+    base_layers_gdfs,
+    output_dir,
+    columns=("Lot", "MSH_MAP_TITLE"),
+    title="",
+    cache_dir=None,
+    max_workers=None,
+    max_features=MAX_PLOTTED_FEATURES,
+):
+    """
+    Render one PNG issue map per lot and per mapsheet in a process pool.
+
+    The issues are partitioned with the assignment computed by the spatial join
+    of `get_stats` (the `index_right` column, pointing to a row of `perimeter`),
+    so the issue layers are read only once. The base layers are rasterized once
+    per extent into `cache_dir` and reused as background by the following runs.
+
+    :param issues: Combined issues as returned by `get_stats`.
+    :param perimeter: Perimeter used for the spatial join (e.g. lots/mapsheets).
+    :param base_layers_gdfs: List of (GeoDataFrame, style) drawn as outlines in the background.
+    :param output_dir: Directory of the PNG maps.
+    :param columns: Columns of `perimeter` to render a map for each of their values.
+    :param title: Prefix of the map titles.
+    :param cache_dir: Directory of the rasterized backgrounds (default: `output_dir`/backgrounds).
+    :param max_workers: Number of processes.
+    :param max_features: Number of issues above which a map shows a density raster.
+    :return: List of the paths of the rendered maps.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if cache_dir is None:
+        cache_dir = os.path.join(output_dir, "backgrounds")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    layers = [
+        (shapely.to_wkb(gdf.geometry.values), style) for gdf, style in base_layers_gdfs
+    ]
+    categories = issues["Code"].astype("category")
+    codes = categories.cat.codes.to_numpy()
+    code_labels = list(categories.cat.categories)
+    geometries = shapely.to_wkb(issues.geometry.values)
+    assignment = issues["index_right"].to_numpy()
+
+    backgrounds = []
+    tasks = []
+    for column in columns:
+        if column not in perimeter.columns:
+            logger.warning(f"No column '{column}' in the perimeter, skipping")
+            continue
+        labels = perimeter_labels(perimeter, column)
+        issue_labels = labels.reindex(assignment).to_numpy()
+
+        for label in labels.unique():
+            if label == "":
+                continue
+            bounds = perimeter.geometry[labels == label].total_bounds
+            extent = map_extent(bounds)
+            # The extent is part of the name, a changed perimeter gets a new background
+            extent_key = hashlib.sha1(repr(np.round(extent)).encode()).hexdigest()[:8]
+            background = os.path.join(
+                cache_dir,
+                f"{safe_filename(column)}_{safe_filename(label)}_{extent_key}.png",
+            )
+            if not os.path.isfile(background):
+                backgrounds.append((background, extent))
+
+            mask = issue_labels == label
+            tasks.append(
+                {
+                    "path": os.path.join(
+                        output_dir, f"{safe_filename(column)}_{safe_filename(label)}.png"
+                    ),
+                    "extent": extent,
+                    "background": background,
+                    "geometry": geometries[mask],
+                    "code": codes[mask],
+                    "labels": code_labels,
+                    "max_features": max_features,
+                    "title": f"{title} {column} {label} ({mask.sum()} issues)".strip(),
+                }
+            )
+
+    logger.info(f"Rendering {len(backgrounds)} backgrounds and {len(tasks)} maps")
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=init_map_worker, initargs=(layers,)
+    ) as executor:
+        if backgrounds:
+            paths, extents = zip(*backgrounds)
+            list(executor.map(render_background, paths, extents))
+        rendered = list(executor.map(render_issue_map, tasks))
+
+    return rendered
+
+
+def plot_counts(
+    pivot_stats, path, title="", log_scale=False, columns=("Lot", "IssueType")
+):
+    """
+    Plot a table of counts, one line per column, into a PNG file.
+
+    All the lines are drawn by a single `plot` call on the values, which
+    stays fast with hundreds of columns (e.g. one per Code).
+
+    :param pivot_stats: DataFrame indexed by date, one column per group.
+    :param path: Path of the PNG file.
+    :param title: Title of the plot.
+    :param log_scale: Use a logarithmic y-axis.
+    :param columns: Names of the levels of the columns, for the legend title.
+    :return: Path of the PNG file.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(12, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.plot(pivot_stats.index, pivot_stats.to_numpy(), marker="o")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Number of Issues (Log Scale)" if log_scale else "Number of Issues")
+    ax.set_title(title)
+    if log_scale:
+        ax.set_yscale("log")
+    ax.legend(
+        [
+            " - ".join(map(str, key)) if isinstance(key, tuple) else str(key)
+            for key in pivot_stats.columns
+        ],
+        title=" - ".join(columns),
+        bbox_to_anchor=(1.05, 1),
+        loc="upper left",
+        fontsize="small",
+    )
+    fig.autofmt_xdate()
+    fig.subplots_adjust(right=0.6)
+    fig.savefig(path, dpi=MAP_DPI)
+
+    return path
+
+
+def plot_trend(
+    all_stats, path, title="", log_scale=False, columns=("Lot", "IssueType")
+):
+    """
+    Plot the number of issues over time, one line per group, into a PNG file.
+
+    :param all_stats: Long table of the stats with a 'date' and an 'IssueCount' column.
+    :param path: Path of the PNG file.
+    :param title: Title of the plot.
+    :param log_scale: Use a logarithmic y-axis.
+    :param columns: Columns defining the lines.
+    :return: Path of the PNG file.
+    """
+    pivot_stats = all_stats.pivot_table(
+        index="date",
+        columns=list(columns),
+        values="IssueCount",
+        aggfunc="sum",
+        fill_value=0,
+    )
+    return plot_counts(pivot_stats, path, title, log_scale, columns)
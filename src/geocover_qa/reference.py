@@ -0,0 +1,167 @@
+"""
+Compact, pre-indexed form of the reference layers of `lots_mapsheets.gpkg`.
+
+The GeoPackage holds six layers, parsed with GDAL on every use. The layers
+needed by the stats are converted once, at build time, into a pickle of WKB
+geometries and a few attribute columns, next to the GeoPackage:
+
+    python -m geocover_qa.reference src/geocover_qa/data/lots_mapsheets.gpkg
+
+`read_reference_layer` loads it in milliseconds, prepares the geometries and
+builds their spatial index. The GeoPackage is read instead when the compact
+form is missing or was built from another version of it.
+"""
+
+import hashlib
+import os
+import pickle
+import sys
+import threading
+
+import geopandas as gpd
+import shapely
+from loguru import logger
+
+# Layers used by the stats, the maps, the GUI and the tiled checks
+REFERENCE_LAYERS = [
+    "ch",
+    "lots",
+    "mapsheet_with_lot_nr_lot_mapsheet_buffer_100m",
+    "mapsheets_100m_buffer",
+]
+# Attributes kept, when present in a layer
+REFERENCE_COLUMNS = ["Id", "Lot", "MSH_MAP_TITLE"]
+REFERENCE_SUFFIX = ".reference.pickle"
+# Bumped when the content of the compact form changes
+REFERENCE_VERSION = 2
+
+# Loaded layers, by (GeoPackage path, layer name)
+loaded_layers = {}
+loaded_layers_lock = threading.Lock()
+
+
+def reference_path(gpkg_path):
+    """Path of the compact form of a GeoPackage."""
+    return os.path.splitext(gpkg_path)[0] + REFERENCE_SUFFIX
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_signature(gpkg_path):
+    stat = os.stat(gpkg_path)
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": file_sha256(gpkg_path),
+    }
+
+
+def build_reference(gpkg_path, output_path=None, layers=REFERENCE_LAYERS):
+    """
+    Write the compact form of the reference layers of a GeoPackage.
+
+    :param gpkg_path: Path of the source GeoPackage.
+    :param output_path: Path of the pickle (default: next to the GeoPackage).
+    :param layers: Names of the layers to convert.
+    :return: Path of the pickle.
+    """
+    if output_path is None:
+        output_path = reference_path(gpkg_path)
+
+    reference = {
+        "version": REFERENCE_VERSION,
+        "source": source_signature(gpkg_path),
+        "layers": {},
+    }
+    for layer in layers:
+        gdf = gpd.read_file(gpkg_path, layer=layer)
+        reference["layers"][layer] = {
+            "crs": gdf.crs.to_wkt() if gdf.crs else None,
+            "wkb": shapely.to_wkb(gdf.geometry.values),
+            "columns": {
+                column: gdf[column].tolist()
+                for column in REFERENCE_COLUMNS
+                if column in gdf.columns
+            },
+        }
+        logger.info(f"{layer}: {len(gdf)} features")
+
+    with open(output_path, "wb") as f:
+        pickle.dump(reference, f, protocol=pickle.HIGHEST_PROTOCOL)
+    logger.info(f"Written {output_path} ({os.path.getsize(output_path)} bytes)")
+
+    return output_path
+
+
+def is_current(reference, gpkg_path):
+    """True if the compact form was built from this very GeoPackage."""
+    if reference.get("version") != REFERENCE_VERSION:
+        return False
+    source = reference["source"]
+    stat = os.stat(gpkg_path)
+    if stat.st_size != source["size"]:
+        return False
+    # Installing the package may change the modification time, not the content
+    return stat.st_mtime == source["mtime"] or file_sha256(gpkg_path) == source[
+        "sha256"
+    ]
+
+
+def load_reference(gpkg_path, path=None):
+    """
+    Load the compact form of a GeoPackage as GeoDataFrames.
+
+    The geometries are prepared and the spatial index of each layer is built.
+
+    :return: Dict of layer name -> GeoDataFrame, None if missing or out of date.
+    """
+    if path is None:
+        path = reference_path(gpkg_path)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        reference = pickle.load(f)
+    if os.path.isfile(gpkg_path) and not is_current(reference, gpkg_path):
+        logger.warning(f"{path} is out of date with {gpkg_path}, not using it")
+        return None
+
+    layers = {}
+    for layer, data in reference["layers"].items():
+        geometries = shapely.from_wkb(data["wkb"])
+        shapely.prepare(geometries)
+        gdf = gpd.GeoDataFrame(data["columns"], geometry=geometries, crs=data["crs"])
+        gdf.sindex  # Build the STRtree now, once
+        layers[layer] = gdf
+
+    return layers
+
+
+def read_reference_layer(gpkg_path, layer):
+    """
+    Read a layer of the reference GeoPackage, from its compact form if up to date.
+
+    Layers are loaded once per process; a copy is returned, sharing the
+    (prepared) geometries.
+    """
+    key = (os.path.abspath(gpkg_path), layer)
+    with loaded_layers_lock:
+        if key not in loaded_layers:
+            layers = load_reference(gpkg_path) or {}
+            if layer not in layers:
+                logger.debug(f"Reading {layer} from {gpkg_path}")
+                layers = {layer: gpd.read_file(gpkg_path, layer=layer)}
+            for name, gdf in layers.items():
+                loaded_layers[(key[0], name)] = gdf
+
+        return loaded_layers[key].copy(deep=False)
+
+
+if __name__ == "__main__":
+    for gpkg_path in sys.argv[1:]:
+        build_reference(gpkg_path)
@@ -0,0 +1,330 @@
+import io
+import ipaddress
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.request import urlopen
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from geocover_qa.aggregate import ISSUE_COLUMNS, IssueIndex
+from geocover_qa.cache import StatsCache
+from geocover_qa.config import QA_DIR, STATS_CACHE_SIZE
+from geocover_qa.source import find_qa_gdbs
+from geocover_qa.stat import get_stats_for_issues_gdb
+
+DEFAULT_PORT = 8765
+# Seconds a listing of the runs is reused before the share is scanned again
+RUNS_TTL = 60
+ARROW_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+
+
+class UnknownColumn(ValueError):
+    """A group-by column which the issues do not have."""
+
+
+def check_columns(group_by, columns):
+    """
+    Check that the group-by columns are among the columns of the issues.
+
+    :raise UnknownColumn: Naming the `group_by` columns not among `columns`.
+    """
+    unknown = [column for column in group_by if column not in columns]
+    if unknown:
+        raise UnknownColumn(
+            f"Unknown group_by column {', '.join(unknown)}, "
+            f"expected among {', '.join(columns)}"
+        )
+
+
+def load_run(gdb_path):
+    """Grouped stats and issue index of a run, all lots (filtered at query time)."""
+    combined, stats = get_stats_for_issues_gdb(gdb_path, lots_in_work="all")
+    return {"stats": stats, "index": IssueIndex(combined)}
+
+
+def aggregate_counts(counts, group_by, count_column="IssueCount", **selections):
+    """
+    Regroup issue counts, as `IssueIndex.aggregate` on the issues they count.
+
+    :param counts: Counts grouped by (at least) the `group_by` and selection columns.
+    :param selections: Column=list of values to keep, None for no filter.
+    """
+    mask = np.ones(len(counts), dtype=bool)
+    for column, selected in selections.items():
+        if selected is not None:
+            mask &= counts[column].isin({str(value) for value in selected}).to_numpy()
+    counts = counts[mask]
+    if not group_by:
+        return pd.DataFrame({count_column: [int(counts[count_column].sum())]})
+    return counts.groupby(list(group_by))[count_column].sum().reset_index()
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def to_arrow(df):
+    """Serialize a DataFrame as an Arrow IPC stream."""
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+class StatsService:
+    """
+    Stats of the QA runs below `qa_dir`, each computed once and kept in memory.
+
+    Used by the HTTP handler; concurrent requests for the same run wait for
+    a single computation (see `StatsCache`).
+
+    Only the last `cache_size` runs keep their issue index. The issue counts
+    of every run, grouped by all the index columns, are a few rows each:
+    they are kept for all the runs, so that trends over long ranges do not
+    read the evicted runs again.
+    """
+
+    def __init__(self, qa_dir=QA_DIR, cache_size=STATS_CACHE_SIZE):
+        self.qa_dir = os.path.realpath(qa_dir)
+        self.cache = StatsCache(load_run, max_entries=cache_size)
+        self.runs = {}  # (QA name, release) -> (time, records)
+        self.runs_lock = threading.Lock()
+        self.counts = {}  # issue.gdb -> (mtime, counts grouped by all the columns)
+        self.counts_lock = threading.Lock()
+
+    def check_path(self, gdb_path):
+        """Only the issue.gdb below the QA directory are served."""
+        real_path = os.path.realpath(gdb_path)
+        if not real_path.startswith(self.qa_dir + os.sep) or not real_path.endswith(
+            "issue.gdb"
+        ):
+            raise ValueError(f"Not an issue.gdb below {self.qa_dir}: {gdb_path}")
+        if not os.path.isdir(real_path):
+            raise FileNotFoundError(gdb_path)
+        return real_path
+
+    def list_runs(self, qa_name="Topology", release="RC_2030-12-31"):
+        key = (qa_name, release)
+        with self.runs_lock:
+            cached = self.runs.get(key)
+            if cached is None or time.time() - cached[0] > RUNS_TTL:
+                records = find_qa_gdbs(
+                    qa_name=qa_name, base_dir=self.qa_dir, release=release
+                )
+                cached = (time.time(), sorted(records, key=lambda run: run["date"]))
+                self.runs[key] = cached
+        return cached[1]
+
+    def run(self, gdb_path):
+        return self.cache.load(self.check_path(gdb_path)).result()
+
+    def aggregate(self, gdb_path, group_by, **selections):
+        index = self.run(gdb_path)["index"]
+        check_columns(group_by, index.columns)
+        return index.aggregate(group_by, **selections)
+
+    def cached_counts(self, gdb_path, mtime):
+        with self.counts_lock:
+            cached = self.counts.get(gdb_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        return None
+
+    def run_counts(self, gdb_path, mtime, future):
+        """Issue counts of a run grouped by all its columns, from its loading future."""
+        index = future.result()["index"]
+        counts = index.aggregate(index.columns)
+        with self.counts_lock:
+            self.counts[gdb_path] = (mtime, counts)
+        return counts
+
+    def trend(
+        self,
+        qa_name="Topology",
+        release="RC_2030-12-31",
+        group_by=("Lot", "IssueType"),
+        start_date=None,
+        end_date=None,
+        **selections,
+    ):
+        """Issue counts of all the runs, in a long table with a 'date' column."""
+        check_columns(group_by, ISSUE_COLUMNS)
+        runs = [
+            run
+            for run in self.list_runs(qa_name, release)
+            if (start_date is None or run["date"] >= start_date)
+            and (end_date is None or run["date"] <= end_date)
+        ]
+        # Counts of each version of a run are computed once, the runs missing
+        # are loaded concurrently
+        tables = []
+        pending = []
+        for run in runs:
+            gdb_path = os.path.realpath(run["file_path"])
+            try:
+                mtime = os.stat(gdb_path).st_mtime
+            except OSError as e:
+                logger.warning(f"Skipping {run['file_path']}: {e}")
+                continue
+            counts = self.cached_counts(gdb_path, mtime)
+            if counts is None:
+                pending.append((run, gdb_path, mtime, self.cache.load(gdb_path)))
+            else:
+                tables.append((run, counts))
+        for run, gdb_path, mtime, future in pending:
+            try:
+                tables.append((run, self.run_counts(gdb_path, mtime, future)))
+            except Exception as e:
+                logger.warning(f"Skipping {run['file_path']}: {e}")
+
+        tables = [
+            aggregate_counts(counts, group_by, **selections).assign(date=run["date"])
+            for run, counts in sorted(tables, key=lambda table: table[0]["date"])
+        ]
+        if not tables:
+            return pd.DataFrame(columns=list(group_by) + ["IssueCount", "date"])
+        return pd.concat(tables, ignore_index=True)
+
+
+def parse_list(params, name, default=None):
+    """Comma separated values of a query parameter, `default` if absent."""
+    if name not in params:
+        return default
+    return [value for value in params[name][0].split(",") if value != ""]
+
+
+def parse_date(params, name):
+    if name not in params:
+        return None
+    return pd.Timestamp(params[name][0]).to_pydatetime()
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON (default) or Arrow (`format=arrow`) endpoints:
+
+        /runs?qa=Topology&rc=RC_2030-12-31
+        /stats?path=<issue.gdb>&group_by=Lot,IssueType&Lot=1,2&IssueType=Error
+        /lots?path=<issue.gdb>
+        /trend?qa=Topology&rc=RC_2030-12-31&group_by=Lot&start=2024-12-01
+    """
+
+    service = None  # StatsService, set by `serve`
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        selections = {
+            column: parse_list(params, column) for column in ("Lot", "IssueType")
+        }
+        try:
+            if url.path == "/runs":
+                runs = self.service.list_runs(
+                    params.get("qa", ["Topology"])[0],
+                    params.get("rc", ["RC_2030-12-31"])[0],
+                )
+                self.send_table(pd.DataFrame(runs), params)
+            elif url.path == "/stats":
+                group_by = parse_list(params, "group_by", ["Lot", "IssueType"])
+                df = self.service.aggregate(params["path"][0], group_by, **selections)
+                self.send_table(df, params)
+            elif url.path == "/lots":
+                df = self.service.aggregate(params["path"][0], ["Lot"], **selections)
+                self.send_table(df, params)
+            elif url.path == "/trend":
+                df = self.service.trend(
+                    params.get("qa", ["Topology"])[0],
+                    params.get("rc", ["RC_2030-12-31"])[0],
+                    group_by=parse_list(params, "group_by", ["Lot", "IssueType"]),
+                    start_date=parse_date(params, "start"),
+                    end_date=parse_date(params, "end"),
+                    **selections,
+                )
+                self.send_table(df, params)
+            else:
+                self.send_error(404, f"Unknown endpoint {url.path}")
+        except KeyError as e:
+            self.send_error(400, f"Missing parameter {e}")
+        except UnknownColumn as e:
+            self.send_error(400, str(e))
+        except (ValueError, FileNotFoundError) as e:
+            self.send_error(404, str(e))
+        except Exception as e:
+            logger.exception(e)
+            self.send_error(500, str(e))
+
+    def send_table(self, df, params):
+        if params.get("format", ["json"])[0] == "arrow":
+            try:
+                body = to_arrow(df)
+            except ModuleNotFoundError:
+                self.send_error(406, "pyarrow is not installed, use format=json")
+                return
+            content_type = ARROW_CONTENT_TYPE
+        else:
+            body = df.to_json(orient="records", date_format="iso").encode()
+            content_type = "application/json"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def serve(
+    qa_dir=QA_DIR, host="127.0.0.1", port=DEFAULT_PORT, cache_size=STATS_CACHE_SIZE
+):
+    """
+    Serve the stats of the QA runs over HTTP, on the local host only.
+
+    :raise ValueError: If `host` is not a loopback address.
+    """
+    if not is_loopback(host):
+        raise ValueError(f"The stats service only listens on localhost, not {host}")
+
+    handler = type(
+        "Handler",
+        (StatsRequestHandler,),
+        {"service": StatsService(qa_dir, cache_size=cache_size)},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    logger.info(f"Serving the stats of {qa_dir} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        handler.service.cache.shutdown()
+
+
+def fetch_table(url, endpoint, **params):
+    """
+    Query the stats service, list values being sent comma separated:
+
+        fetch_table("http://127.0.0.1:8765", "stats", path=gdb, Lot=[1, 2])
+
+    :return: DataFrame of the JSON records.
+    """
+    query = {
+        name: ",".join(map(str, value)) if isinstance(value, (list, tuple)) else value
+        for name, value in params.items()
+        if value is not None
+    }
+    with urlopen(f"{url.rstrip('/')}/{endpoint}?{urlencode(query)}") as response:
+        return pd.DataFrame(json.load(response))
@@ -0,0 +1,158 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from loguru import logger
+
+from geocover_qa.config import INCREMENTS_DIR, MAX_WORKERS, QA_DIR
+from geocover_qa.utils import (
+    filter_qa_records,
+    increment_gdb_record,
+    parse_qa_paths,
+    qa_catalog_records,
+)
+
+
+def list_subdirectories(path):
+    """List the names of the sub-directories of `path` (one round trip on a share)."""
+    with os.scandir(path) as entries:
+        return [entry.name for entry in entries if entry.is_dir()]
+
+
+def scan_directories(
+    base_dir, match, prune=None, max_workers=MAX_WORKERS, listdir=list_subdirectories
+):
+    """
+    Find all the directories below `base_dir` whose name matches, listing siblings in parallel.
+
+    At most `max_workers` listings are in flight at any time. Matching
+    directories, and those for which `prune(name)` is true, are not descended into.
+
+    :param base_dir: Root directory of the scan.
+    :param match: Callable taking a directory name, true for the directories to return.
+    :param prune: Optional callable taking a directory name, true for the directories to skip.
+    :param max_workers: Maximum number of concurrent listings.
+    :param listdir: Callable returning the sub-directory names of a path.
+    :return: Sorted list of the full paths of the matching directories.
+    """
+    found = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(listdir, base_dir): base_dir}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    names = future.result()
+                except OSError as e:
+                    logger.warning(f"Cannot list {path}: {e}")
+                    continue
+                for name in names:
+                    full_path = os.path.join(path, name)
+                    if match(name):
+                        found.append(full_path)
+                    elif prune is None or not prune(name):
+                        pending[executor.submit(listdir, full_path)] = full_path
+
+    return sorted(found)
+
+
+def find_qa_gdbs(
+    qa_name="Topology",
+    base_dir=QA_DIR,
+    release="RC_2030-12-31",
+    start_date=None,
+    end_date=None,
+    last=False,
+    max_workers=MAX_WORKERS,
+    listdir=list_subdirectories,
+):
+    """Concurrent counterpart of `get_qa_gdb`, returning the same records."""
+    base_dir = os.path.join(base_dir, qa_name)
+    logger.debug(base_dir)
+    candidates = scan_directories(
+        base_dir,
+        match=lambda name: name.endswith("issue.gdb"),
+        prune=lambda name: name.endswith(".gdb"),
+        max_workers=max_workers,
+        listdir=listdir,
+    )
+
+    catalog = parse_qa_paths(candidates, release=release, qa_name=qa_name)
+    found_files = qa_catalog_records(catalog)
+    logger.debug(f"Candidates: {len(candidates)}, matching: {len(found_files)}")
+
+    return filter_qa_records(
+        found_files, start_date=start_date, end_date=end_date, last=last
+    )
+
+
+def find_increment_gdbs(
+    base_dir=INCREMENTS_DIR,
+    release="2030-12-31",
+    newer_than=None,
+    max_workers=MAX_WORKERS,
+    listdir=list_subdirectories,
+):
+    """Concurrent counterpart of `get_increment_gdb`, returning the same records."""
+    logger.info(base_dir)
+    candidates = scan_directories(
+        base_dir,
+        match=lambda name: name.endswith(".gdb"),
+        max_workers=max_workers,
+        listdir=listdir,
+    )
+
+    found_files = []
+    for full_path in candidates:
+        meta = increment_gdb_record(
+            os.path.dirname(full_path), os.path.basename(full_path), release, newer_than
+        )
+        if meta:
+            found_files.append(meta)
+
+    return found_files
+
+
+def layer_matches(layer, name):
+    """
+    Whether `layer` is the table `name`, with or without owner prefix.
+
+    E.g. 'GC_BEDROCK' matches 'GC_BEDROCK', 'TOPGIS_GC.GC_BEDROCK' and its
+    laundered form 'TOPGIS_GC_GC_BEDROCK'.
+    """
+    layer, name = layer.upper(), name.upper()
+    return layer == name or layer[-len(name) - 1 :] in (f".{name}", f"_{name}")
+
+
+def find_layer(gdb_path, name):
+    """Name of the layer of a GDB matching `name`, see `layer_matches`."""
+    import pyogrio
+
+    layers = [layer for layer, _ in pyogrio.list_layers(gdb_path)]
+    for layer in layers:
+        if layer_matches(layer, name):
+            return layer
+    raise ValueError(f"No layer {name} in {gdb_path} (layers: {', '.join(layers)})")
+
+
+def read_increment_layer(gdb_path, name, bbox=None, columns=None):
+    """
+    Read a table of a GCOVERP increment GDB, e.g. GC_BEDROCK.
+
+    :param gdb_path: Path of the increment GDB.
+    :param name: Name of the layer, see `find_layer`.
+    :param bbox: Optional (minx, miny, maxx, maxy) to read only a part of it.
+    :param columns: Optional attribute columns to read (default: all of them).
+    :return: GeoDataFrame in EPSG:2056.
+    """
+    import geopandas as gpd
+
+    layer = find_layer(gdb_path, name)
+    gdf = gpd.read_file(
+        gdb_path, layer=layer, bbox=bbox, columns=columns, engine="pyogrio"
+    )
+    gdf.set_crs(epsg=2056, inplace=True, allow_override=True)
+    logger.info(f"Read {len(gdf)} objects from {gdb_path}/{layer}")
+
+    return gdf
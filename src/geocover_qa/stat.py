@@ -4,6 +4,7 @@ import ast
 import json
 import os
 import sys
+import threading
 
 import geopandas as gpd
 import matplotlib.pyplot as plt
@@ -12,7 +13,11 @@ from loguru import logger
 
 import click
 import numpy as np
+import shapely
 
+from geocover_qa.config import LOTS_IN_WORK
+from geocover_qa.dimensions import load_dimensions
+from geocover_qa.reference import read_reference_layer
 from geocover_qa.utils import (
     get_mapsheets_path,
     check_qa_path_level,
@@ -43,9 +48,51 @@ cur_dir = os.path.dirname(os.path.realpath(__file__))
 
 # gpkg_path = os.path.join(cur_dir, "data/lots_mapsheets.gpkg")
 
-GPKG_FILEPATH = os.path.join(cur_dir, "../../../../QA/data/lots_mapsheets.gpkg")
 
-GPKG_FILEPATH = get_mapsheets_path()
+# Issue layers of an issue.gdb, in the order they are combined
+ISSUE_LAYERS = ["IssuePoints", "IssueLines", "IssuePolygons"]
+
+# Columns the stats of the `qa stat` and `qa watch` commands are grouped by
+STATS_GROUP_BY = ["Id", "IssueType", "Code", "CodeDescription", "QualityCondition"]
+
+# Number of features read (and joined) at once, between progress reports
+ISSUES_CHUNK_SIZE = 50000
+
+# Perimeter rows covering the whole of Switzerland: only attributed to the
+# issues outside all the other rows
+ALL_SWITZERLAND_LOT = "CH"
+# Lot of the issues spread over several lots, none holding most of them
+SHARED_LOT = "Shared"
+# Columns the stats are grouped by when each issue has exactly one lot
+ATTRIBUTED_GROUP_BY = [
+    "Lot",
+    "IssueType",
+    "Code",
+    "CodeDescription",
+    "QualityCondition",
+]
+
+
+class Cancelled(Exception):
+    """Raised when a computation is cancelled through its CancelToken."""
+
+
+class CancelToken:
+    """Thread-safe flag used to cancel a running stats computation."""
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def check(self):
+        if self.event.is_set():
+            raise Cancelled()
 
 
 # Function to load a layer using fsspec
@@ -53,54 +100,219 @@ def load_layer(gpkg_path, layer):
     return gpd.read_file(gpkg_path, layer=layer)
 
 
+def count_features(gdb_path, layer):
+    """Number of features of a layer, read from its metadata."""
+    try:
+        import pyogrio
+
+        return pyogrio.read_info(gdb_path, layer=layer)["features"]
+    except ImportError:
+        import fiona
+
+        with fiona.open(gdb_path, layer=layer) as src:
+            return len(src)
+
+
+def load_layer_chunks(gdb_path, layer, chunk_size=ISSUES_CHUNK_SIZE, cancel=None):
+    """
+    Read a layer by chunks of `chunk_size` features.
+
+    :return: Generator of (chunk, number of features read so far, total number of features).
+    """
+    total = count_features(gdb_path, layer)
+    if total <= 0:
+        yield load_layer(gdb_path, layer), 0, 0
+        return
+
+    for start in range(0, total, chunk_size):
+        if cancel is not None:
+            cancel.check()
+        stop = min(start + chunk_size, total)
+        chunk = gpd.read_file(gdb_path, layer=layer, rows=slice(start, stop))
+        yield chunk, stop, total
+
+
 def convert_to_windows_path(path):
     if os.name == "nt":
         return os.path.normpath(path)
     return path
 
 
-def get_stats(issue_gdb_path, lots_perimeter=None, group_by=["Id", "IssueType"]):
+def overlap_measure(geometries, others):
+    """Area of the intersection of each pair, or its length for lines, 0 for points."""
+    intersections = shapely.intersection(geometries, others)
+    return np.where(
+        shapely.area(geometries) > 0,
+        shapely.area(intersections),
+        shapely.length(intersections),
+    )
+
+
+def attribute_issues(issues, perimeter, mode="overlap", shared=False):
+    """
+    Give each issue exactly one row of the perimeter, unlike an "intersects" join.
+
+    With mode "overlap", an issue gets the row holding the largest part of it
+    (area, or length for lines). With mode "point", the row containing its
+    representative point. Invalid geometries are made valid first. Ties,
+    e.g. points in the overlap of buffered mapsheets, go to the row the
+    point lies deepest in. ALL_SWITZERLAND_LOT rows only get the issues
+    outside all the other rows.
+
+    :param issues: GeoDataFrame of the issues.
+    :param perimeter: GeoDataFrame of the lots/mapsheets, with a "Lot" column.
+    :param mode: "overlap" or "point".
+    :param shared: Issues spread over several lots, none holding more than
+        half of them, get the lot SHARED_LOT (and their largest mapsheet).
+        With mode "point" (or for points), this is any issue whose point is
+        in several lots.
+    :return: The issues with the columns of their perimeter row and its index
+        as `index_right` (NaN when outside the perimeter), as many rows as `issues`.
+    """
+    geometries = issues.geometry.values.to_numpy()
+    # Topology issues may be invalid polygons, on which the intersection fails
+    invalid = ~shapely.is_valid(geometries) & ~shapely.is_missing(geometries)
+    if invalid.any():
+        geometries = geometries.copy()
+        geometries[invalid] = shapely.make_valid(geometries[invalid])
+    if mode == "point":
+        geometries = shapely.point_on_surface(geometries)
+    issue_ids, rows = perimeter.sindex.query(geometries, predicate="intersects")
+
+    lot_codes, _ = pd.factorize(perimeter["Lot"])
+    fallback = (perimeter["Lot"] == ALL_SWITZERLAND_LOT).to_numpy()
+    # The whole-Switzerland rows only for the issues outside the other rows
+    in_lots = np.zeros(len(issues), dtype=bool)
+    in_lots[issue_ids[~fallback[rows]]] = True
+    keep = ~fallback[rows] | ~in_lots[issue_ids]
+    issue_ids, rows = issue_ids[keep], rows[keep]
+
+    # Overlaps are only computed for the issues with several candidates
+    measure = np.zeros(len(rows))
+    depth = np.zeros(len(rows))
+    several = np.bincount(issue_ids, minlength=len(issues))[issue_ids] > 1
+    if several.any():
+        candidates = geometries[issue_ids[several]]
+        row_geometries = perimeter.geometry.values[rows[several]]
+        if mode == "overlap":
+            measure[several] = overlap_measure(candidates, row_geometries)
+        points = shapely.point_on_surface(candidates)
+        depth[several] = np.where(
+            shapely.intersects(points, row_geometries), 1, -1
+        ) * shapely.distance(points, shapely.boundary(row_geometries))
+
+    # Best row of each issue: first of its pairs, by decreasing measure and depth
+    order = np.lexsort((rows, -depth, -measure, issue_ids))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = issue_ids[order][1:] != issue_ids[order][:-1]
+    positions = np.full(len(issues), -1)
+    positions[issue_ids[order][first]] = rows[order][first]
+
+    attributes = perimeter.drop(columns=perimeter.geometry.name)
+    attributes = attributes.reset_index(names="index_right").reindex(positions)
+    attributes.index = issues.index
+    joined = pd.concat(
+        [issues, attributes.drop(columns=issues.columns, errors="ignore")], axis=1
+    )
+
+    if shared:
+        # Measure of each issue in each lot
+        lot_count = max(lot_codes.max() + 1, 1)
+        keys, inverse = np.unique(
+            issue_ids * lot_count + lot_codes[rows], return_inverse=True
+        )
+        lot_measure = np.bincount(inverse, weights=measure)
+        lot_issues = keys // lot_count
+        largest = np.zeros(len(issues))
+        np.maximum.at(largest, lot_issues, lot_measure)
+        total = np.bincount(issue_ids, weights=measure, minlength=len(issues))
+        is_shared = (np.bincount(lot_issues, minlength=len(issues)) > 1) & (
+            2 * largest <= total
+        )
+        joined["Lot"] = joined["Lot"].astype(object).mask(is_shared, SHARED_LOT)
+
+    return joined
+
+
+def get_stats(
+    issue_gdb_path,
+    lots_perimeter=None,
+    group_by=["Id", "IssueType"],
+    progress=None,
+    cancel=None,
+    chunk_size=ISSUES_CHUNK_SIZE,
+    attribution="intersects",
+    shared=False,
+):
+    """
+    Join the issues of an issue.gdb with the lots perimeter and count them by group.
+
+    The issue layers are read and joined by chunks. After each chunk,
+    `progress(layer, done, total, joined_chunk)` is called, and `cancel` (a
+    CancelToken) is checked: cancelling raises `Cancelled`.
+
+    With attribution "intersects", an issue is repeated for each lot/mapsheet
+    it intersects. With "overlap" or "point", it gets exactly one of them, see
+    `attribute_issues` (and its `shared` option).
+
+    :return: Tuple of the combined (joined) issues and the grouped stats, None on read errors.
+    """
     if lots_perimeter is None:
+        # Resolved when needed: importing this module does not require the data
         lots_perimeter = get_lots_perimeter(
-            GPKG_FILEPATH, layername="mapsheet_with_lot_nr_lot_mapsheet_buffer_100m"
+            get_mapsheets_path(),
+            layername="mapsheet_with_lot_nr_lot_mapsheet_buffer_100m",
         )
     logger.info(f"Using: {lots_perimeter}")
     logger.info(lots_perimeter.head())
+    # Lots and mapsheets joined as integer codes, not repeated strings
+    dimensions = load_dimensions()
+    lots_perimeter = dimensions.encode_frame(lots_perimeter)
     # Read layers from geodatabase
 
     issue_gdb_path = convert_to_windows_path(issue_gdb_path)
 
+    joined_layers = []
+    issue_count = 0
     try:
         os.path.exists(issue_gdb_path)
-        issue_points = load_layer(issue_gdb_path, layer="IssuePoints")
-        issue_polygons = load_layer(issue_gdb_path, layer="IssuePolygons")
-        issue_lines = load_layer(issue_gdb_path, layer="IssueLines")
+        for layer in ISSUE_LAYERS:
+            joined_chunks = []
+            for chunk, done, total in load_layer_chunks(
+                issue_gdb_path, layer, chunk_size=chunk_size, cancel=cancel
+            ):
+                chunk.set_crs(epsg=2056, inplace=True, allow_override=True)
+                # Identifies the issues in the run, as the join repeats them per lot
+                chunk["IssueId"] = np.arange(issue_count, issue_count + len(chunk))
+                issue_count += len(chunk)
+
+                # Perform spatial joins
+                if attribution == "intersects":
+                    joined = gpd.sjoin(
+                        chunk, lots_perimeter, how="left", predicate="intersects"
+                    )
+                else:
+                    joined = attribute_issues(
+                        chunk, lots_perimeter, mode=attribution, shared=shared
+                    )
+                joined_chunks.append(joined)
+                if progress is not None:
+                    progress(layer, done, total, joined)
+            joined_layers.append(pd.concat(joined_chunks, ignore_index=True))
+    except Cancelled:
+        logger.info(f"Cancelled while reading {issue_gdb_path}")
+        raise
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
         fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
         logger.error(f"{exc_type}, {fname}, {exc_tb.tb_lineno}")
         logger.error(f"Error while opening {issue_gdb_path}: {e}")
         return None
-    # Read lots_perimeter from GeoPackage
-
-    issue_points.set_crs(epsg=2056, inplace=True, allow_override=True)
-    issue_polygons.set_crs(epsg=2056, inplace=True, allow_override=True)
-    issue_lines.set_crs(epsg=2056, inplace=True, allow_override=True)
-
-    # Perform spatial joins
-    joined_points = gpd.sjoin(
-        issue_points, lots_perimeter, how="left", predicate="intersects"
-    )
-    joined_polygons = gpd.sjoin(
-        issue_polygons, lots_perimeter, how="left", predicate="intersects"
-    )
-    joined_lines = gpd.sjoin(
-        issue_lines, lots_perimeter, how="left", predicate="intersects"
-    )
 
-    # Combine points and polygons
-    combined_issues = pd.concat(
-        [joined_points, joined_lines, joined_polygons], ignore_index=True
+    # Combine points, lines and polygons
+    combined_issues = pd.concat(joined_layers, ignore_index=True)
+    combined_issues = dimensions.encode_frame(
+        combined_issues, columns={"Lot": "lots", "QualityCondition": "conditions"}
     )
 
     # Filter only 'Error' issue types and ignore 'Warning'
@@ -110,13 +322,15 @@ def get_stats(issue_gdb_path, lots_perimeter=None, group_by=["Id", "IssueType"])
 
     # Group by lot ID (id) and issue type, and count the number of occurrences
     grouped_stats = (
-        combined_issues.groupby(group_by).size().reset_index(name="IssueCount")
+        combined_issues.groupby(group_by, observed=True)
+        .size()
+        .reset_index(name="IssueCount")
     )
 
     # Renaming to 'Lot'
     if "Lot" not in grouped_stats.columns:
         grouped_stats = grouped_stats.rename(columns={"Id": "Lot"})
-        grouped_stats["Lot"] = grouped_stats["Lot"].astype(int)
+        grouped_stats["Lot"] = dimensions.lots.categorical(grouped_stats["Lot"])
 
     return (combined_issues, grouped_stats)
 
@@ -125,7 +339,7 @@ def plot_data(stats):
     # Plot the statistics
     grouped_stats = stats["stats"]
     date = stats["date"]
-    grouped_stats.pivot(index="Lot", columns="IssueType", values="issue_count").plot(
+    grouped_stats.pivot(index="Lot", columns="IssueType", values="IssueCount").plot(
         kind="bar", stacked=True
     )
     plt.xlabel("Lot ID")
@@ -178,7 +392,26 @@ def plot_single_lot(lot, lots_perimeter, gpkg_path, ch):
         logger.info("  No operations found")
 
 
-def get_stats_for_issues_gdb(full_gdb_path):
+def get_stats_for_issues_gdb(
+    full_gdb_path,
+    lots_in_work=None,
+    progress=None,
+    cancel=None,
+    attribution="intersects",
+    shared=False,
+):
+    """
+    Compute the grouped issue counts of an issue.gdb, restricted to `lots_in_work`.
+
+    :param full_gdb_path: Path to the issue.gdb.
+    :param lots_in_work: Lots to keep in the stats, 'all' for no filter. Default:
+        the LOTS_IN_WORK of the config, as the `stat` command.
+    :param progress: Optional progress callback, see `get_stats`.
+    :param cancel: Optional CancelToken, see `get_stats`.
+    :param attribution: "intersects", "overlap" or "point", see `get_stats`.
+    :param shared: Count apart the issues spread over lots, see `attribute_issues`.
+    :return: Tuple of the combined (joined) issues and the grouped stats.
+    """
     if not full_gdb_path.endswith("issue.gdb"):
         raise Exception(f"Path not ending with .gdb {full_gdb_path}")
     level, matched_values = check_qa_path_level(full_gdb_path)
@@ -201,11 +434,11 @@ def get_stats_for_issues_gdb(full_gdb_path):
         "QualityCondition",
     ]
 
-    LOTS_IN_WORK = (1, 2, 8, 10)
-    ch_gdf = gpd.read_file(GPKG_FILEPATH, layer="ch")
+    gpkg_path = get_mapsheets_path()
+    ch_gdf = read_reference_layer(gpkg_path, "ch")
     ch_gdf = ch_gdf.set_crs(epsg=2056, allow_override=True)
     lots_perimeter_gdf = get_lots_perimeter(
-        GPKG_FILEPATH, layername="mapsheet_with_lot_nr_lot_mapsheet_buffer_100m"
+        gpkg_path, layername="mapsheet_with_lot_nr_lot_mapsheet_buffer_100m"
     )
     ALL_SWITZERLAND_ID = "CH"
 
@@ -218,7 +451,13 @@ def get_stats_for_issues_gdb(full_gdb_path):
 
     try:
         combined_issues, stats_gdf = get_stats(
-            full_gdb_path, lots_perimeter=lots_perimeter_gdf, group_by=GROUP_BY
+            full_gdb_path,
+            lots_perimeter=lots_perimeter_gdf,
+            group_by=GROUP_BY,
+            progress=progress,
+            cancel=cancel,
+            attribution=attribution,
+            shared=shared,
         )
     except TypeError as e:
         logger.error(f"Cannot get stats from {full_gdb_path}: {e}")
@@ -227,17 +466,15 @@ def get_stats_for_issues_gdb(full_gdb_path):
     if stats_gdf is None:
         raise Exception
 
-    grouped_stats = stats_gdf[stats_gdf["Lot"].isin(LOTS_IN_WORK)]
+    if lots_in_work is None:
+        lots_in_work = ast.literal_eval(LOTS_IN_WORK)
+    if lots_in_work == "all":
+        grouped_stats = stats_gdf
+    else:
+        lots = load_dimensions().lots
+        grouped_stats = stats_gdf[lots.isin(stats_gdf["Lot"], lots_in_work)]
 
+    # Lots stay coded, as labels '1', '2', ... (see geocover_qa.dimensions)
     grouped_stats = grouped_stats.rename(columns={"MSH_MAP_TITLE": "Sheet"})
 
-    def convert_to_string(value):
-        if pd.isna(value) or np.isinf(value):
-            return ""  # Return the value as a string if it's NaN or infinite
-        else:
-            return f"{value:.0f}"  # Convert to string with formatting (e.g., 2 decimal places)
-
-    if "Lot" in grouped_stats.columns:
-        grouped_stats["Lot"] = grouped_stats["Lot"].apply(convert_to_string)
-
     return (combined_issues, grouped_stats)
@@ -0,0 +1,263 @@
+"""
+Issues of all the QA runs in a single GeoParquet dataset.
+
+Each run is ingested once into its own partition:
+
+    <store>/QA=Topology/RC=RC_2030-12-31/run=20241207_03-01-10/issues.parquet
+
+Rows are the issues joined with the mapsheets (an issue on two sheets is
+two rows with the same IssueId), sorted along a Hilbert curve and written
+with a `bbox` covering column. Queries only open the partitions of the
+requested runs, and skip the row groups outside the requested bbox, sheets
+or lots with the Parquet statistics.
+
+    ingest_runs("issue_store", find_qa_gdbs(qa_name="Topology"))
+    issues = query_issues("issue_store", sheets=["Bern"], start_date=six_months_ago)
+"""
+
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from loguru import logger
+
+from geocover_qa.stat import get_stats
+from geocover_qa.utils import get_lots_perimeter, get_mapsheets_path
+
+STORE_FILENAME = "issues.parquet"
+# Attribute columns of the stored issues, besides `date` and the geometry
+STORE_COLUMNS = [
+    "IssueId",
+    "IssueType",
+    "Code",
+    "CodeDescription",
+    "QualityCondition",
+    "Lot",
+    "Sheet",
+]
+# Small row groups: the unit skipped by bbox, sheet or lot filters
+STORE_ROW_GROUP_SIZE = 10000
+# Format of the `run` partition, sorted as the dates
+RUN_FORMAT = "%Y%m%d_%H-%M-%S"
+
+
+def partition_path(store_dir, record):
+    """Path of the Parquet file of a run, from its record (see `find_qa_gdbs`)."""
+    return os.path.join(
+        store_dir,
+        f"QA={record['QA']}",
+        f"RC={record['RC']}",
+        f"run={record['date']:{RUN_FORMAT}}",
+        STORE_FILENAME,
+    )
+
+
+def is_ingested(store_dir, record):
+    return os.path.isfile(partition_path(store_dir, record))
+
+
+def issues_table(combined_issues, date):
+    """
+    Stored form of the joined issues of a run (see `get_stats`).
+
+    Attributes are stored as strings, so that the schema of every run is the same.
+    """
+    combined_issues = combined_issues.rename(columns={"MSH_MAP_TITLE": "Sheet"})
+    issues = gpd.GeoDataFrame(
+        {
+            "date": pd.Timestamp(date),
+            "IssueId": combined_issues["IssueId"].to_numpy(dtype="int64"),
+        },
+        geometry=combined_issues.geometry.values,
+        crs="EPSG:2056",
+    )
+    for column in STORE_COLUMNS[1:]:
+        values = combined_issues.get(column, pd.Series(index=combined_issues.index))
+        if pd.api.types.is_float_dtype(values):
+            # Lots missing for the issues outside of the sheets: 1.0 -> "1"
+            values = values.astype("Int64")
+        issues[column] = values.astype("string").to_numpy()
+
+    # Nearby issues in the same row groups: their bbox statistics stay small
+    if len(issues):
+        order = np.argsort(issues.hilbert_distance(), kind="stable")
+        issues = issues.iloc[order].reset_index(drop=True)
+    return issues
+
+
+def ingest_issues(store_dir, combined_issues, record):
+    """
+    Write the joined issues of a run into its partition, replacing it if present.
+
+    :return: Path of the Parquet file.
+    """
+    path = partition_path(store_dir, record)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    issues = issues_table(combined_issues, record["date"])
+    # Written aside then renamed: a partition is either complete or missing
+    tmp_path = os.path.join(os.path.dirname(path), f".{STORE_FILENAME}.tmp")
+    issues.to_parquet(
+        tmp_path,
+        index=False,
+        write_covering_bbox=True,
+        row_group_size=STORE_ROW_GROUP_SIZE,
+    )
+    os.replace(tmp_path, path)
+    logger.info(f"Ingested {len(issues)} issues into {path}")
+    return path
+
+
+def ingest_run(store_dir, record, sheets_perimeter=None):
+    """Compute the joined issues of a run and ingest them."""
+    combined_issues, _ = get_stats(
+        record["file_path"], lots_perimeter=sheets_perimeter
+    )
+    return ingest_issues(store_dir, combined_issues, record)
+
+
+def ingest_runs(store_dir, records, replace=False):
+    """
+    Ingest the runs not in the store yet.
+
+    :param store_dir: Root directory of the store.
+    :param records: Records of the runs, see `find_qa_gdbs`.
+    :param replace: Ingest again the runs already in the store.
+    :return: Paths of the ingested partitions.
+    """
+    records = [
+        record for record in records if replace or not is_ingested(store_dir, record)
+    ]
+    logger.info(f"{len(records)} runs to ingest into {store_dir}")
+    if not records:
+        return []
+
+    sheets_perimeter = get_lots_perimeter(
+        get_mapsheets_path(),
+        layername="mapsheet_with_lot_nr_lot_mapsheet_buffer_100m",
+    )
+    ingested = []
+    for record in sorted(records, key=lambda record: record["date"]):
+        try:
+            ingested.append(ingest_run(store_dir, record, sheets_perimeter))
+        except Exception as e:
+            logger.error(f"Cannot ingest {record['file_path']}: {e}")
+    return ingested
+
+
+def open_store(store_dir):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partitioning = ds.partitioning(
+        pa.schema([("QA", pa.string()), ("RC", pa.string()), ("run", pa.string())]),
+        flavor="hive",
+    )
+    return ds.dataset(
+        store_dir,
+        format="parquet",
+        partitioning=partitioning,
+        exclude_invalid_files=False,
+        ignore_prefixes=[".", "_"],
+    )
+
+
+def store_filter(
+    qa_name=None,
+    release=None,
+    start_date=None,
+    end_date=None,
+    bbox=None,
+    lots=None,
+    sheets=None,
+):
+    """
+    Filter expression of a query, None if it selects everything.
+
+    The QA, RC and dates select partitions; bbox, lots and sheets are
+    pushed down to the row groups.
+    """
+    import pyarrow.dataset as ds
+
+    conditions = []
+    if qa_name:
+        conditions.append(ds.field("QA") == qa_name)
+    if release:
+        conditions.append(ds.field("RC") == release)
+    if start_date is not None:
+        conditions.append(ds.field("run") >= f"{start_date:{RUN_FORMAT}}")
+    if end_date is not None:
+        conditions.append(ds.field("run") <= f"{end_date:{RUN_FORMAT}}")
+    if bbox is not None:
+        minx, miny, maxx, maxy = bbox
+        conditions += [
+            ds.field("bbox", "xmax") >= minx,
+            ds.field("bbox", "xmin") <= maxx,
+            ds.field("bbox", "ymax") >= miny,
+            ds.field("bbox", "ymin") <= maxy,
+        ]
+    if lots is not None:
+        conditions.append(ds.field("Lot").isin([str(lot) for lot in lots]))
+    if sheets is not None:
+        conditions.append(ds.field("Sheet").isin(list(sheets)))
+
+    if not conditions:
+        return None
+    expression = conditions[0]
+    for condition in conditions[1:]:
+        expression = expression & condition
+    return expression
+
+
+def query_issues(store_dir, columns=None, geometry=True, **filters):
+    """
+    Issues of the store matching `filters` (see `store_filter`).
+
+    :param store_dir: Root directory of the store.
+    :param columns: Attribute columns to read (default: all of them).
+    :param geometry: Read and decode the geometries, as a GeoDataFrame.
+    :return: DataFrame (GeoDataFrame with `geometry`) with the QA, RC and run columns.
+    """
+    dataset = open_store(store_dir)
+    if columns is None:
+        columns = ["date"] + STORE_COLUMNS
+    columns = list(dict.fromkeys(list(columns) + ["QA", "RC", "run"]))
+    if geometry:
+        columns.append("geometry")
+
+    table = dataset.to_table(columns=columns, filter=store_filter(**filters))
+    df = table.to_pandas()
+    logger.debug(f"{len(df)} issues read from {store_dir}")
+    if not geometry:
+        return df
+
+    issues = gpd.GeoDataFrame(
+        df.drop(columns="geometry"),
+        geometry=shapely.from_wkb(df["geometry"].to_numpy()),
+        crs="EPSG:2056",
+    )
+    bbox = filters.get("bbox")
+    if bbox is not None:
+        # The bbox filter keeps what intersects the bboxes of the issues
+        issues = issues[issues.intersects(shapely.box(*bbox))]
+    return issues
+
+
+def count_issues(store_dir, group_by=("date", "Sheet"), **filters):
+    """
+    Number of issues of the store matching `filters`, by group.
+
+    An issue repeated on several sheets or lots is counted once per group.
+
+    :return: DataFrame of the `group_by` columns and IssueCount.
+    """
+    group_by = list(group_by)
+    issues = query_issues(
+        store_dir,
+        columns=["date", "IssueId"] + group_by,
+        geometry=filters.get("bbox") is not None,
+        **filters,
+    )
+    issues = pd.DataFrame(issues).drop_duplicates(["run", "IssueId"] + group_by)
+    return issues.groupby(group_by, dropna=False).size().reset_index(name="IssueCount")
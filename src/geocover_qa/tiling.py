@@ -0,0 +1,143 @@
+"""
+Geometry checks of national tables, tile by tile in a process pool.
+
+The LV95 extent is partitioned by the buffered mapsheets of
+`lots_mapsheets.gpkg`. Each worker reads the objects intersecting its tile
+(bbox filter) and checks them with `check_layer`. Objects crossing tile
+borders are read by several tiles, so the issues are deduplicated when the
+per-tile results are merged.
+
+Gaps are not checked per tile: a long gap crossing a tile border is not
+closed by the objects read by either tile. Each tile returns instead the
+part of it covered by no object, which is exact, as any object covering it
+is read. Merged, these parts are the holes of the whole layer: those up
+to MAX_GAP_AREA, and not touching the outer border of the tiles, are the
+gaps `check_layer` reports untiled.
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import geopandas as gpd
+import pandas as pd
+import shapely
+from loguru import logger
+
+from geocover_qa.geometry import MAX_GAP_AREA, check_layer, gap_issues, issues_frame
+from geocover_qa.reference import read_reference_layer
+from geocover_qa.source import find_layer, read_increment_layer
+from geocover_qa.utils import get_mapsheets_path
+
+# Layer of `lots_mapsheets.gpkg` partitioning the extent
+TILES_LAYER = "mapsheets_100m_buffer"
+# Issues identical on these columns (and geometry) are reported once
+DEDUPLICATION_COLUMNS = ["Code", "QualityCondition", "InvolvedObjects"]
+
+
+def read_tiles(gpkg_path=None, layer=TILES_LAYER):
+    """Tiles of the extent: the buffered mapsheets."""
+    if gpkg_path is None:
+        gpkg_path = get_mapsheets_path()
+    return read_reference_layer(gpkg_path, layer)
+
+
+def select_tiles(tiles, extent=None):
+    """
+    Geometries of the tiles, those intersecting `extent` only if given.
+
+    :param tiles: GeoDataFrame of the tiles.
+    :param extent: Optional (minx, miny, maxx, maxy), e.g. of the checked layer.
+    :return: Array of the tile geometries.
+    """
+    geometries = tiles.geometry.values.to_numpy()
+    if extent is not None:
+        geometries = geometries[shapely.intersects(geometries, shapely.box(*extent))]
+    return geometries
+
+
+def check_tile(gdb_path, layer, tile, id_column="UUID"):
+    """
+    Check the objects of `layer` intersecting the bbox of `tile`, but the gaps.
+
+    :return: Tuple of the issues (GeoDataFrame) and of the part of `tile`
+        covered by no (valid) object.
+    """
+    gdf = read_increment_layer(gdb_path, layer, bbox=tuple(shapely.bounds(tile)))
+    if len(gdf) == 0:
+        return issues_frame([], "", "", "", "", [], []), tile
+    issues = check_layer(gdf, layer, id_column=id_column, gaps=False)
+    geometries = gdf.geometry.values.to_numpy()
+    covered = shapely.union_all(geometries[shapely.is_valid(geometries)])
+    return issues, shapely.difference(tile, covered)
+
+
+def merge_gaps(uncovered, tiles, layer, max_area=MAX_GAP_AREA):
+    """
+    Gaps of a layer, from the parts of the tiles covered by no object.
+
+    :param uncovered: Parts of the tiles covered by no object, see `check_tile`.
+    :param tiles: Geometries of the tiles.
+    :return: Issues (gap polygons).
+    """
+    holes = shapely.get_parts(shapely.union_all(uncovered))
+    holes = holes[shapely.get_type_id(holes) == 3]
+    # Beyond the border of the tiles, the objects around are unknown
+    border = shapely.boundary(shapely.union_all(tiles))
+    return gap_issues(holes[~shapely.intersects(holes, border)], layer, max_area)
+
+
+def deduplicate_issues(issues):
+    """Drop the issues reported by several tiles: same code, objects and geometry."""
+    keys = issues[DEDUPLICATION_COLUMNS].copy()
+    keys["wkb"] = shapely.to_wkb(shapely.normalize(issues.geometry.values))
+    duplicated = keys.duplicated()
+    logger.debug(f"Dropped {duplicated.sum()} issues found by several tiles")
+    return issues[~duplicated.to_numpy()].reset_index(drop=True)
+
+
+def check_layer_tiled(gdb_path, layer, tiles, id_column="UUID", max_workers=None):
+    """
+    Check a layer of a GDB tile by tile, in parallel.
+
+    :param gdb_path: Path of the GDB (e.g. a GCOVERP increment).
+    :param layer: Name of the layer, see `find_layer`.
+    :param tiles: GeoDataFrame of the tiles, see `read_tiles`.
+    :param id_column: Column identifying the objects in the issues.
+    :param max_workers: Number of processes (default: number of CPUs).
+    :return: GeoDataFrame of the issues, in the issue.gdb schema.
+    """
+    import pyogrio
+
+    extent = pyogrio.read_info(
+        gdb_path, layer=find_layer(gdb_path, layer), force_total_bounds=True
+    )["total_bounds"]
+    geometries = select_tiles(tiles, extent)
+    logger.info(f"{layer}: checking {len(geometries)} tiles")
+
+    started = time.time()
+    results = []
+    uncovered = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(check_tile, gdb_path, layer, tile, id_column): tile
+            for tile in geometries
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            issues, tile_uncovered = future.result()
+            results.append(issues)
+            uncovered.append(tile_uncovered)
+            bounds = tuple(shapely.bounds(futures[future]))
+            logger.debug(f"{layer}: tile {done}/{len(geometries)} {bounds}")
+    logger.info(
+        f"{layer}: {len(geometries)} tiles checked in {time.time() - started:.1f}s"
+    )
+
+    results = [df for df in results if len(df)]
+    if results:
+        issues = deduplicate_issues(pd.concat(results, ignore_index=True))
+    else:
+        issues = issues_frame([], "", "", "", "", [], [])
+    gaps = merge_gaps(uncovered, geometries, layer)
+    if len(gaps):
+        issues = pd.concat([issues, gaps], ignore_index=True)
+    return gpd.GeoDataFrame(issues, geometry="geometry", crs="EPSG:2056")
@@ -20,6 +20,7 @@ from loguru import logger
 from shapely.geometry import box
 
 from geocover_qa.config import BASE_DIR, ZIP_BASE_DIR, zip_date_pattern
+from geocover_qa.reference import read_reference_layer
 
 # from archives_all_files import BASE_DIR, zip_date_pattern
 
@@ -27,6 +28,33 @@ from geocover_qa.config import BASE_DIR, ZIP_BASE_DIR, zip_date_pattern
 # Regular expression to match the final chunk of the directory (date pattern: YYYYMMDD_HH-MM-SS)
 date_pattern = re.compile(r"(\d{8}_\d{2}-\d{2}-\d{2})")
 
+# GCOVER_2030-12-31_20220307.gdb
+# GCOVER_2016-12-31_20220131.gdb
+# 20241104_GCOVERP_2030-12-31.gdb
+increment_gdb_pattern = re.compile(r"(\d{8})_GCOVERP_(2030-12-31|2016-12-31).gdb")
+
+# Expected hierarchy below "QA/Vérifications": <QA name>/<RC>/<timestamp>/issue.gdb
+QA_PREFIX_OPTIONS = [["QA", "Vérifications"], ["QA", "Verifications"]]
+QA_HIERARCHY_PATTERNS = [
+    re.compile(r"(Topology|QualityAssuranceTest|TechnicalQualityAssurance)"),
+    re.compile(r"RC_\d{4}-\d{2}-\d{2}"),
+    re.compile(r"\d{8}_\d{2}-\d{2}-\d{2}"),
+    re.compile(r"issue\.gdb"),
+]
+
+# Same hierarchy as a single pattern, applied on '/'-separated paths (bulk parsing)
+qa_hierarchy_pattern = re.compile(
+    r"(?:^|/)(?P<prefix>QA/V(?:é|e\u0301|e)rifications)"
+    r"(?:/(?P<QA>Topology|QualityAssuranceTest|TechnicalQualityAssurance)"
+    r"(?:/(?P<RC>RC_\d{4}-\d{2}-\d{2})"
+    r"(?:/(?P<timestamp>\d{8}_\d{2}-\d{2}-\d{2})"
+    r"(?:/(?P<gdb>issue\.gdb))?)?)?)?/?$"
+)
+# <RC>/<timestamp>/issue.gdb, whatever the prefix is (see `parse_qa_full_path`)
+qa_tail_pattern = re.compile(
+    r"(?:^|/)(?P<RC>[^/]+)/(?P<timestamp>\d{8}_\d{2}-\d{2}-\d{2})[^/]*/[^/]+/?$"
+)
+
 TABLES = [
     "GC_EXPLOIT_GEOMAT_PLG",
     "GC_EXPLOIT_GEOMAT_PT",
@@ -223,7 +251,14 @@ def get_sha256(filename):
 
 
 def zip_increment_gdb_directories(base_dir, pattern, zip_if_missing=True, limit=99):
-    # TODO: use limit and sort
+    """
+    Zip the `limit` most recent increment GDB matching `pattern`, if not zipped yet.
+
+    Increments are sorted by name, i.e. by date (YYYYMMDD_GCOVERP_...). Older
+    ones are left to the retention policy, see `geocover_qa.increments`.
+
+    :return: Tuple of the paths of the GDB and of their zips, most recent first.
+    """
     # Compile the regex pattern
     regex = re.compile(pattern)
     zipped_paths = []
@@ -232,28 +267,29 @@ def zip_increment_gdb_directories(base_dir, pattern, zip_if_missing=True, limit=
     for root, dirs, files in os.walk(base_dir):
         # Filter directories based on the regex pattern
         matching_dirs = [d for d in dirs if regex.match(d)]
-
-        for dir_name in matching_dirs:
-            gdb_path = os.path.join(root, dir_name)
-            zip_path = os.path.join(root, f"{dir_name}.zip")
-
-            gdbs_paths.append(gdb_path)
-
-            logger.debug(f"Checking if {zip_path} exists...")
-
-            if not os.path.isfile(zip_path):
-                if zip_if_missing:
-                    logger.info(f"Zipping {gdb_path} into {zip_path}")
-                    try:
-                        zip_directory(gdb_path, zip_path)
-                        zipped_paths.append(zip_path)
-                    except Exception as e:
-                        logger.error(f"Failed to zip {gdb_path}: {e}")
-                else:
-                    logger.debug(f"{zip_path} does not exist and zipping is disabled.")
+        gdbs_paths += [os.path.join(root, dir_name) for dir_name in matching_dirs]
+        # Do not walk into the GDB
+        dirs[:] = [d for d in dirs if d not in matching_dirs]
+
+    gdbs_paths = sorted(gdbs_paths, key=os.path.basename, reverse=True)[:limit]
+    for gdb_path in gdbs_paths:
+        zip_path = f"{gdb_path}.zip"
+
+        logger.debug(f"Checking if {zip_path} exists...")
+
+        if not os.path.isfile(zip_path):
+            if zip_if_missing:
+                logger.info(f"Zipping {gdb_path} into {zip_path}")
+                try:
+                    zip_directory(gdb_path, zip_path)
+                    zipped_paths.append(zip_path)
+                except Exception as e:
+                    logger.error(f"Failed to zip {gdb_path}: {e}")
             else:
-                logger.debug(f"{zip_path} already exists, adding to the list.")
-                zipped_paths.append(zip_path)
+                logger.debug(f"{zip_path} does not exist and zipping is disabled.")
+        else:
+            logger.debug(f"{zip_path} already exists, adding to the list.")
+            zipped_paths.append(zip_path)
 
     return (gdbs_paths, zipped_paths)
 
@@ -452,16 +488,8 @@ def check_qa_path_level(path):
     path_parts = normalize_path(path)
 
     # logger.info(path_parts)
-    fixed_prefix_options = [["QA", "Vérifications"], ["QA", "Verifications"]]
-    expected_hierarchy = [
-        r"(Topology|QualityAssuranceTest)",
-        r"RC_\d{4}-\d{2}-\d{2}",
-        r"\d{8}_\d{2}-\d{2}-\d{2}",
-        r"issue\.gdb",
-    ]
-
     prefix_index = -1
-    for fixed_prefix in fixed_prefix_options:
+    for fixed_prefix in QA_PREFIX_OPTIONS:
         try:
             index = path_parts.index(fixed_prefix[0])
             if path_parts[index + 1] == fixed_prefix[1]:
@@ -476,10 +504,10 @@ def check_qa_path_level(path):
     current_level = prefix_index + len(fixed_prefix)
     matched_values = []
 
-    for pattern in expected_hierarchy:
+    for pattern in QA_HIERARCHY_PATTERNS:
         if current_level >= len(path_parts):
             break
-        if re.fullmatch(pattern, path_parts[current_level]):
+        if pattern.fullmatch(path_parts[current_level]):
             matched_values.append(path_parts[current_level])
             current_level += 1
         else:
@@ -488,6 +516,75 @@ def check_qa_path_level(path):
     return current_level - prefix_index, matched_values
 
 
+def parse_qa_paths(paths, release=None, qa_name=None):
+    """
+    Parse many QA result paths at once, without touching the filesystem.
+
+    Vectorized counterpart of `parse_qa_full_path` and `check_qa_path_level`,
+    used to build the catalog of a whole share in one pass.
+
+    :param paths: Iterable of paths (POSIX, Windows or UNC).
+    :param release: Only keep the paths whose RC directory contains this string.
+    :param qa_name: QA test name to use when it is not part of the path.
+    :return: DataFrame with the columns file_path, QA, RC, timestamp, date, week and level.
+    """
+    file_paths = pd.Series(list(paths), dtype="object").astype(str)
+    posix_paths = file_paths.str.replace("\\", "/", regex=False).str.replace(
+        r"/{2,}", "/", regex=True
+    )
+
+    hierarchy = posix_paths.str.extract(qa_hierarchy_pattern)
+    tail = posix_paths.str.extract(qa_tail_pattern)
+
+    catalog = pd.DataFrame({"file_path": file_paths})
+    catalog["QA"] = hierarchy["QA"]
+    if qa_name:
+        catalog["QA"] = catalog["QA"].fillna(qa_name)
+    catalog["RC"] = hierarchy["RC"].fillna(tail["RC"])
+    catalog["timestamp"] = hierarchy["timestamp"].fillna(tail["timestamp"])
+    catalog["date"] = pd.to_datetime(
+        catalog["timestamp"], format="%Y%m%d_%H-%M-%S", errors="coerce"
+    )
+    # Same format as `get_calendar_week`
+    catalog["week"] = (
+        catalog["date"].dt.strftime("%Y")
+        + "-W"
+        + catalog["date"].dt.isocalendar().week.astype("string").str.zfill(2)
+    )
+    depth = hierarchy[["QA", "RC", "timestamp", "gdb"]].notna().sum(axis=1)
+    catalog["level"] = (depth + 2).where(hierarchy["prefix"].notna(), -1)
+
+    if release:
+        catalog = catalog[catalog["RC"].str.contains(release, regex=False, na=False)]
+
+    return catalog
+
+
+def qa_catalog_records(catalog):
+    """
+    Convert a catalog from `parse_qa_paths` into the records returned by `get_qa_gdb`.
+
+    Rows without a valid timestamp are dropped.
+    """
+    catalog = catalog.dropna(subset=["date"])
+    return [
+        {
+            "date": file_date.to_pydatetime(),
+            "file_path": file_path,
+            "RC": rc,
+            "QA": qa,
+            "week": week,
+        }
+        for file_date, file_path, rc, qa, week in zip(
+            catalog["date"],
+            catalog["file_path"],
+            catalog["RC"],
+            catalog["QA"],
+            catalog["week"],
+        )
+    ]
+
+
 def get_qa_gdb(
     qa_name="Topology",
     base_dir=BASE_DIR,
@@ -503,25 +600,24 @@ def get_qa_gdb(
 
     base_dir = os.path.join(base_dir, qa_name)
     logger.debug(base_dir)
-    pattern = os.path.join(base_dir, "**/*")
-    files = glob.glob(pattern, recursive=True)
+    candidates = []
     for root, dirs, files in os.walk(base_dir):
         for directory in dirs:
             if directory.endswith("issue.gdb"):
-                # Get the final chunk of the directory, which should contain the date
-                full_path = os.path.join(root, directory)
-                logger.debug(full_path)
+                candidates.append(os.path.join(root, directory))
 
-                rc_dir = full_path.split(os.sep)[-3]
-                raw_date = full_path.split(os.sep)[-2]
-                logger.debug(full_path.split(os.sep))
-                logger.debug(f"{rc_dir}, {raw_date}")
+    # Parse all the candidates at once
+    catalog = parse_qa_paths(candidates, release=release, qa_name=qa_name)
+    found_files = qa_catalog_records(catalog)
+    logger.debug(f"Candidates: {len(candidates)}, matching: {len(found_files)}")
 
-                meta = parse_qa_full_path(full_path, release, qa_name)
+    return filter_qa_records(
+        found_files, start_date=start_date, end_date=end_date, last=last
+    )
 
-                if meta:
-                    found_files.append(meta)
 
+def filter_qa_records(found_files, start_date=None, end_date=None, last=False):
+    """Sort QA records by date (newest first) and restrict them to a date range."""
     if len(found_files) > 0:
         found_files = sorted(found_files, key=itemgetter("date"), reverse=True)
 
@@ -542,54 +638,55 @@ def get_increment_gdb(base_dir=BASE_DIR, release="2030-12-31", newer_than=None):
     # Store results as a list of dictionaries with date and file path
     found_files = []
 
-    date_pattern = re.compile(r"(\d{8})_GCOVERP_(2030-12-31|2016-12-31).gdb")
-
-    # GCOVER_2030-12-31_20220307.gdb
-    # GCOVER_2016-12-31_20220131.gdb
-    # 20241104_GCOVERP_2030-12-31.gdb
-
     logger.info(base_dir)
-    pattern = os.path.join(base_dir, "**/*")
-    files = glob.glob(pattern, recursive=True)
     for root, dirs, files in os.walk(base_dir):
         for directory in dirs:
-            if directory.endswith(".gdb"):
-                # Get the final chunk of the directory, which should contain the date
-                full_path = os.path.dirname(os.path.join(root, directory))
-                full_path = Path(root, directory)
-                logger.debug(f"full={full_path}")
+            meta = increment_gdb_record(root, directory, release, newer_than)
+            if meta:
+                found_files.append(meta)
 
-                # Check if it matches the expected date pattern
-                match = date_pattern.match(directory)
-                if match:
-                    # Extract the date part
-                    rc = match.group(2)
-                    date_str = match.group(1)
-                    # logger.info(f"{rc}, {date_str}")
+    return found_files
 
-                    # Convert string to a datetime object
-                    try:
-                        file_date = datetime.strptime(date_str, "%Y%m%d")
-                    except ValueError:
-                        logger.error(f"Error parsing date for {directory}: {date_str}")
-                        continue
 
-                    logger.debug(f"Increment:  {directory} {file_date}")
-                    if rc != release:
-                        continue
-                    if newer_than and file_date > newer_than:
-                        # Add the file information to the list
-                        week = get_calendar_week(file_date)
-                        found_files.append(
-                            {
-                                "date": file_date,
-                                "file_path": full_path,
-                                "RC": rc,
-                                "week": week,
-                            }
-                        )
+def increment_gdb_record(root, directory, release="2030-12-31", newer_than=None):
+    """Return the record of an increment GDB directory, or None if it does not match."""
+    if not directory.endswith(".gdb"):
+        return None
 
-    return found_files
+    # Get the final chunk of the directory, which should contain the date
+    full_path = Path(root, directory)
+    logger.debug(f"full={full_path}")
+
+    # Check if it matches the expected date pattern
+    match = increment_gdb_pattern.match(directory)
+    if not match:
+        return None
+
+    # Extract the date part
+    rc = match.group(2)
+    date_str = match.group(1)
+
+    # Convert string to a datetime object
+    try:
+        file_date = datetime.strptime(date_str, "%Y%m%d")
+    except ValueError:
+        logger.error(f"Error parsing date for {directory}: {date_str}")
+        return None
+
+    logger.debug(f"Increment:  {directory} {file_date}")
+    if rc != release:
+        return None
+    if newer_than and file_date > newer_than:
+        # Add the file information to the list
+        week = get_calendar_week(file_date)
+        return {
+            "date": file_date,
+            "file_path": full_path,
+            "RC": rc,
+            "week": week,
+        }
+
+    return None
 
 
 def get_backup_gdbs(base_dir=BASE_DIR, release="2030-12-31", newer_than=None):
@@ -678,7 +775,8 @@ def list_directories_in_zip(zip_name):
 
 def get_lots_perimeter(gpkg_path, layername="lots"):
     logger.info(f"GPGK: {gpkg_path}")
-    lots_perimeter = gpd.read_file(gpkg_path, layer=layername)  #
+    # Compact pre-indexed form when available, see geocover_qa.reference
+    lots_perimeter = read_reference_layer(gpkg_path, layername)
 
     if "Lot" not in lots_perimeter.columns:
         lots_perimeter["Lot"] = lots_perimeter["Id"].apply(lambda x: f"{int(x)}")
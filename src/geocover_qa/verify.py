@@ -0,0 +1,241 @@
+"""
+Bulk verification of the zip archives of a backup tree.
+
+Each archive is checked against its SHA-256 sidecar (`<archive>.sha256`,
+as written by `calculate_sha256`) and the CRC of its members, and its
+directories are listed from the central directory only. Archives are
+checked concurrently in threads (hashing and inflating release the GIL),
+and the results are cached by size and mtime: a nightly run only reads
+the archives added or changed since the previous one.
+
+    results = verify_archives(find_archives(ZIP_BASE_DIR), cache_path=".verify_cache.json")
+    results[results["status"] != "ok"]
+"""
+
+import hashlib
+import json
+import os
+import re
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import pandas as pd
+from loguru import logger
+
+from geocover_qa.config import MAX_WORKERS
+
+CACHE_FILENAME = ".verify_cache.json"
+SIDECAR_SUFFIXES = [".sha256", ".sha256sum"]
+# Bytes hashed at once: large blocks, so that hashlib releases the GIL
+READ_SIZE = 1024 * 1024
+
+# `SHA256(path) = hex` (calculate_sha256, openssl) or `hex  path` (sha256sum)
+sidecar_pattern = re.compile(
+    r"SHA256\(.*\)\s*=\s*([0-9a-fA-F]{64})|^([0-9a-fA-F]{64})\b", re.MULTILINE
+)
+
+
+def find_archives(base_dir, suffix=".zip"):
+    """Paths of the archives below `base_dir`, sorted."""
+    paths = []
+    for root, _, files in os.walk(base_dir):
+        paths += [os.path.join(root, name) for name in files if name.endswith(suffix)]
+    return sorted(paths)
+
+
+def sidecar_path(archive_path):
+    """Path of the SHA-256 sidecar of an archive, None if there is none."""
+    for suffix in SIDECAR_SUFFIXES:
+        path = f"{archive_path}{suffix}"
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def read_sidecar(path):
+    """Checksum recorded in a sidecar, lowercase, None if not found."""
+    with open(path) as f:
+        match = sidecar_pattern.search(f.read())
+    if match is None:
+        return None
+    return (match.group(1) or match.group(2)).lower()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def zip_directories(zipf):
+    """Directories of the files of an open zip, as `list_directories_in_zip`."""
+    return sorted(
+        {
+            os.path.dirname(info.filename)
+            for info in zipf.infolist()
+            if not info.is_dir()
+        }
+    )
+
+
+def archive_key(archive_path):
+    """What a cached result depends on: size and mtime of the archive and its sidecar."""
+    stat = os.stat(archive_path)
+    key = {"size": stat.st_size, "mtime": stat.st_mtime}
+    sidecar = sidecar_path(archive_path)
+    if sidecar is not None:
+        key["sidecar_mtime"] = os.stat(sidecar).st_mtime
+    return key
+
+
+def verify_archive(archive_path, check_crc=True):
+    """
+    Check an archive against its sidecar and the CRC of its members.
+
+    :param archive_path: Path of the zip.
+    :param check_crc: Inflate the members to check their CRC (the slow part).
+    :return: Dict of the results, `status` being "ok" or "failed".
+    :raise OSError: If the archive cannot be read, e.g. the share is unavailable:
+        no verdict on the archive.
+    """
+    result = {"path": archive_path, **archive_key(archive_path)}
+    errors = []
+
+    sidecar = sidecar_path(archive_path)
+    if sidecar is None:
+        result["sidecar"] = "missing"
+    else:
+        expected = read_sidecar(sidecar)
+        result["sha256"] = file_sha256(archive_path)
+        if expected is None:
+            result["sidecar"] = "unreadable"
+            errors.append(f"No checksum found in {sidecar}")
+        elif expected == result["sha256"]:
+            result["sidecar"] = "ok"
+        else:
+            result["sidecar"] = "mismatch"
+            errors.append(f"SHA-256 {result['sha256']} instead of {expected}")
+
+    try:
+        with zipfile.ZipFile(archive_path) as zipf:
+            # Listing only reads the central directory
+            result["files"] = sum(not info.is_dir() for info in zipf.infolist())
+            result["directories"] = zip_directories(zipf)
+            if check_crc:
+                bad_member = zipf.testzip()
+                result["crc"] = "ok" if bad_member is None else "bad"
+                if bad_member is not None:
+                    errors.append(f"Bad CRC for {bad_member}")
+            else:
+                result["crc"] = "unchecked"
+    except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+        result["crc"] = "bad"
+        errors.append(f"Cannot read the archive: {e}")
+
+    result["status"] = "failed" if errors else "ok"
+    result["error"] = "; ".join(errors)
+    result["verified"] = datetime.now().isoformat(timespec="seconds")
+    return result
+
+
+class VerificationCache:
+    """
+    JSON file of the last verification result of each archive.
+
+    A result is reused while the archive and its sidecar keep their size and
+    mtime, and if it was done with at least the same checks.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.results = {}
+        if path and os.path.isfile(path):
+            with open(path) as f:
+                self.results = json.load(f)
+
+    def get(self, archive_path, check_crc=True):
+        result = self.results.get(archive_path)
+        if result is None or (check_crc and result.get("crc") == "unchecked"):
+            return None
+        key = archive_key(archive_path)
+        if any(result.get(name) != value for name, value in key.items()):
+            return None
+        if "sidecar_mtime" in result and "sidecar_mtime" not in key:
+            return None
+        return result
+
+    def put(self, result):
+        self.results[result["path"]] = result
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.results, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def unverified(path, error):
+    """Result of an archive which could not be read: reported, not cached."""
+    logger.error(f"Cannot verify {path}: {error}")
+    return {"path": path, "status": "failed", "error": str(error)}
+
+
+def verify_archives(
+    paths, cache_path=None, max_workers=MAX_WORKERS, check_crc=True, force=False
+):
+    """
+    Verify many archives concurrently, reusing the cached results.
+
+    :param paths: Paths of the archives.
+    :param cache_path: JSON file of the cached results (None: no cache).
+    :param max_workers: Number of threads.
+    :param check_crc: Inflate the members to check their CRC.
+    :param force: Verify again the archives with a cached result.
+    :return: DataFrame of the results, one row per archive.
+    """
+    cache = VerificationCache(cache_path)
+    results, pending = [], []
+    for path in paths:
+        try:
+            result = None if force else cache.get(path, check_crc)
+        except OSError as e:
+            # Vanished since it was listed
+            results.append(unverified(path, e))
+            continue
+        if result is None:
+            pending.append(path)
+        else:
+            results.append(result)
+    logger.info(
+        f"{len(pending)} archives to verify, {len(results)} unchanged since cached"
+    )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(verify_archive, path, check_crc): path for path in pending
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # E.g. vanished or unreadable
+                results.append(unverified(path, e))
+                continue
+            if result["status"] != "ok":
+                logger.warning(f"{path}: {result['error']}")
+            results.append(result)
+            cache.put(result)
+    cache.save()
+
+    results = pd.DataFrame(results)
+    if len(results):
+        results = results.sort_values("path", ignore_index=True)
+    return results
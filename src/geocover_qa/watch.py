@@ -0,0 +1,361 @@
+import json
+import os
+import time
+from datetime import datetime
+
+import pandas as pd
+from loguru import logger
+
+from geocover_qa.config import (
+    MAX_PLOTTED_FEATURES,
+    POLL_INTERVAL,
+    RETRY_ATTEMPTS,
+    RETRY_DELAY,
+    SETTLE_SECONDS,
+)
+from geocover_qa.dimensions import load_dimensions
+from geocover_qa.export import append_table, export_table
+from geocover_qa.plot import plot_trend, render_issue_maps
+from geocover_qa.reference import read_reference_layer
+from geocover_qa.source import list_subdirectories
+from geocover_qa.stat import ATTRIBUTED_GROUP_BY, STATS_GROUP_BY, get_stats
+from geocover_qa.store import ingest_issues
+from geocover_qa.utils import (
+    QA_HIERARCHY_PATTERNS,
+    get_lots_perimeter,
+    get_mapsheets_path,
+    parse_qa_paths,
+    qa_catalog_records,
+)
+
+# Processed runs, kept in the output directory across restarts
+STATE_FILENAME = "watch_state.json"
+
+rc_pattern = QA_HIERARCHY_PATTERNS[1]
+timestamp_pattern = QA_HIERARCHY_PATTERNS[2]
+
+
+def gdb_signature(gdb_path):
+    """Number of files, total size and last modification of an issue.gdb."""
+    count, size, mtime = 0, 0, 0.0
+    with os.scandir(gdb_path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                count += 1
+                size += stat.st_size
+                mtime = max(mtime, stat.st_mtime)
+    return count, size, mtime
+
+
+class RunWatcher:
+    """
+    Detect the new QA runs (RC_*/<timestamp>/issue.gdb) below a QA directory by polling.
+
+    The listing of each directory is cached with its modification time: a
+    poll costs one `stat` per RC directory and per run without issue.gdb
+    yet, and lists only the directories which changed. A new issue.gdb is
+    reported once it has not changed for `settle` seconds, i.e. once the QA
+    job stopped writing it.
+
+        watcher = RunWatcher("/QA/Vérifications/Topology", release="RC_2030-12-31")
+        new_gdbs = watcher.poll()
+    """
+
+    def __init__(
+        self, qa_dir, release=None, settle=SETTLE_SECONDS, listdir=list_subdirectories
+    ):
+        self.qa_dir = qa_dir
+        self.release = release
+        self.settle = settle
+        self.listdir = listdir
+        self.listings = {}  # directory -> (mtime, sub-directories)
+        self.found = set()  # issue.gdb already reported or ignored
+        self.settling = {}  # issue.gdb -> (signature, time it was first seen so)
+        self.retry_at = {}  # issue.gdb which failed -> time of the next attempt
+
+    def list_changed(self, path):
+        """Sub-directories of `path`, listed again only if its mtime changed."""
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError as e:
+            logger.warning(f"Cannot access {path}: {e}")
+            return []
+        cached = self.listings.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, self.listdir(path))
+            self.listings[path] = cached
+        return cached[1]
+
+    def scan(self):
+        """Paths of the issue.gdb present and not reported yet."""
+        gdbs = []
+        for rc in self.list_changed(self.qa_dir):
+            if not rc_pattern.fullmatch(rc) or (self.release and rc != self.release):
+                continue
+            rc_dir = os.path.join(self.qa_dir, rc)
+            for timestamp in self.list_changed(rc_dir):
+                gdb_path = os.path.join(rc_dir, timestamp, "issue.gdb")
+                if gdb_path in self.found or not timestamp_pattern.match(timestamp):
+                    continue
+                if "issue.gdb" in self.list_changed(os.path.dirname(gdb_path)):
+                    gdbs.append(gdb_path)
+        return gdbs
+
+    def ignore(self, gdb_paths):
+        """Do not report these issue.gdb (e.g. processed by a previous session)."""
+        self.found.update(gdb_paths)
+
+    def retry(self, gdb_path, delay=0, now=None):
+        """Report this issue.gdb again, at the first poll `delay` seconds from now."""
+        now = time.time() if now is None else now
+        self.found.discard(gdb_path)
+        self.retry_at[gdb_path] = now + delay
+
+    def poll(self, now=None):
+        """
+        Scan once and return the new issue.gdb which are complete, oldest first.
+
+        A run is complete when its files are older than `settle` seconds, or
+        when they did not change during `settle` seconds (clock skew with the share).
+        An issue.gdb without any file yet (just created) is never complete.
+        """
+        now = time.time() if now is None else now
+        ready = []
+        for gdb_path in self.scan():
+            if now < self.retry_at.get(gdb_path, now):
+                continue
+            try:
+                signature = gdb_signature(gdb_path)
+            except OSError as e:
+                logger.warning(f"Cannot read {gdb_path}: {e}")
+                continue
+            previous = self.settling.get(gdb_path)
+            if previous is None or previous[0] != signature:
+                self.settling[gdb_path] = (signature, now)
+            unchanged_since = self.settling[gdb_path][1]
+            if signature[0] == 0:
+                logger.debug(f"{gdb_path} is still empty")
+                continue
+            settled = now - signature[2] >= self.settle
+            if settled or now - unchanged_since >= self.settle:
+                del self.settling[gdb_path]
+                self.retry_at.pop(gdb_path, None)
+                self.found.add(gdb_path)
+                ready.append(gdb_path)
+            else:
+                logger.debug(f"{gdb_path} is being written")
+        return sorted(ready)
+
+
+class RunProcessor:
+    """
+    Stats, tables, maps and trend of single QA runs, reference data kept loaded.
+
+    With a `store_dir`, the issues of each run are also ingested into the
+    issue store (see `geocover_qa.store`).
+
+    The perimeters and their spatial index are loaded once, when the processor
+    is created, and reused for every run.
+
+    With an `attribution` other than "intersects", each issue is counted in
+    exactly one lot (see `geocover_qa.stat.attribute_issues`).
+
+    `qa_name` is the QA test of the runs when their path does not hold it.
+    """
+
+    def __init__(
+        self,
+        output_dir,
+        qa_name=None,
+        lots_in_work=None,
+        table_formats=("xlsx",),
+        trend_formats=("csv",),
+        maps=False,
+        max_map_features=MAX_PLOTTED_FEATURES,
+        store_dir=None,
+        attribution="intersects",
+        shared=False,
+    ):
+        self.output_dir = output_dir
+        self.qa_name = qa_name
+        self.lots_in_work = lots_in_work
+        self.table_formats = table_formats
+        self.trend_formats = trend_formats
+        self.maps = maps
+        self.max_map_features = max_map_features
+        self.store_dir = store_dir
+        self.attribution = attribution
+        self.shared = shared
+
+        gpkg_path = get_mapsheets_path()
+        self.ch_gdf = read_reference_layer(gpkg_path, "ch")
+        self.lots_perimeter_gdf = get_lots_perimeter(gpkg_path)
+        self.sheets_perimeter_gdf = get_lots_perimeter(
+            gpkg_path, layername="mapsheet_with_lot_nr_lot_mapsheet_buffer_100m"
+        )
+        self.sheets_perimeter_gdf.sindex  # Built once for all the joins
+        os.makedirs(output_dir, exist_ok=True)
+
+    def __call__(self, gdb_path):
+        catalog = parse_qa_paths([gdb_path], qa_name=self.qa_name)
+        entry = qa_catalog_records(catalog)[0]
+        file_date, rc, test_name = entry["date"], entry["RC"], entry["QA"]
+
+        result = get_stats(
+            gdb_path,
+            lots_perimeter=self.sheets_perimeter_gdf,
+            group_by=(
+                STATS_GROUP_BY
+                if self.attribution == "intersects"
+                else ATTRIBUTED_GROUP_BY
+            ),
+            attribution=self.attribution,
+            shared=self.shared,
+        )
+        if result is None:
+            raise RuntimeError(f"Cannot compute the stats of {gdb_path}")
+        combined_issues, stats = result
+        if self.store_dir:
+            ingest_issues(self.store_dir, combined_issues, entry)
+        if self.lots_in_work is not None:
+            lots = load_dimensions().lots
+            stats = stats[lots.isin(stats["Lot"], self.lots_in_work)]
+
+        name = f"{file_date:%Y-%m-%d}_{rc}_{test_name}"
+        for table_format in self.table_formats:
+            table_path = os.path.join(self.output_dir, f"{name}.{table_format}")
+            export_table(stats, table_path, sheet="Issue")
+
+        if self.maps:
+            render_issue_maps(
+                combined_issues,
+                self.sheets_perimeter_gdf,
+                [
+                    (
+                        self.ch_gdf,
+                        {"edgecolor": "purple", "linewidth": 3, "alpha": 0.15},
+                    ),
+                    (self.lots_perimeter_gdf, {"edgecolor": "pink", "linewidth": 3}),
+                ],
+                os.path.join(self.output_dir, "maps", name),
+                title=f"{file_date:%Y-%m-%d} {test_name}",
+                cache_dir=os.path.join(self.output_dir, "maps", "backgrounds"),
+                max_features=self.max_map_features,
+            )
+
+        self.append_trend(stats.assign(date=file_date), rc, test_name)
+
+    def append_trend(self, stats, rc, test_name):
+        """Append the stats of a run to the trend tables and redraw the trend plot."""
+        trend_name = f"trend_{rc}_{test_name}"
+        for trend_format in self.trend_formats:
+            trend_path = os.path.join(self.output_dir, f"{trend_name}.{trend_format}")
+            append_table(stats, trend_path)
+
+        # The trend is read back from the first format, all of them hold the same rows
+        trend_path = os.path.join(
+            self.output_dir, f"{trend_name}.{self.trend_formats[0]}"
+        )
+        if trend_path.endswith(".parquet"):
+            all_stats = pd.read_parquet(trend_path)
+        else:
+            all_stats = pd.read_csv(trend_path, parse_dates=["date"])
+        plot_trend(
+            all_stats,
+            os.path.join(self.output_dir, f"{trend_name}.png"),
+            title=f"Evolution of {test_name} issues over time ({rc})",
+            log_scale=test_name == "Topology",
+        )
+
+
+def load_state(path):
+    """Processed runs and failed runs (path -> error and attempts) of a state file."""
+    if not os.path.isfile(path):
+        return [], {}
+    with open(path) as f:
+        state = json.load(f)
+    return state["processed"], state.get("failed", {})
+
+
+def save_state(path, processed, failed=None):
+    # Written aside then renamed: never left half written when interrupted
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(
+            {"processed": sorted(processed), "failed": failed or {}}, f, indent=2
+        )
+    os.replace(tmp_path, path)
+
+
+def watch(
+    watcher,
+    process,
+    state_path,
+    interval=POLL_INTERVAL,
+    skip_existing=True,
+    once=False,
+    retry_attempts=RETRY_ATTEMPTS,
+    retry_delay=RETRY_DELAY,
+):
+    """
+    Poll for new QA runs and call `process(gdb_path)` for each of them.
+
+    The processed runs are recorded in `state_path`, so runs landing while
+    the watcher is stopped are processed at the next start. On the very first
+    start (no state), the runs already there are skipped if `skip_existing`.
+    A run which fails is processed again after `retry_delay`, 2 * `retry_delay`,
+    ... seconds, then recorded as failed in `state_path` and no longer
+    processed (remove it from the state file to process it again).
+
+    :param watcher: RunWatcher of the QA directory.
+    :param process: Callable processing one issue.gdb.
+    :param state_path: JSON file of the processed runs.
+    :param interval: Seconds between two polls.
+    :param skip_existing: On the first start, only process the runs landing afterwards.
+    :param once: Process the runs ready now, then return (e.g. from cron).
+    :param retry_attempts: Number of attempts before a run is recorded as failed.
+    :param retry_delay: Seconds before the first retry of a run, doubled at each retry.
+    """
+    processed, failed = load_state(state_path)
+    processed = set(processed)
+    if not processed and skip_existing and not os.path.isfile(state_path):
+        processed.update(watcher.scan())
+        logger.info(f"Skipping the {len(processed)} runs already there")
+        save_state(state_path, processed, failed)
+    watcher.ignore(processed | set(failed))
+    attempts = {}  # Failed attempts of the runs of this session
+
+    while True:
+        started = time.time()
+        for gdb_path in watcher.poll():
+            logger.info(f"New run: {gdb_path}")
+            try:
+                process(gdb_path)
+            except Exception as e:
+                attempts[gdb_path] = attempts.get(gdb_path, 0) + 1
+                if attempts[gdb_path] < retry_attempts:
+                    delay = retry_delay * 2 ** (attempts[gdb_path] - 1)
+                    logger.error(
+                        f"Error while processing {gdb_path}, retrying in {delay}s: {e}"
+                    )
+                    watcher.retry(gdb_path, delay)
+                    continue
+                logger.error(
+                    f"Error while processing {gdb_path}, "
+                    f"giving up after {attempts[gdb_path]} attempts: {e}"
+                )
+                failed[gdb_path] = {
+                    "error": str(e),
+                    "attempts": attempts.pop(gdb_path),
+                    "finished": datetime.now().isoformat(timespec="seconds"),
+                }
+                save_state(state_path, processed, failed)
+                continue
+            attempts.pop(gdb_path, None)
+            processed.add(gdb_path)
+            save_state(state_path, processed, failed)
+        logger.debug(f"Polled {watcher.qa_dir} in {time.time() - started:.2f}s")
+        if once:
+            return
+        time.sleep(interval)
@@ -0,0 +1,33 @@
+import os
+import time
+from collections import defaultdict
+
+
+class FakeFileSystem:
+    """
+    In-memory directory tree with an injected latency on each listing.
+
+    Emulates a high-latency SMB share to test or benchmark the scanners locally:
+
+        fs = FakeFileSystem(["/QA/Topology/RC_2030-12-31/20241207_03-01-10/issue.gdb"], latency=0.05)
+        find_qa_gdbs(base_dir="/QA", listdir=fs.listdir)
+    """
+
+    def __init__(self, directories, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.children = defaultdict(set)
+        for directory in directories:
+            path = os.path.normpath(directory)
+            parent = os.path.dirname(path)
+            while parent != path:
+                self.children[parent].add(os.path.basename(path))
+                path, parent = parent, os.path.dirname(parent)
+
+    def listdir(self, path):
+        time.sleep(self.latency)
+        self.calls += 1
+        path = os.path.normpath(path)
+        if path not in self.children:
+            raise FileNotFoundError(path)
+        return sorted(self.children[path])
@@ -0,0 +1,129 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from geocover_qa.aggregate import IssueIndex, StatsAccumulator, compare_counts, sort_key
+
+
+def issues():
+    return pd.DataFrame(
+        {
+            "Lot": [1.0, 1.0, 2.0, np.nan, 2.0, 10.0],
+            "MSH_MAP_TITLE": ["Bern", "Bern", "Thun", None, "Thun", "Biel"],
+            "IssueType": ["Error", "Warning", "Error", "Error", "Error", "Warning"],
+            "Code": ["TOP.1", "TOP.2", "TOP.1", "TOP.1", "TOP.3", "TOP.1"],
+        }
+    )
+
+
+def test_issue_index_aggregate_as_groupby():
+    index = IssueIndex(issues())
+    assert index.columns == ["Lot", "Sheet", "IssueType", "Code"]
+    assert index.values("Lot") == ["", "1", "10", "2"]
+
+    counts = index.aggregate(["Lot", "IssueType"])
+    expected = (
+        pd.DataFrame(
+            {
+                "Lot": ["1", "1", "2", "", "2", "10"],
+                "IssueType": issues()["IssueType"],
+            }
+        )
+        .groupby(["Lot", "IssueType"])
+        .size()
+        .reset_index(name="IssueCount")
+    )
+    pd.testing.assert_frame_equal(
+        counts.sort_values(["Lot", "IssueType"], ignore_index=True),
+        expected,
+        check_dtype=False,
+    )
+
+
+def test_issue_index_selections():
+    index = IssueIndex(issues())
+    counts = index.aggregate(["Sheet"], Lot=[2, 10], IssueType=["Error"])
+    assert counts.to_dict("records") == [{"Sheet": "Thun", "IssueCount": 2}]
+    assert index.aggregate([], Code=["TOP.1"])["IssueCount"].tolist() == [4]
+    assert index.mask(Lot=None).all()
+
+
+def test_compare_counts():
+    index = IssueIndex(issues())
+    counts = index.aggregate(["Code"])
+    other_counts = index.aggregate(["Code"], Lot=["1"])
+    result = compare_counts(counts, other_counts, ["Code"])
+    assert result.to_dict("records") == [
+        {"Code": "TOP.1", "IssueCount A": 4, "IssueCount B": 1, "Difference": -3},
+        {"Code": "TOP.2", "IssueCount A": 1, "IssueCount B": 1, "Difference": 0},
+        {"Code": "TOP.3", "IssueCount A": 1, "IssueCount B": 0, "Difference": -1},
+    ]
+
+
+def test_sort_key():
+    assert sorted(["CH", 10, None, 2, 1.5], key=sort_key) == [1.5, 2, 10, "CH", None]
+    # Lot labels sort as numbers
+    assert sorted(["CH", "10", None, 2, "1"], key=sort_key) == [
+        "1",
+        2,
+        "10",
+        "CH",
+        None,
+    ]
+
+
+def test_stats_accumulator():
+    accumulator = StatsAccumulator(["Lot", "IssueType"])
+    first = pd.DataFrame(
+        {"Lot": [1, 2], "IssueType": ["Error", "Error"], "IssueCount": [3, 4]}
+    )
+    second = pd.DataFrame(
+        {"Lot": [2, None], "IssueType": ["Error", "Warning"], "IssueCount": [5, 1]}
+    )
+    # Added out of order: the pivot sorts the dates
+    accumulator.add(datetime(2024, 12, 7), second)
+    accumulator.add(datetime(2024, 12, 6), first)
+
+    assert len(accumulator) == 2
+    assert accumulator.group_count == 3
+    totals = accumulator.total_frame().set_index(["Lot", "IssueType"])["IssueCount"]
+    assert totals[(2, "Error")] == 9
+    assert totals[(1, "Error")] == 3
+
+    entries = list(accumulator.entries())
+    pd.testing.assert_frame_equal(entries[1]["stats"], first, check_dtype=False)
+
+    pivot = accumulator.pivot(["Lot"])
+    assert pivot.index.tolist() == [datetime(2024, 12, 6), datetime(2024, 12, 7)]
+    lots = pivot.columns.get_level_values("Lot")
+    assert lots[:2].tolist() == [1, 2]
+    assert lots[2:].isna().all()
+    assert pivot.to_numpy().tolist() == [[3, 4, 0], [0, 5, 1]]
+
+
+def test_stats_accumulator_groups():
+    accumulator = StatsAccumulator(["Lot", "IssueType"])
+    accumulator.add(
+        datetime(2024, 12, 6),
+        pd.DataFrame({"Lot": [1], "IssueType": ["Error"], "IssueCount": [1]}),
+    )
+    # Known and new groups, and a group repeated within the run
+    accumulator.add(
+        datetime(2024, 12, 7),
+        pd.DataFrame(
+            {
+                "Lot": [2, 1, 2, 1],
+                "IssueType": ["Error", "Error", "Error", "Warning"],
+                "IssueCount": [2, 3, 4, 5],
+            }
+        ),
+    )
+
+    assert accumulator.group_count == 3
+    assert accumulator.columns[1].tolist() == [1, 0, 1, 2]
+    assert accumulator.total_frame().to_dict("records") == [
+        {"Lot": 1, "IssueType": "Error", "IssueCount": 4},
+        {"Lot": 2, "IssueType": "Error", "IssueCount": 6},
+        {"Lot": 1, "IssueType": "Warning", "IssueCount": 5},
+    ]
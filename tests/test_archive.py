@@ -0,0 +1,86 @@
+import io
+import os
+import random
+import zipfile
+
+from geocover_qa.archive import (
+    archive_gdb,
+    archive_qa_gdbs,
+    content_chunks,
+    list_runs,
+    restore_gdb,
+    restore_zip,
+    run_name,
+)
+
+RUN_DIR = "QA/Vérifications/Topology/RC_2030-12-31/20241207_03-01-10"
+
+
+def random_bytes(size, seed):
+    return random.Random(seed).randbytes(size)
+
+
+def write_gdb(root, tables):
+    gdb_path = os.path.join(root, "issue.gdb")
+    os.makedirs(gdb_path, exist_ok=True)
+    for name, data in tables.items():
+        with open(os.path.join(gdb_path, name), "wb") as f:
+            f.write(data)
+    return gdb_path
+
+
+def test_content_chunks():
+    data = random_bytes(1024 * 1024, seed=1)
+    chunks = list(content_chunks(io.BytesIO(data), read_size=100000))
+    assert b"".join(chunks) == data
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 256 * 1024 for chunk in chunks)
+
+    # Inserted bytes only change the chunks around them
+    edited = data[:500000] + b"inserted" + data[500000:]
+    edited_chunks = list(content_chunks(io.BytesIO(edited)))
+    assert len(set(chunks) & set(edited_chunks)) >= len(chunks) - 2
+
+
+def test_archive_and_restore(tmp_path):
+    archive_dir = str(tmp_path / "archive")
+    tables = {
+        "a00000001.gdbtable": random_bytes(300000, seed=2),
+        "a00000009.gdbtable": random_bytes(700000, seed=3),
+        "gdb": b"header",
+    }
+    gdb_path = write_gdb(str(tmp_path / RUN_DIR), tables)
+    assert run_name(gdb_path) == "Topology_RC_2030-12-31_20241207_03-01-10"
+
+    manifest = archive_gdb(archive_dir, gdb_path)
+    assert manifest["size"] == sum(len(data) for data in tables.values())
+    assert manifest["stored"] > 0
+    assert list_runs(archive_dir) == [manifest["name"]]
+
+    # The next night: only the changed table is stored again
+    tables["a00000009.gdbtable"] = random_bytes(700000, seed=4)
+    next_gdb = write_gdb(str(tmp_path / "next"), tables)
+    next_manifest = archive_gdb(archive_dir, next_gdb, name="next")
+    assert 0 < next_manifest["stored"] < manifest["stored"]
+    assert archive_gdb(archive_dir, next_gdb, name="again")["stored"] == 0
+
+    restored = restore_gdb(archive_dir, manifest["name"], str(tmp_path / "restored"))
+    assert os.path.basename(restored) == "issue.gdb"
+    for name in tables:
+        with (
+            open(os.path.join(gdb_path, name), "rb") as f,
+            open(os.path.join(restored, name), "rb") as g,
+        ):
+            assert f.read() == g.read()
+
+    zip_path = restore_zip(archive_dir, "next", str(tmp_path / "next.zip"))
+    with zipfile.ZipFile(zip_path) as zipf:
+        assert zipf.read("issue.gdb/a00000009.gdbtable") == tables["a00000009.gdbtable"]
+
+
+def test_archive_qa_gdbs(tmp_path):
+    archive_dir = str(tmp_path / "archive")
+    write_gdb(str(tmp_path / RUN_DIR), {"gdb": b"header"})
+    assert len(archive_qa_gdbs(archive_dir, str(tmp_path / "QA"))) == 1
+    # Already archived
+    assert archive_qa_gdbs(archive_dir, str(tmp_path / "QA")) == []
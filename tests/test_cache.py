@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from geocover_qa.cache import StatsCache
+
+
+def wait_cached(cache, key, timeout=5):
+    """The entry is added by a callback, after the future is done."""
+    deadline = time.monotonic() + timeout
+    while key not in cache:
+        assert time.monotonic() < deadline, f"{key} never cached"
+        time.sleep(0.001)
+
+
+def test_load_shares_the_pending_future():
+    release = threading.Event()
+    calls = []
+
+    def loader(key):
+        calls.append(key)
+        release.wait(5)
+        return key.upper()
+
+    cache = StatsCache(loader)
+    future = cache.load("a")
+    assert cache.is_loading("a")
+    assert cache.load("a") is future
+    release.set()
+    assert future.result() == "A"
+    wait_cached(cache, "a")
+
+    assert not cache.is_loading("a")
+    cached = cache.load("a")
+    assert cached.done() and cached.result() == "A"
+    assert calls == ["a"]
+    cache.shutdown()
+
+
+def test_eviction():
+    cache = StatsCache(str.upper, max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    # "a" becomes the most recently used: "b" is evicted
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert len(cache) == 2
+    assert cache.get("b", "missing") == "missing"
+
+
+def test_failed_loads_are_not_cached():
+    calls = []
+
+    def loader(key):
+        calls.append(key)
+        if len(calls) == 1:
+            raise OSError("share unavailable")
+        return key.upper()
+
+    cache = StatsCache(loader)
+    with pytest.raises(OSError):
+        cache.load("a").result()
+    deadline = time.monotonic() + 5
+    while cache.is_loading("a") and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert "a" not in cache
+
+    assert cache.load("a").result() == "A"
+    assert calls == ["a", "a"]
+    cache.shutdown()
+
+
+def test_prefetch():
+    cache = StatsCache(str.upper)
+    cache.put("a", "cached")
+    cache.prefetch(["a", "b", "c"])
+    wait_cached(cache, "b")
+    wait_cached(cache, "c")
+    assert cache.get("a") == "cached"
+    assert cache.get("c") == "C"
+    cache.shutdown()
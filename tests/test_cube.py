@@ -0,0 +1,91 @@
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from geocover_qa.aggregate import StatsAccumulator
+from geocover_qa.cube import CUBE_DIMENSIONS, CountCube, write_cube
+
+
+def accumulator():
+    accumulator = StatsAccumulator(CUBE_DIMENSIONS + ["Sheet"])
+    accumulator.add(
+        datetime(2024, 12, 7),
+        pd.DataFrame(
+            {
+                "Lot": [1, 1, 2, 10],
+                "IssueType": ["Error", "Error", "Warning", "Error"],
+                "Code": ["TOP.1", "TOP.1", "TOP.2", "TOP.1"],
+                "Sheet": ["Bern", "Thun", "Thun", None],
+                "IssueCount": [2, 3, 4, 1],
+            }
+        ),
+    )
+    accumulator.add(
+        datetime(2024, 12, 6),
+        pd.DataFrame(
+            {
+                "Lot": [2],
+                "IssueType": ["Error"],
+                "Code": ["TOP.1"],
+                "Sheet": ["Thun"],
+                "IssueCount": [7],
+            }
+        ),
+    )
+    return accumulator
+
+
+def test_write_and_read_cube(tmp_path):
+    path = write_cube(accumulator(), str(tmp_path / "runs.cube"))
+    with open(os.path.join(path, "labels.json")) as f:
+        labels = json.load(f)
+    assert labels["Lot"] == [1, 2, 10]
+    assert labels["date"] == ["2024-12-06T00:00:00", "2024-12-07T00:00:00"]
+
+    cube = CountCube(path)
+    assert cube.shape == (2, 3, 2, 2)
+    # Summed over the sheets
+    assert int(cube.counts.sum()) == 17
+    counts, labels = cube.select(Lot=["1"], Code=["TOP.1"])
+    assert counts[:, 0, :, 0].tolist() == [[0, 0], [5, 0]]
+    assert labels["IssueType"] == ["Error", "Warning"]
+
+
+def test_cube_series(tmp_path):
+    cube = CountCube(write_cube(accumulator(), str(tmp_path / "runs.cube")))
+
+    series = cube.series(["Lot"])
+    assert series.index.tolist() == [datetime(2024, 12, 6), datetime(2024, 12, 7)]
+    assert series[(2,)].tolist() == [7, 4]
+    assert series[(1,)].tolist() == [0, 5]
+
+    series = cube.series(["Code", "Lot"], start_date=datetime(2024, 12, 7))
+    assert series.columns.names == ["Code", "Lot"]
+    assert series.loc[datetime(2024, 12, 7), ("TOP.1", 1)] == 5
+
+    series = cube.series([], IssueType=["Warning"], end_date=datetime(2024, 12, 6))
+    assert series["IssueCount"].tolist() == [0]
+
+
+def test_missing_labels_written_as_null(tmp_path):
+    accumulator = StatsAccumulator(CUBE_DIMENSIONS)
+    accumulator.add(
+        datetime(2024, 12, 7),
+        pd.DataFrame(
+            {
+                "Lot": [1.0, np.nan],
+                "IssueType": ["Error", "Error"],
+                "Code": ["TOP.1", None],
+                "IssueCount": [2, 1],
+            }
+        ),
+    )
+    path = write_cube(accumulator, str(tmp_path / "runs.cube"))
+    with open(os.path.join(path, "labels.json")) as f:
+        labels = json.load(f)
+    assert labels["Lot"] == [1.0, None]
+    assert labels["Code"] == ["TOP.1", None]
+    assert CountCube(path).series(["Lot"]).sum().tolist() == [2, 1]
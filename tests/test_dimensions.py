@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from geocover_qa.dimensions import Dimension, Dimensions, to_label
+
+
+def test_to_label():
+    assert to_label(1) == "1"
+    assert to_label(1.0) == "1"
+    assert to_label(np.float32(10)) == "10"
+    assert to_label(" Bern ") == "Bern"
+    assert to_label(1.5) == "1.5"
+    assert to_label(None) is None
+    assert to_label(np.nan) is None
+
+
+def test_dimension_encode_decode():
+    lots = Dimension("lots", ["1", "2", "10"])
+    codes = lots.encode([2.0, "1", None, 10, "CH"])
+    assert codes.tolist() == [1, 0, -1, 2, 3]
+    assert codes.dtype == np.int16
+    # New labels are appended, codes are never reassigned
+    assert lots.labels == ["1", "2", "10", "CH"]
+    assert lots.decode(codes).tolist() == ["2", "1", None, "10", "CH"]
+
+    categorical = pd.Series(pd.Categorical(["CH", "1", None]))
+    assert lots.encode(categorical).tolist() == [3, 0, -1]
+
+
+def test_dimension_categorical_and_isin():
+    lots = Dimension("lots", ["1", "2"])
+    values = pd.Series([2.0, 1.0, np.nan], index=[5, 6, 7])
+    categorical = lots.categorical(values)
+    assert categorical.index.tolist() == [5, 6, 7]
+    assert categorical.cat.categories.tolist() == ["1", "2"]
+    assert categorical.tolist()[:2] == ["2", "1"]
+    assert pd.isna(categorical.iloc[2])
+
+    assert lots.isin(values, [1, "unknown"]).tolist() == [False, True, False]
+    # Coded and raw values give the same mask
+    assert lots.isin(categorical, [1]).tolist() == [False, True, False]
+
+
+def test_dimensions_encode_frame():
+    dimensions = Dimensions(lots=["1", "2"], sheets=["Bern"])
+    df = pd.DataFrame({"Lot": [2, 1], "MSH_MAP_TITLE": ["Thun", "Bern"], "n": [1, 2]})
+    encoded = dimensions.encode_frame(df)
+    assert isinstance(encoded["Lot"].dtype, pd.CategoricalDtype)
+    assert encoded["Lot"].cat.codes.tolist() == [1, 0]
+    assert encoded["MSH_MAP_TITLE"].cat.codes.tolist() == [1, 0]
+    assert dimensions.sheets.labels == ["Bern", "Thun"]
+    assert encoded["n"].tolist() == [1, 2]
+    # The input is not modified
+    assert df["Lot"].tolist() == [2, 1]
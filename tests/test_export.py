@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from geocover_qa.export import export_table, sheet_name, write_excel
+
+
+def stats():
+    return pd.DataFrame(
+        {
+            "Lot": [1.0, np.nan],
+            "IssueType": ["Error", None],
+            "date": [datetime(2024, 12, 7, 3, 1, 10), pd.NaT],
+            "IssueCount": [3, 4],
+        }
+    )
+
+
+def test_sheet_name():
+    assert sheet_name("2024/12:07") == "2024_12_07"
+    assert len(sheet_name("x" * 40)) == 31
+    assert sheet_name("x" * 40, used=["x" * 31]) == "x" * 29 + "_2"
+
+
+def test_write_excel(tmp_path):
+    path = write_excel(
+        {"Issue": stats(), "Other": stats().head(1)}, tmp_path / "a.xlsx"
+    )
+    sheets = pd.read_excel(path, sheet_name=None)
+    assert list(sheets) == ["Issue", "Other"]
+    issues = sheets["Issue"]
+    assert issues["IssueCount"].tolist() == [3, 4]
+    # Missing values are written as empty cells
+    assert issues.iloc[1][["Lot", "IssueType", "date"]].isna().all()
+    assert issues["date"].iloc[0] == datetime(2024, 12, 7, 3, 1, 10)
+
+
+@pytest.mark.parametrize("extension", ["xlsx", "csv", "parquet"])
+def test_export_table(tmp_path, extension):
+    path = export_table(stats(), str(tmp_path / f"stats.{extension.upper()}"))
+    if extension == "xlsx":
+        df = pd.read_excel(path)
+    elif extension == "csv":
+        df = pd.read_csv(path)
+    else:
+        df = pd.read_parquet(path)
+    assert df["IssueCount"].tolist() == [3, 4]
+
+
+def test_export_table_unsupported(tmp_path):
+    with pytest.raises(ValueError, match="Unsupported table format"):
+        export_table(stats(), str(tmp_path / "stats"))
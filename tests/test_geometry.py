@@ -0,0 +1,65 @@
+import geopandas as gpd
+import numpy as np
+import pyogrio
+import shapely
+from shapely.geometry import box
+
+from geocover_qa.geometry import (
+    check_layer,
+    check_overlaps,
+    polygonal_parts,
+    write_issues,
+)
+
+
+def layer(*geometries):
+    return gpd.GeoDataFrame(
+        {"UUID": [f"id{i}" for i in range(len(geometries))]},
+        geometry=list(geometries),
+        crs="EPSG:2056",
+    )
+
+
+def test_overlap_sharing_an_edge_is_polygonal(tmp_path):
+    # Overlap on [1, 2] x [0, 2], and a common edge along x = 2 above it
+    left = shapely.union(box(0, 0, 2, 2), box(0, 2, 2, 3))
+    right = shapely.union(box(1, 0, 3, 2), box(2, 2, 3, 3))
+    assert shapely.intersection(left, right).geom_type == "GeometryCollection"
+
+    issues = check_overlaps(np.array([left, right]), np.array(["a", "b"]), "GC_BEDROCK")
+
+    assert len(issues) == 1
+    assert issues.geom_type.tolist() == ["MultiPolygon"]
+    assert issues.geometry.area.tolist() == [2.0]
+    assert issues["InvolvedObjects"].tolist() == ["GC_BEDROCK:a;GC_BEDROCK:b"]
+
+    path = str(tmp_path / "issues.gpkg")
+    write_issues(issues, path)
+    assert pyogrio.read_info(path, layer="IssuePolygons")["features"] == 1
+
+
+def test_touching_polygons_do_not_overlap():
+    issues = check_layer(layer(box(0, 0, 1, 1), box(1, 0, 2, 1)), "GC_BEDROCK")
+
+    assert "Overlap" not in issues["Code"].tolist()
+
+
+def test_polygonal_parts():
+    geometries = np.array(
+        [
+            shapely.from_wkt(
+                "GEOMETRYCOLLECTION (MULTIPOLYGON (((0 0, 1 0, 1 1, 0 0)), "
+                "((2 0, 3 0, 3 1, 2 0))), LINESTRING (1 1, 2 1))"
+            ),
+            shapely.from_wkt("GEOMETRYCOLLECTION (LINESTRING (0 0, 1 1))"),
+            box(0, 0, 1, 1),
+        ]
+    )
+
+    parts = polygonal_parts(geometries)
+
+    assert shapely.get_type_id(parts[0]) == 6
+    assert shapely.get_num_geometries(parts[0]) == 2
+    assert parts[0].area == 1.0
+    assert parts[1] is None
+    assert parts[2] == geometries[2]
@@ -0,0 +1,63 @@
+import os
+from datetime import datetime
+
+from geocover_qa.increments import apply_retention, find_increments, plan_retention
+
+
+def increment_names(dates, release="2030-12-31"):
+    return [f"{date:%Y%m%d}_GCOVERP_{release}.gdb.zip" for date in dates]
+
+
+def test_plan_retention():
+    dates = [
+        datetime(2024, 12, 6),  # Daily
+        datetime(2024, 12, 5),
+        datetime(2024, 11, 20),  # Weekly: W47
+        datetime(2024, 11, 19),
+        datetime(2024, 11, 13),  # W46
+        datetime(2024, 9, 30),  # Monthly
+        datetime(2024, 9, 2),
+    ]
+    paths = increment_names(dates) + increment_names(
+        [datetime(2024, 9, 2)], release="2016-12-31"
+    )
+    plan = plan_retention(
+        paths + ["notes.txt"], today=datetime(2024, 12, 7), daily_days=7, weekly_days=30
+    )
+
+    assert len(plan) == 8
+    plan = plan.set_index("file_path")
+    kept = plan.index[plan["keep"]].tolist()
+    assert kept == [paths[7]] + [paths[i] for i in (0, 1, 2, 4, 5)]
+    assert plan.loc[paths[2], "bucket"] == "2024-W47"
+    assert plan.loc[paths[5], "bucket"] == "2024-09"
+    assert plan.loc[paths[0], "bucket"] == "2024-12-06"
+
+    assert plan_retention([]).empty
+
+
+def test_apply_retention(tmp_path):
+    dates = [datetime(2024, 9, 30), datetime(2024, 9, 2)]
+    for name in increment_names(dates):
+        (tmp_path / name).write_bytes(b"x" * 1000)
+        (tmp_path / f"{name}.sha256").write_text("0" * 64)
+    gdb_path = tmp_path / "20240903_GCOVERP_2030-12-31.gdb"
+    gdb_path.mkdir()
+    (gdb_path / "a00000001.gdbtable").write_bytes(b"x" * 500)
+
+    paths = find_increments(str(tmp_path))
+    assert len(paths) == 3
+    # The same month
+    plan = plan_retention(
+        paths, today=datetime(2024, 12, 7), daily_days=7, weekly_days=30
+    )
+    assert plan["keep"].sum() == 1
+
+    assert apply_retention(plan, dry_run=True) == 1000 + 64 + 500
+    assert len(os.listdir(tmp_path)) == 5
+
+    apply_retention(plan, dry_run=False)
+    assert sorted(os.listdir(tmp_path)) == [
+        "20240930_GCOVERP_2030-12-31.gdb.zip",
+        "20240930_GCOVERP_2030-12-31.gdb.zip.sha256",
+    ]
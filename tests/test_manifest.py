@@ -0,0 +1,66 @@
+import os
+
+import pandas as pd
+import pytest
+
+from geocover_qa.manifest import MANIFEST_FILENAME, RunManifest, call_with_retry
+
+GDB_PATH = "/QA/Topology/RC_2030-12-31/20241207_03-01-10/issue.gdb"
+OPTIONS = {"group_by": ["Lot", "IssueType"]}
+
+
+def test_resume_completed_entries(tmp_path):
+    path = str(tmp_path / MANIFEST_FILENAME)
+    output = tmp_path / "stats.xlsx"
+    output.write_text("")
+    stats = pd.DataFrame({"Lot": [1], "IssueCount": [3]})
+
+    manifest = RunManifest(path, OPTIONS)
+    assert manifest.completed_stats(GDB_PATH) is None
+    manifest.complete(GDB_PATH, stats, outputs=[str(output)])
+
+    resumed = RunManifest(path, OPTIONS)
+    pd.testing.assert_frame_equal(resumed.completed_stats(GDB_PATH), stats)
+
+    # Processed again when an output is missing
+    os.remove(output)
+    assert resumed.completed_stats(GDB_PATH) is None
+
+
+def test_options_changed(tmp_path):
+    path = str(tmp_path / MANIFEST_FILENAME)
+    RunManifest(path, OPTIONS).complete(GDB_PATH, pd.DataFrame({"IssueCount": [1]}))
+    assert RunManifest(path, OPTIONS).completed_stats(GDB_PATH) is not None
+    assert RunManifest(path, {"group_by": ["Lot"]}).entries == {}
+
+
+def test_failed_entries(tmp_path):
+    path = str(tmp_path / MANIFEST_FILENAME)
+    manifest = RunManifest(path)
+    manifest.fail(GDB_PATH, OSError("share unavailable"), attempts=3)
+    manifest.complete("other/issue.gdb", pd.DataFrame({"IssueCount": [1]}))
+
+    resumed = RunManifest(path)
+    assert resumed.failed() == [GDB_PATH]
+    assert resumed.entries[GDB_PATH]["error"] == "share unavailable"
+    assert resumed.completed_stats(GDB_PATH) is None
+    resumed.reset()
+    assert RunManifest(path).entries == {}
+
+
+def test_call_with_retry():
+    calls = []
+
+    def flaky(value):
+        calls.append(value)
+        if len(calls) < 3:
+            raise OSError("busy")
+        return value
+
+    assert call_with_retry(flaky, 42, attempts=3, delay=0) == 42
+    assert len(calls) == 3
+
+    calls.clear()
+    with pytest.raises(OSError):
+        call_with_retry(flaky, 42, attempts=2, delay=0)
+    assert len(calls) == 2
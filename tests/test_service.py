@@ -0,0 +1,96 @@
+import os
+import threading
+from http.server import ThreadingHTTPServer
+from urllib.error import HTTPError
+
+import pandas as pd
+import pytest
+
+from geocover_qa.aggregate import IssueIndex
+from geocover_qa.cache import StatsCache
+from geocover_qa.service import (
+    StatsRequestHandler,
+    StatsService,
+    aggregate_counts,
+    fetch_table,
+)
+
+RUNS = {
+    "20241206_03-01-10": {"Lot": [1, 1, 2], "IssueType": ["Error", "Warning", "Error"]},
+    "20241207_03-01-10": {"Lot": [1, 2, 2], "IssueType": ["Error", "Error", "Error"]},
+}
+
+
+def issues(gdb_path):
+    """Issues of a run, from the name of its directory instead of reading the GDB."""
+    return pd.DataFrame(RUNS[os.path.basename(os.path.dirname(gdb_path))])
+
+
+@pytest.fixture
+def url(tmp_path):
+    for run in RUNS:
+        os.makedirs(tmp_path / "Topology" / "RC_2030-12-31" / run / "issue.gdb")
+    service = StatsService(str(tmp_path))
+    service.cache = StatsCache(lambda gdb_path: {"index": IssueIndex(issues(gdb_path))})
+    handler = type("Handler", (StatsRequestHandler,), {"service": service})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    service.cache.shutdown()
+
+
+def gdb_path(url, run="20241207_03-01-10"):
+    runs = fetch_table(url, "runs")
+    return next(path for path in runs["file_path"] if run in path)
+
+
+def test_stats(url):
+    path = gdb_path(url)
+    df = fetch_table(url, "stats", path=path, group_by=["Lot"])
+    assert df.to_dict("records") == [
+        {"Lot": "1", "IssueCount": 1},
+        {"Lot": "2", "IssueCount": 2},
+    ]
+    df = fetch_table(url, "stats", path=path, group_by=[], Lot=[2])
+    assert df["IssueCount"].tolist() == [2]
+
+
+def test_trend(url):
+    df = fetch_table(url, "trend", group_by=["IssueType"], IssueType=["Error"])
+    assert df["IssueCount"].tolist() == [2, 3]
+    assert df["date"].tolist() == ["2024-12-06T03:01:10.000", "2024-12-07T03:01:10.000"]
+
+
+@pytest.mark.parametrize("endpoint", ["stats", "trend"])
+def test_unknown_group_by_column(url, endpoint):
+    with pytest.raises(HTTPError) as error:
+        fetch_table(url, endpoint, path=gdb_path(url), group_by=["Lot", "Colour"])
+    assert error.value.code == 400
+    assert "Unknown group_by column Colour" in error.value.reason
+
+
+def test_missing_parameter(url):
+    with pytest.raises(HTTPError) as error:
+        fetch_table(url, "stats", group_by=["Lot"])
+    assert error.value.code == 400
+    assert "Missing parameter" in error.value.reason
+
+
+def test_path_outside_the_qa_directory(url, tmp_path):
+    with pytest.raises(HTTPError) as error:
+        fetch_table(url, "stats", path=str(tmp_path.parent / "issue.gdb"))
+    assert error.value.code == 404
+
+
+def test_aggregate_counts():
+    index = IssueIndex(issues("20241206_03-01-10/issue.gdb"))
+    counts = index.aggregate(index.columns)
+    for group_by in ([], ["Lot"], ["IssueType", "Lot"]):
+        expected = index.aggregate(group_by, IssueType=["Error"])
+        result = aggregate_counts(counts, group_by, IssueType=["Error"])
+        pd.testing.assert_frame_equal(
+            result.reset_index(drop=True), expected, check_dtype=False
+        )
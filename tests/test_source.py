@@ -0,0 +1,168 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from geocover_qa.source import find_increment_gdbs, find_qa_gdbs, scan_directories
+from geocover_qa.utils import parse_increment_gdb, parse_qa_full_path, parse_qa_paths
+from tests.fakes import FakeFileSystem
+
+QA_DIR = "/QA/Vérifications"
+RUNS = [
+    "Topology/RC_2030-12-31/20241205_03-01-10",
+    "Topology/RC_2030-12-31/20241206_03-01-10",
+    "Topology/RC_2030-12-31/20241207_03-01-10",
+    "Topology/RC_2016-12-31/20241207_04-00-00",
+]
+
+
+@pytest.fixture
+def fs():
+    directories = [f"{QA_DIR}/{run}/issue.gdb/tables" for run in RUNS]
+    directories.append(f"{QA_DIR}/Topology/RC_2030-12-31/20241208_03-01-10/logs/old")
+    return FakeFileSystem(directories)
+
+
+def test_scan_directories_matches_and_prunes(fs):
+    found = scan_directories(
+        f"{QA_DIR}/Topology",
+        match=lambda name: name == "issue.gdb",
+        max_workers=2,
+        listdir=fs.listdir,
+    )
+    assert found == sorted(f"{QA_DIR}/{run}/issue.gdb" for run in RUNS)
+
+    # Matching directories are not descended into: no listing of issue.gdb
+    calls = fs.calls
+    pruned = scan_directories(
+        f"{QA_DIR}/Topology",
+        match=lambda name: name == "issue.gdb",
+        prune=lambda name: name.startswith("RC_2016"),
+        listdir=fs.listdir,
+    )
+    assert len(pruned) == 3
+    # Topology, RC_2030-12-31, its 4 runs and logs, but not below issue.gdb
+    assert fs.calls - calls == 1 + 1 + 4 + 1 + 1
+
+
+def test_scan_directories_skips_unlistable_directories(fs):
+    def listdir(path):
+        if path.endswith("20241206_03-01-10"):
+            raise PermissionError(path)
+        return fs.listdir(path)
+
+    found = scan_directories(
+        f"{QA_DIR}/Topology", match=lambda name: name == "issue.gdb", listdir=listdir
+    )
+    assert len(found) == 3
+    assert not any("20241206" in path for path in found)
+    assert scan_directories("/missing", match=bool, listdir=fs.listdir) == []
+
+
+def test_find_qa_gdbs(fs):
+    records = find_qa_gdbs(base_dir=QA_DIR, listdir=fs.listdir)
+    assert [record["date"] for record in records] == [
+        datetime(2024, 12, 7, 3, 1, 10),
+        datetime(2024, 12, 6, 3, 1, 10),
+        datetime(2024, 12, 5, 3, 1, 10),
+    ]
+    assert {record["RC"] for record in records} == {"RC_2030-12-31"}
+    assert {record["QA"] for record in records} == {"Topology"}
+    assert records[0]["week"] == "2024-W49"
+
+    records = find_qa_gdbs(
+        base_dir=QA_DIR,
+        release="RC_2016-12-31",
+        listdir=fs.listdir,
+    )
+    assert len(records) == 1
+
+    records = find_qa_gdbs(
+        base_dir=QA_DIR,
+        start_date=datetime(2024, 12, 6),
+        end_date=datetime(2024, 12, 6, 23),
+        listdir=fs.listdir,
+    )
+    assert [record["date"].day for record in records] == [6]
+
+    records = find_qa_gdbs(base_dir=QA_DIR, last=True, listdir=fs.listdir)
+    assert [record["date"].day for record in records] == [7]
+
+
+def test_find_increment_gdbs():
+    fs = FakeFileSystem(
+        [
+            "/increments/2024/20241001_GCOVERP_2030-12-31.gdb",
+            "/increments/2024/20241101_GCOVERP_2030-12-31.gdb",
+            "/increments/2024/20241101_GCOVERP_2016-12-31.gdb",
+            "/increments/2024/notes",
+        ]
+    )
+    records = find_increment_gdbs(
+        base_dir="/increments", newer_than=datetime(2024, 10, 15), listdir=fs.listdir
+    )
+    assert [os.path.basename(record["file_path"]) for record in records] == [
+        "20241101_GCOVERP_2030-12-31.gdb"
+    ]
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/mnt/share/QA/Vérifications/Topology/RC_2030-12-31/20241207_03-01-10/issue.gdb",
+        r"Q:\QA\Vérifications\Topology\RC_2030-12-31\20241207_03-01-10\issue.gdb",
+        r"\\server\share\QA\Vérifications\Topology\RC_2030-12-31\20241207_03-01-10"
+        r"\issue.gdb",
+    ],
+)
+def test_parse_qa_paths(path):
+    catalog = parse_qa_paths([path])
+    row = catalog.iloc[0]
+    assert row["file_path"] == path
+    assert row["QA"] == "Topology"
+    assert row["RC"] == "RC_2030-12-31"
+    assert row["date"] == datetime(2024, 12, 7, 3, 1, 10)
+    assert row["week"] == "2024-W49"
+    assert row["level"] == 6
+
+
+def test_parse_qa_paths_filters_and_fills():
+    paths = [
+        "/data/RC_2030-12-31/20241207_03-01-10/issue.gdb",
+        "/data/RC_2016-12-31/20241207_03-01-10/issue.gdb",
+    ]
+    catalog = parse_qa_paths(paths, release="RC_2030-12-31", qa_name="Topology")
+    assert catalog["file_path"].tolist() == [paths[0]]
+    assert catalog["QA"].tolist() == ["Topology"]
+    assert catalog["level"].tolist() == [-1]
+
+    catalog = parse_qa_paths(["/data/RC_2030-12-31/not-a-date/issue.gdb"])
+    assert catalog["date"].isna().all()
+
+
+def test_parse_qa_full_path():
+    path = os.path.join(
+        "QA", "Topology", "RC_2030-12-31", "20241207_03-01-10", "issue.gdb"
+    )
+    meta = parse_qa_full_path(path, "RC_2030-12-31", "Topology")
+    assert meta == {
+        "date": datetime(2024, 12, 7, 3, 1, 10),
+        "file_path": path,
+        "RC": "RC_2030-12-31",
+        "QA": "Topology",
+        "week": "2024-W49",
+    }
+    assert parse_qa_full_path(path, "RC_2016-12-31", "Topology") is None
+
+
+def test_parse_increment_gdb():
+    meta = parse_increment_gdb("/backup/20241001_GCOVERP_2030-12-31.gdb.zip")
+    assert meta["date"] == datetime(2024, 10, 1)
+    assert meta["RC"] == "2030-12-31"
+    assert meta["extension"] == "gdb.zip"
+    assert meta["week"] == "2024-W40"
+    assert (
+        parse_increment_gdb("/backup/20241001_GCOVERP_2030-12-31.gdb")["extension"]
+        == "gdb"
+    )
+    assert parse_increment_gdb("/backup/GCOVERP_2030-12-31.gdb") is False
@@ -0,0 +1,63 @@
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import LineString, Point, Polygon, box
+
+from geocover_qa.stat import ALL_SWITZERLAND_LOT, SHARED_LOT, attribute_issues
+
+
+def perimeter():
+    """Two lots side by side, and the whole-Switzerland fallback."""
+    return gpd.GeoDataFrame(
+        {"Lot": [1, 2, ALL_SWITZERLAND_LOT], "MSH_MAP_TITLE": ["Bern", "Thun", "CH"]},
+        geometry=[box(0, 0, 10, 10), box(10, 0, 20, 10), box(-100, -100, 100, 100)],
+        crs="EPSG:2056",
+    )
+
+
+def issues(geometries):
+    return gpd.GeoDataFrame(
+        {"IssueId": range(len(geometries))},
+        geometry=geometries,
+        crs="EPSG:2056",
+        index=range(100, 100 + len(geometries)),
+    )
+
+
+def test_one_row_per_issue():
+    joined = attribute_issues(
+        issues(
+            [
+                box(8, 2, 18, 4),  # Mostly in lot 2
+                LineString([(1, 1), (12, 1)]),  # Mostly in lot 1
+                Point(50, 50),  # Outside the lots
+                Point(500, 500),  # Outside the perimeter
+            ]
+        ),
+        perimeter(),
+    )
+    assert joined.index.tolist() == [100, 101, 102, 103]
+    assert joined["Lot"].tolist()[:3] == [2, 1, ALL_SWITZERLAND_LOT]
+    assert joined["index_right"].tolist()[:3] == [1, 0, 2]
+    assert np.isnan(joined["index_right"].iloc[3])
+    assert joined["IssueId"].tolist() == [0, 1, 2, 3]
+
+
+def test_point_mode():
+    joined = attribute_issues(
+        issues([box(2, 2, 12, 3), box(9, 2, 19, 3)]), perimeter(), mode="point"
+    )
+    assert joined["Lot"].tolist() == [1, 2]
+
+
+def test_invalid_geometries():
+    # Bow-tie over both lots, mostly in lot 2: its intersections need make_valid
+    bowtie = Polygon([(4, 1), (18, 9), (18, 1), (4, 9)])
+    joined = attribute_issues(issues([bowtie, box(2, 2, 12, 3)]), perimeter())
+    assert joined["Lot"].tolist() == [2, 1]
+
+
+def test_shared_issues():
+    joined = attribute_issues(
+        issues([box(5, 2, 15, 4), box(1, 2, 12, 4)]), perimeter(), shared=True
+    )
+    assert joined["Lot"].tolist() == [SHARED_LOT, 1]
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import Point
+
+from geocover_qa.store import count_issues, ingest_issues, is_ingested, query_issues
+
+
+def run_record(day):
+    return {"QA": "Topology", "RC": "RC_2030-12-31", "date": datetime(2024, 12, day, 3)}
+
+
+def combined_issues():
+    """Joined issues of a run: issue 2 lies on two sheets."""
+    return gpd.GeoDataFrame(
+        {
+            "IssueId": [1, 2, 2, 3],
+            "IssueType": ["Error", "Error", "Error", "Warning"],
+            "Code": ["TOP.1", "TOP.1", "TOP.1", "TOP.2"],
+            "CodeDescription": ["Overlap", "Overlap", "Overlap", "Gap"],
+            "QualityCondition": ["qc1", "qc1", "qc1", "qc2"],
+            "Lot": [1.0, 1.0, 2.0, np.nan],
+            "MSH_MAP_TITLE": ["Bern", "Bern", "Thun", None],
+        },
+        geometry=[Point(0, 0), Point(10, 10), Point(10, 10), Point(100, 100)],
+        crs="EPSG:2056",
+    )
+
+
+def test_ingest_and_query(tmp_path):
+    store_dir = str(tmp_path / "store")
+    record = run_record(6)
+    assert not is_ingested(store_dir, record)
+    path = ingest_issues(store_dir, combined_issues(), record)
+    assert path.endswith(
+        "QA=Topology/RC=RC_2030-12-31/run=20241206_03-00-00/issues.parquet"
+    )
+    assert is_ingested(store_dir, record)
+
+    issues = query_issues(store_dir)
+    assert len(issues) == 4
+    assert set(issues["Lot"].dropna()) == {"1", "2"}
+    assert issues["run"].unique().tolist() == ["20241206_03-00-00"]
+    assert issues.crs.to_epsg() == 2056
+
+    selected = query_issues(store_dir, lots=[2])
+    assert selected["IssueId"].tolist() == [2]
+    selected = query_issues(store_dir, bbox=(-1, -1, 11, 11), geometry=True)
+    assert sorted(selected["IssueId"]) == [1, 2, 2]
+    selected = query_issues(store_dir, columns=["IssueId"], geometry=False)
+    assert "geometry" not in selected.columns
+
+
+def test_count_issues(tmp_path):
+    store_dir = str(tmp_path / "store")
+    ingest_issues(store_dir, combined_issues(), run_record(6))
+    ingest_issues(store_dir, combined_issues().iloc[:1], run_record(7))
+
+    counts = count_issues(store_dir, group_by=["run"])
+    assert counts.set_index("run")["IssueCount"].to_dict() == {
+        "20241206_03-00-00": 3,
+        "20241207_03-00-00": 1,
+    }
+    # An issue on two sheets counts once per sheet
+    counts = count_issues(
+        store_dir, group_by=["Sheet"], start_date=datetime(2024, 12, 6)
+    )
+    counts = counts.set_index("Sheet")["IssueCount"]
+    assert counts["Bern"] == 3
+    assert counts["Thun"] == 1
+
+    counts = count_issues(
+        store_dir, group_by=["run"], end_date=datetime(2024, 12, 6, 12)
+    )
+    assert counts["IssueCount"].tolist() == [3]
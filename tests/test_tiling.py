@@ -0,0 +1,52 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.geometry import box
+
+from geocover_qa.geometry import check_layer
+from geocover_qa.tiling import check_layer_tiled
+
+TILE_BUFFER = 100
+
+
+def grid_layer(path, gap):
+    """Layer of 100 m cells over two mapsheets, with `gap` left uncovered."""
+    cells = [
+        shapely.difference(box(x, y, x + 100, y + 100), gap)
+        for x in range(0, 2000, 100)
+        for y in range(0, 1000, 100)
+    ]
+    gdf = gpd.GeoDataFrame(
+        {"UUID": [f"cell{i}" for i in range(len(cells))]},
+        geometry=cells,
+        crs="EPSG:2056",
+    )
+    gdf.to_file(path, layer="GC_BEDROCK", driver="GPKG")
+    return gdf
+
+
+def tiles():
+    sheets = [box(0, 0, 1000, 1000), box(1000, 0, 2000, 1000)]
+    return gpd.GeoDataFrame(
+        geometry=shapely.buffer(sheets, TILE_BUFFER, join_style="mitre"),
+        crs="EPSG:2056",
+    )
+
+
+def gaps(issues):
+    issues = issues[issues["Code"] == "Gap"]
+    return sorted(np.round(issues.geometry.area, 3))
+
+
+def test_gap_crossing_the_tiles_border(tmp_path):
+    # Longer (400 m) than the overlap of the tiles (200 m), 2 m wide
+    gap = box(800, 550, 1200, 552)
+    path = str(tmp_path / "increment.gpkg")
+    gdf = grid_layer(path, gap)
+
+    untiled = check_layer(gdf, "GC_BEDROCK")
+    tiled = check_layer_tiled(path, "GC_BEDROCK", tiles(), max_workers=2)
+
+    assert gaps(untiled) == [800.0]
+    assert gaps(tiled) == gaps(untiled)
+    assert len(tiled) == len(untiled)
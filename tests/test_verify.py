@@ -0,0 +1,100 @@
+import hashlib
+import os
+import zipfile
+
+from geocover_qa import verify as verify_module
+from geocover_qa.verify import (
+    VerificationCache,
+    find_archives,
+    read_sidecar,
+    verify_archive,
+    verify_archives,
+)
+
+
+def write_archive(path, sidecar=True):
+    # Stored: the member data is the bytes of the file, easy to corrupt
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as zipf:
+        zipf.writestr("issue.gdb/a00000001.gdbtable", b"table" * 1000)
+        zipf.writestr("issue.gdb/gdb", b"header")
+    if sidecar:
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()
+        (path.parent / f"{path.name}.sha256").write_text(f"SHA256({path})= {digest}\n")
+    return str(path)
+
+
+def test_read_sidecar(tmp_path):
+    digest = "ab" * 32
+    path = tmp_path / "a.zip.sha256sum"
+    path.write_text(f"{digest.upper()}  a.zip\n")
+    assert read_sidecar(path) == digest
+    path.write_text("no checksum\n")
+    assert read_sidecar(path) is None
+
+
+def test_verify_archive(tmp_path):
+    result = verify_archive(write_archive(tmp_path / "good.zip"))
+    assert result["status"] == "ok"
+    assert result["sidecar"] == "ok"
+    assert result["crc"] == "ok"
+    assert result["directories"] == ["issue.gdb"]
+
+    result = verify_archive(write_archive(tmp_path / "bare.zip", sidecar=False))
+    assert (result["status"], result["sidecar"]) == ("ok", "missing")
+
+    # Corrupted after its checksum was written
+    path = write_archive(tmp_path / "corrupted.zip")
+    data = bytearray(open(path, "rb").read())
+    data[100] ^= 0xFF
+    open(path, "wb").write(bytes(data))
+    result = verify_archive(path)
+    assert result["status"] == "failed"
+    assert result["sidecar"] == "mismatch"
+    assert result["crc"] == "bad"
+
+
+def test_verify_archives_cache(tmp_path):
+    write_archive(tmp_path / "a.zip")
+    write_archive(tmp_path / "b.zip")
+    cache_path = str(tmp_path / "cache.json")
+    paths = find_archives(str(tmp_path))
+    assert len(paths) == 2
+
+    results = verify_archives(paths, cache_path=cache_path, max_workers=2)
+    assert results["status"].tolist() == ["ok", "ok"]
+    verified = results["verified"].tolist()
+
+    # Unchanged archives: the cached results are returned
+    cached = verify_archives(paths, cache_path=cache_path)
+    assert cached["verified"].tolist() == verified
+    # Results with a CRC check also serve the runs without one
+    cached = verify_archives(paths, cache_path=cache_path, check_crc=False)
+    assert cached["crc"].tolist() == ["ok", "ok"]
+
+    write_archive(tmp_path / "b.zip", sidecar=False)
+    (tmp_path / "b.zip.sha256").write_text("0" * 64)
+    results = verify_archives(paths, cache_path=cache_path)
+    assert results["status"].tolist() == ["ok", "failed"]
+
+
+def test_unreadable_archives_are_not_cached(tmp_path, monkeypatch):
+    paths = [write_archive(tmp_path / "a.zip"), write_archive(tmp_path / "b.zip")]
+    cache_path = str(tmp_path / "cache.json")
+
+    def unavailable(path):
+        raise OSError("share unavailable")
+
+    monkeypatch.setattr(verify_module.zipfile, "ZipFile", unavailable)
+    results = verify_archives(paths, cache_path=cache_path)
+    assert results["status"].tolist() == ["failed", "failed"]
+    assert VerificationCache(cache_path).results == {}
+
+    monkeypatch.undo()
+    results = verify_archives(paths, cache_path=cache_path)
+    assert results["status"].tolist() == ["ok", "ok"]
+
+    # Vanished after being listed: reported, and its cached result kept
+    os.remove(paths[1])
+    results = verify_archives(paths, cache_path=cache_path)
+    assert results["status"].tolist() == ["ok", "failed"]
+    assert "b.zip" in results["error"].iloc[1]
@@ -0,0 +1,153 @@
+import json
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from geocover_qa import watch as watch_module
+from geocover_qa.watch import RunProcessor, RunWatcher, load_state, watch
+
+RUN = "RC_2030-12-31/20241207_03-01-10"
+
+
+class StopWatching(Exception):
+    pass
+
+
+def write_run(qa_dir, run=RUN, content=b"table"):
+    gdb_path = os.path.join(qa_dir, *run.split("/"), "issue.gdb")
+    os.makedirs(gdb_path, exist_ok=True)
+    if content is not None:
+        with open(os.path.join(gdb_path, "a00000001.gdbtable"), "wb") as f:
+            f.write(content)
+    return gdb_path
+
+
+def test_poll_waits_for_settled_runs(tmp_path):
+    qa_dir = str(tmp_path / "Topology")
+    gdb_path = write_run(qa_dir)
+    os.makedirs(os.path.join(qa_dir, "RC_2016-12-31", "20241207_03-01-10"))
+    watcher = RunWatcher(qa_dir, release="RC_2030-12-31", settle=60)
+
+    now = time.time()
+    assert watcher.poll(now) == []
+    # Not written to for `settle` seconds
+    assert watcher.poll(now + 61) == [gdb_path]
+    # Reported once
+    assert watcher.poll(now + 122) == []
+
+
+def test_poll_skips_empty_runs(tmp_path):
+    qa_dir = str(tmp_path / "Topology")
+    gdb_path = write_run(qa_dir, content=None)
+    watcher = RunWatcher(qa_dir, settle=60)
+    now = time.time()
+    assert watcher.poll(now) == []
+    assert watcher.poll(now + 3600) == []
+
+    write_run(qa_dir)
+    assert watcher.poll(now + 3600) == [gdb_path]
+
+
+def test_retry_after_a_delay(tmp_path):
+    qa_dir = str(tmp_path / "Topology")
+    gdb_path = write_run(qa_dir)
+    watcher = RunWatcher(qa_dir, settle=0)
+    now = time.time()
+    assert watcher.poll(now) == [gdb_path]
+
+    watcher.retry(gdb_path, delay=10, now=now)
+    assert watcher.poll(now + 5) == []
+    assert watcher.poll(now + 10) == [gdb_path]
+
+
+def test_watch_gives_up_on_failing_runs(tmp_path, monkeypatch):
+    qa_dir = str(tmp_path / "Topology")
+    state_path = str(tmp_path / "watch_state.json")
+    good = write_run(qa_dir, "RC_2030-12-31/20241206_03-01-10")
+    bad = write_run(qa_dir, "RC_2030-12-31/20241207_03-01-10")
+    calls = []
+
+    def process(gdb_path):
+        calls.append(gdb_path)
+        if gdb_path == bad:
+            raise OSError("corrupt issue.gdb")
+
+    polls = []
+
+    def sleep(seconds):
+        polls.append(seconds)
+        if len(polls) == 5:
+            raise StopWatching()
+
+    monkeypatch.setattr(watch_module.time, "sleep", sleep)
+    with pytest.raises(StopWatching):
+        watch(
+            RunWatcher(qa_dir, settle=0),
+            process,
+            state_path,
+            interval=0,
+            skip_existing=False,
+            retry_attempts=3,
+            retry_delay=0,
+        )
+
+    assert calls.count(good) == 1
+    assert calls.count(bad) == 3
+    processed, failed = load_state(state_path)
+    assert processed == [good]
+    assert failed[bad]["attempts"] == 3
+    assert failed[bad]["error"] == "corrupt issue.gdb"
+
+    # Failed runs are not processed again by the next sessions
+    calls.clear()
+    watch(RunWatcher(qa_dir, settle=0), process, state_path, once=True)
+    assert calls == []
+
+
+def processor(output_dir, qa_name):
+    """RunProcessor without the reference layers, unused with a fake get_stats."""
+    processor = RunProcessor.__new__(RunProcessor)
+    processor.__dict__.update(
+        output_dir=output_dir,
+        qa_name=qa_name,
+        lots_in_work=None,
+        table_formats=("csv",),
+        trend_formats=("csv",),
+        maps=False,
+        store_dir=None,
+        attribution="intersects",
+        shared=False,
+        sheets_perimeter_gdf=None,
+    )
+    return processor
+
+
+def test_processor_names_runs_outside_the_qa_hierarchy(tmp_path, monkeypatch):
+    stats = pd.DataFrame({"Lot": [1], "IssueType": ["Error"], "IssueCount": [3]})
+    monkeypatch.setattr(
+        watch_module, "get_stats", lambda *args, **kwargs: (None, stats)
+    )
+    monkeypatch.setattr(watch_module, "plot_trend", lambda *args, **kwargs: None)
+
+    gdb_path = write_run(str(tmp_path / "share"))
+    processor(str(tmp_path), "Topology")(gdb_path)
+    assert os.path.isfile(tmp_path / "2024-12-07_RC_2030-12-31_Topology.csv")
+    trend = pd.read_csv(tmp_path / "trend_RC_2030-12-31_Topology.csv")
+    assert trend["IssueCount"].tolist() == [3]
+
+
+def test_processor_raises_on_unreadable_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(watch_module, "get_stats", lambda *args, **kwargs: None)
+    gdb_path = write_run(str(tmp_path / "share"))
+    with pytest.raises(RuntimeError, match="Cannot compute the stats"):
+        processor(str(tmp_path), "Topology")(gdb_path)
+
+
+def test_state_file(tmp_path):
+    state_path = tmp_path / "watch_state.json"
+    assert load_state(str(state_path)) == ([], {})
+    # State files written before the failed runs were recorded
+    state_path.write_text(json.dumps({"processed": ["a"]}))
+    assert load_state(str(state_path)) == (["a"], {})